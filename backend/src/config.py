@@ -9,6 +9,149 @@ class Settings(BaseSettings):
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379")
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
 
+    # Адреса Steam Web API и Store API (переопределяются, например, для бенчмарков)
+    STEAM_API_URL: str = os.getenv("STEAM_API_URL", "https://api.steampowered.com")
+    STEAM_STORE_URL: str = os.getenv("STEAM_STORE_URL", "https://store.steampowered.com/api")
+
+    # Пул соединений к Steam API
+    STEAM_HTTP2: bool = os.getenv("STEAM_HTTP2", "true").lower() == "true"
+    STEAM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("STEAM_HTTP_MAX_CONNECTIONS", "100"))
+    STEAM_HTTP_MAX_KEEPALIVE: int = int(os.getenv("STEAM_HTTP_MAX_KEEPALIVE", "20"))
+    STEAM_HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("STEAM_HTTP_KEEPALIVE_EXPIRY", "30"))
+
+    # Лимит запросов к Store API (appdetails): запросов в секунду и размер всплеска
+    STEAM_STORE_RATE: float = float(os.getenv("STEAM_STORE_RATE", "2"))
+    STEAM_STORE_BURST: float = float(os.getenv("STEAM_STORE_BURST", "4"))
+    # То же для Web API (GetOwnedGames, GetMostPlayedGames), у каждого endpoint'а свой лимит
+    STEAM_WEBAPI_RATE: float = float(os.getenv("STEAM_WEBAPI_RATE", "20"))
+    STEAM_WEBAPI_BURST: float = float(os.getenv("STEAM_WEBAPI_BURST", "40"))
+    # Лимиты общие для всех воркеров и узлов через Redis (иначе - на процесс).
+    # Фоновые обновления занимают не больше STEAM_RATE_BACKGROUND_SHARE всплеска;
+    # токены берутся пачками до STEAM_RATE_LOCAL_BATCH и живут STEAM_RATE_LOCAL_TTL секунд
+    STEAM_RATE_DISTRIBUTED: bool = os.getenv("STEAM_RATE_DISTRIBUTED", "true").lower() == "true"
+    STEAM_RATE_BACKGROUND_SHARE: float = float(os.getenv("STEAM_RATE_BACKGROUND_SHARE", "0.5"))
+    STEAM_RATE_LOCAL_BATCH: int = int(os.getenv("STEAM_RATE_LOCAL_BATCH", "4"))
+    STEAM_RATE_LOCAL_TTL: float = float(os.getenv("STEAM_RATE_LOCAL_TTL", "1.0"))
+    # Устойчивость вызовов Steam: до STEAM_RETRY_ATTEMPTS попыток с экспоненциальной
+    # задержкой и jitter (Retry-After важнее), всё в пределах STEAM_REQUEST_DEADLINE секунд
+    STEAM_RETRY_ATTEMPTS: int = int(os.getenv("STEAM_RETRY_ATTEMPTS", "3"))
+    STEAM_RETRY_BASE_DELAY: float = float(os.getenv("STEAM_RETRY_BASE_DELAY", "0.5"))
+    STEAM_RETRY_MAX_DELAY: float = float(os.getenv("STEAM_RETRY_MAX_DELAY", "5"))
+    STEAM_REQUEST_DEADLINE: float = float(os.getenv("STEAM_REQUEST_DEADLINE", "10"))
+    # AIMD-лимит одновременных запросов на endpoint: растёт на успехах, вдвое падает на 429
+    STEAM_CONCURRENCY_INITIAL: int = int(os.getenv("STEAM_CONCURRENCY_INITIAL", "16"))
+    STEAM_CONCURRENCY_MIN: int = int(os.getenv("STEAM_CONCURRENCY_MIN", "1"))
+    STEAM_CONCURRENCY_MAX: int = int(os.getenv("STEAM_CONCURRENCY_MAX", "64"))
+    # Предохранитель на endpoint: размыкается после STEAM_BREAKER_FAILURES неудачных
+    # вызовов подряд на STEAM_BREAKER_RESET секунд
+    STEAM_BREAKER_FAILURES: int = int(os.getenv("STEAM_BREAKER_FAILURES", "5"))
+    STEAM_BREAKER_RESET: float = float(os.getenv("STEAM_BREAKER_RESET", "30"))
+
+    # Формат значений кэша в Redis: msgpack | orjson | json, сжатие zstd | lz4 | none
+    # для значений от REDIS_COMPRESS_MIN_BYTES; старые JSON-записи читаются как раньше
+    REDIS_CODEC: str = os.getenv("REDIS_CODEC", "msgpack")
+    REDIS_COMPRESSION: str = os.getenv("REDIS_COMPRESSION", "zstd")
+    REDIS_COMPRESS_MIN_BYTES: int = int(os.getenv("REDIS_COMPRESS_MIN_BYTES", "1024"))
+
+    # In-process L1 кэш перед Redis: TTL задаются по префиксу ключа
+    L1_CACHE_MAX_ITEMS: int = int(os.getenv("L1_CACHE_MAX_ITEMS", "10000"))
+    L1_CACHE_TTLS: str = os.getenv("L1_CACHE_TTLS", "game_details=300,popular_games=60,user_games=30,recommendation_result=60")
+    L1_INVALIDATION_ENABLED: bool = os.getenv("L1_INVALIDATION_ENABLED", "false").lower() == "true"
+    L1_INVALIDATION_CHANNEL: str = os.getenv("L1_INVALIDATION_CHANNEL", "playiter:l1:invalidate")
+    # Single-flight: одна загрузка на ключ кэша, опционально - между воркерами через Redis
+    SINGLEFLIGHT_DISTRIBUTED: bool = os.getenv("SINGLEFLIGHT_DISTRIBUTED", "false").lower() == "true"
+    SINGLEFLIGHT_LOCK_TTL_MS: int = int(os.getenv("SINGLEFLIGHT_LOCK_TTL_MS", "10000"))
+    SINGLEFLIGHT_POLL_INTERVAL: float = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.1"))
+    # Сроки жизни данных Steam: после мягкого срока отдаём устаревшее значение
+    # и обновляем его в фоне, после жёсткого - ключ удаляется из Redis
+    USER_GAMES_SOFT_TTL: int = int(os.getenv("USER_GAMES_SOFT_TTL", "86400"))
+    USER_GAMES_HARD_TTL: int = int(os.getenv("USER_GAMES_HARD_TTL", "259200"))
+    # Профиль предпочтений пользователя живёт дольше библиотеки: при её
+    # обновлении пересчитывается только изменившаяся часть
+    USER_PROFILE_TTL: int = int(os.getenv("USER_PROFILE_TTL", "2592000"))
+    GAME_DETAILS_SOFT_TTL: int = int(os.getenv("GAME_DETAILS_SOFT_TTL", "3600"))
+    GAME_DETAILS_HARD_TTL: int = int(os.getenv("GAME_DETAILS_HARD_TTL", "86400"))
+    POPULAR_GAMES_SOFT_TTL: int = int(os.getenv("POPULAR_GAMES_SOFT_TTL", "7200"))
+    POPULAR_GAMES_HARD_TTL: int = int(os.getenv("POPULAR_GAMES_HARD_TTL", "86400"))
+    SWR_REFRESH_CONCURRENCY: int = int(os.getenv("SWR_REFRESH_CONCURRENCY", "4"))
+    # mmap-снимок каталога игр, общий для воркеров узла (пустой путь - выключен).
+    # Снимок пересобирается из Redis раз в CATALOG_BUILD_INTERVAL секунд
+    # (0 - только вручную), новый файл подхватывается раз в CATALOG_CHECK_INTERVAL,
+    # снимки старше CATALOG_MAX_AGE не используются. Снимок моложе
+    # GAME_DETAILS_SOFT_TTL читается до кэша, более старый - после промаха
+    CATALOG_SNAPSHOT_PATH: str = os.getenv("CATALOG_SNAPSHOT_PATH", "")
+    CATALOG_BUILD_INTERVAL: float = float(os.getenv("CATALOG_BUILD_INTERVAL", "3600"))
+    CATALOG_CHECK_INTERVAL: float = float(os.getenv("CATALOG_CHECK_INTERVAL", "30"))
+    CATALOG_MAX_AGE: float = float(os.getenv("CATALOG_MAX_AGE", "86400"))
+    # mmap-модель совместного владения играми (пустой путь - выключена).
+    # Процесс "python -m backend.src.services.coownership run" дособирает
+    # модель по журналу загрузок библиотек раз в COOWNERSHIP_BUILD_INTERVAL
+    # секунд, воркеры API её только читают; у каждой игры
+    # хранится COOWNERSHIP_TOP_K соседей, пары реже COOWNERSHIP_MIN_SUPPORT
+    # библиотек отбрасываются, из библиотеки берутся COOWNERSHIP_MAX_GAMES
+    # самых сыгранных игр. В рекомендации добавляется до
+    # COOWNERSHIP_CANDIDATES соседей с деталями в кэше
+    COOWNERSHIP_MODEL_PATH: str = os.getenv("COOWNERSHIP_MODEL_PATH", "")
+    COOWNERSHIP_BUILD_INTERVAL: float = float(os.getenv("COOWNERSHIP_BUILD_INTERVAL", "600"))
+    COOWNERSHIP_CHECK_INTERVAL: float = float(os.getenv("COOWNERSHIP_CHECK_INTERVAL", "30"))
+    COOWNERSHIP_MAX_AGE: float = float(os.getenv("COOWNERSHIP_MAX_AGE", "604800"))
+    COOWNERSHIP_TOP_K: int = int(os.getenv("COOWNERSHIP_TOP_K", "50"))
+    COOWNERSHIP_MIN_SUPPORT: int = int(os.getenv("COOWNERSHIP_MIN_SUPPORT", "2"))
+    COOWNERSHIP_MAX_GAMES: int = int(os.getenv("COOWNERSHIP_MAX_GAMES", "100"))
+    COOWNERSHIP_CANDIDATES: int = int(os.getenv("COOWNERSHIP_CANDIDATES", "100"))
+    # Фоновый прогрев каталога: цикл раз в PREFETCH_INTERVAL секунд на одной
+    # реплике (аренда в Redis), не больше PREFETCH_BUDGET_PER_MINUTE запросов
+    # к Steam; обновляются записи, которые устареют в ближайшие
+    # PREFETCH_REFRESH_AHEAD секунд, и игры из PREFETCH_LIBRARY_SAMPLE библиотек
+    PREFETCH_ENABLED: bool = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+    PREFETCH_INTERVAL: float = float(os.getenv("PREFETCH_INTERVAL", "300"))
+    PREFETCH_BUDGET_PER_MINUTE: float = float(os.getenv("PREFETCH_BUDGET_PER_MINUTE", "60"))
+    PREFETCH_CONCURRENCY: int = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+    PREFETCH_REFRESH_AHEAD: float = float(os.getenv("PREFETCH_REFRESH_AHEAD", "600"))
+    PREFETCH_LIBRARY_SAMPLE: int = int(os.getenv("PREFETCH_LIBRARY_SAMPLE", "200"))
+    PREFETCH_LEASE_TTL_MS: int = int(os.getenv("PREFETCH_LEASE_TTL_MS", "60000"))
+    # Как часто (не чаще, секунд) сохранять снимок индекса тегов в Redis
+    TAG_INDEX_SNAPSHOT_INTERVAL: float = float(os.getenv("TAG_INDEX_SNAPSHOT_INTERVAL", "60"))
+    # Алгоритм рекомендаций: scored | legacy | compare (legacy со сверкой против скоринга)
+    RECOMMENDATION_MODE: str = os.getenv("RECOMMENDATION_MODE", "scored")
+    # JSON с весами ScoringWeights, например {"popularity_weight": 0.5}
+    SCORING_WEIGHTS: str = os.getenv("SCORING_WEIGHTS", "")
+    # Кэш готовых рекомендаций: ключ зависит от содержимого входов, так что
+    # TTL лишь ограничивает устаревание деталей игр (0 - кэш выключен)
+    RECOMMENDATION_CACHE_TTL: int = int(os.getenv("RECOMMENDATION_CACHE_TTL", "3600"))
+    # Срок запроса /recommend: заголовок X-Request-Timeout-Ms или параметр timeout_ms,
+    # по умолчанию RECOMMEND_DEADLINE_MS, от RECOMMEND_DEADLINE_MIN_MS до RECOMMEND_DEADLINE_MAX_MS.
+    # Последние RECOMMEND_RANK_RESERVE_MS оставляются на ранжирование того, что успели загрузить
+    RECOMMEND_DEADLINE_MS: int = int(os.getenv("RECOMMEND_DEADLINE_MS", "8000"))
+    RECOMMEND_DEADLINE_MIN_MS: int = int(os.getenv("RECOMMEND_DEADLINE_MIN_MS", "500"))
+    RECOMMEND_DEADLINE_MAX_MS: int = int(os.getenv("RECOMMEND_DEADLINE_MAX_MS", "30000"))
+    RECOMMEND_RANK_RESERVE_MS: int = int(os.getenv("RECOMMEND_RANK_RESERVE_MS", "150"))
+    # Допуск /recommend на воркер: одновременно RECOMMEND_MAX_IN_FLIGHT, ещё до
+    # RECOMMEND_MAX_QUEUE ждут не дольше RECOMMEND_QUEUE_TIMEOUT секунд, остальным - 503
+    RECOMMEND_MAX_IN_FLIGHT: int = int(os.getenv("RECOMMEND_MAX_IN_FLIGHT", "64"))
+    RECOMMEND_MAX_QUEUE: int = int(os.getenv("RECOMMEND_MAX_QUEUE", "128"))
+    RECOMMEND_QUEUE_TIMEOUT: float = float(os.getenv("RECOMMEND_QUEUE_TIMEOUT", "2"))
+    # Пакетные рекомендации: максимум пользователей в запросе, размер пачки
+    # для общего скоринга и число параллельных загрузок библиотек
+    RECOMMEND_BATCH_MAX_USERS: int = int(os.getenv("RECOMMEND_BATCH_MAX_USERS", "1000"))
+    RECOMMEND_BATCH_CHUNK_SIZE: int = int(os.getenv("RECOMMEND_BATCH_CHUNK_SIZE", "50"))
+    RECOMMEND_BATCH_CONCURRENCY: int = int(os.getenv("RECOMMEND_BATCH_CONCURRENCY", "10"))
+    # Хранение метрик рекомендаций: срок (секунд) и максимум записей на пользователя
+    METRICS_RETENTION: int = int(os.getenv("METRICS_RETENTION", "604800"))
+    METRICS_MAX_PER_USER: int = int(os.getenv("METRICS_MAX_PER_USER", "1000"))
+    # Профилирование запросов: доля запросов под сэмплирующим профайлером
+    # и токен заголовка X-Profile, включающего его для одного запроса
+    # (0 и пустой токен - выключено). Профили хранятся PROFILING_TTL секунд,
+    # не больше PROFILING_MAX_STORED последних; /internal/profiles отдаёт их
+    # только с тем же X-Profile (без токена - 404)
+    PROFILING_SAMPLE_RATE: float = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+    PROFILING_TOKEN: str = os.getenv("PROFILING_TOKEN", "")
+    PROFILING_INTERVAL_MS: float = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+    PROFILING_TTL: int = int(os.getenv("PROFILING_TTL", "86400"))
+    PROFILING_MAX_STORED: int = int(os.getenv("PROFILING_MAX_STORED", "200"))
+    # Сколько помнить игры, для которых Steam вернул success: false
+    NEGATIVE_CACHE_TTL: int = int(os.getenv("NEGATIVE_CACHE_TTL", "1800"))
+
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
@@ -1,14 +1,64 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import time
+from contextlib import asynccontextmanager, suppress
+
+from typing import AsyncIterator, Dict, Literal, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
 from .services.steam import steam_service
-from .utils.recommendations import get_recommendations
+from .services.library import user_libraries
+from .models.game import BatchRecommendationRequest
+from .utils.recommendations import get_recommendations_async, iter_batch_recommendations, iter_recommendations
 from .services.auth import router as auth_router
 from .services.redis import redis_service
+from .services.http import close_http_client
+from .services.catalog import catalog_store, run_catalog_builder
+from .services.coownership import coownership_store
+from .services.prefetch import prefetcher
+from .config import settings
+from .utils.tag_index import tag_index
+from .utils.deadline import deadline_after
+from .utils.instrumentation import registry, start_trace
+from .utils.fragments import FragmentJSONResponse, detail_fragment, encode, game_fragment
+from .utils.profiling import ProfilingMiddleware, token_matches
+from .utils.resilience import AdmissionController, Overloaded
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tasks = []
+    if settings.L1_INVALIDATION_ENABLED:
+        tasks.append(asyncio.create_task(redis_service.listen_invalidations()))
+    if catalog_store.enabled:
+        catalog_store.reload()
+        if settings.CATALOG_BUILD_INTERVAL > 0:
+            tasks.append(asyncio.create_task(
+                run_catalog_builder(catalog_store.path, settings.CATALOG_BUILD_INTERVAL)
+            ))
+    # Модель собирает отдельный процесс (coownership run), воркер только читает файл
+    if coownership_store.enabled:
+        coownership_store.reload()
+    await tag_index.load_snapshot()
+    if settings.PREFETCH_ENABLED:
+        tasks.append(asyncio.create_task(prefetcher.run_forever(settings.PREFETCH_INTERVAL)))
+    yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await tag_index.save_snapshot(force=True)
+    # Закрываем пулы соединений текущего event loop
+    await close_http_client()
+    await redis_service.close_async()
+
 
 app = FastAPI(
     title="Playiter",
-    version="1.0.3"
+    version="1.0.3",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -16,7 +66,9 @@ app.add_middleware(
     allow_origins=["http://localhost:3000", "http://frontend:3000"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
+app.add_middleware(ProfilingMiddleware)
 
 app.include_router(auth_router)
 
@@ -26,22 +78,39 @@ async def root():
     return {
         "service": "Playiter",
         "endpoints": {
-            "user_info": "/user/{steam_id}",
+            "user_info": "/user/{steam_id}?sort=recent|playtime&order=desc|asc&min_playtime_hours=&cursor=",
             "game_info": "/game/{appid}",
-            "recommendations": "/recommend/{steam_id}"
+            "recommendations": "/recommend/{steam_id}",
+            "recommendations_stream": "/recommend/{steam_id}/stream?format=ndjson|sse",
+            "batch_recommendations": "POST /recommend/batch"
         }
     }
 
 
 @app.get("/user/{steam_id}")
-async def get_user_info(steam_id: str):
-    games = steam_service.get_user_games(steam_id)
-    if not games:
+async def get_user_info(
+        steam_id: str,
+        sort: Literal["recent", "playtime"] = "recent",
+        order: Literal["desc", "asc"] = "desc",
+        min_playtime_hours: int = Query(0, ge=0),
+        cursor: Optional[str] = None,
+        limit: int = Query(20, ge=1, le=100)
+):
+    """Страница библиотеки из индексов: sort - по последнему запуску или времени
+    в игре, cursor - из next_cursor предыдущей страницы
+    """
+    try:
+        page = await user_libraries.page_async(
+            steam_id, sort, order == "desc", min_playtime_hours * 60, cursor, limit
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if page is None:
         raise HTTPException(status_code=404, detail="User not found or no games")
 
     return {
         "steam_id": steam_id,
-        "game_count": len(games),
+        "game_count": page.game_count,
         "recent_games": [
             {
                 "appid": g['appid'],
@@ -49,71 +118,289 @@ async def get_user_info(steam_id: str):
                 "playtime_hours": g.get('playtime_forever', 0) // 60,
                 "last_played": g.get('rtime_last_played', 0)
             }
-            for g in sorted(games, key=lambda x: x.get('rtime_last_played', 0), reverse=True)[:20]
-        ]
+            for g in page.games
+        ],
+        "next_cursor": page.next_cursor
     }
 
 
 @app.get("/game/{appid}")
 async def get_game_info(appid: int):
-    game = steam_service.get_game_details(appid)
+    game = await steam_service.get_game_details_async(appid)
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
 
-    return game.dict()
+    return FragmentJSONResponse(detail_fragment(game))
+
+
+recommend_admission = AdmissionController(
+    settings.RECOMMEND_MAX_IN_FLIGHT, settings.RECOMMEND_MAX_QUEUE, settings.RECOMMEND_QUEUE_TIMEOUT
+)
+admission_rejected = registry.counter(
+    "playiter_admission_rejected_total", "Recommendation requests rejected with 503", ("endpoint",)
+)
+registry.gauge(
+    "playiter_admission_requests", "Recommendation requests in flight and waiting for a slot",
+    lambda: {("in_flight",): recommend_admission.slots.in_flight, ("queued",): recommend_admission.waiting},
+    ("state",)
+)
+
+
+def _request_deadline(request: Request, timeout_ms: Optional[int]) -> float:
+    """Срок запроса: параметр timeout_ms, заголовок X-Request-Timeout-Ms или значение по умолчанию"""
+    if timeout_ms is None and request.headers.get("X-Request-Timeout-Ms"):
+        try:
+            timeout_ms = int(request.headers["X-Request-Timeout-Ms"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout-Ms must be an integer")
+    if timeout_ms is None:
+        timeout_ms = settings.RECOMMEND_DEADLINE_MS
+    timeout_ms = min(max(timeout_ms, settings.RECOMMEND_DEADLINE_MIN_MS), settings.RECOMMEND_DEADLINE_MAX_MS)
+    return deadline_after(timeout_ms / 1000)
+
+
+async def _admit(endpoint: str, deadline: float) -> float:
+    """Ждёт слот обработки, пока позволяет срок; перегрузка - 503 с Retry-After.
+    Возвращает момент начала обработки
+    """
+    try:
+        await recommend_admission.acquire(deadline - time.monotonic())
+    except Overloaded as e:
+        admission_rejected.inc(endpoint)
+        raise HTTPException(
+            status_code=503,
+            detail="Too many recommendation requests, retry later",
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+    return time.monotonic()
 
 
 @app.get("/recommend/{steam_id}")
-async def get_game_recommendations(steam_id: str):
+async def get_game_recommendations(steam_id: str, request: Request, timeout_ms: Optional[int] = None):
+    deadline = _request_deadline(request, timeout_ms)
+    started = await _admit("recommend", deadline)
     try:
-        recommendations, metrics = get_recommendations(steam_id)
+        recommendations, metrics = await get_recommendations_async(steam_id, deadline=deadline)
 
         # Сохраняем метрики в Redis
-        metrics_key = f"metrics:{steam_id}:{int(metrics.timestamp)}"
-        redis_service.cache_data(metrics_key, metrics.dict(), ttl=604800)
+        await redis_service.add_metrics_async(steam_id, metrics.timestamp, metrics.dict())
 
-        return {
+        return FragmentJSONResponse({
             "steam_id": steam_id,
-            "recommendations": [
-                {
-                    "name": game.name,
-                    "appid": game.steam_appid,
-                    "categories": game.categories,
-                    "genres": game.genres,
-                    "recommendations": game.recommendations,
-                    "release_year": game.release_year,
-                    "store_url": f"https://store.steampowered.com/app/{game.steam_appid}"
-                }
-                for game in recommendations
-            ],
+            "recommendations": [game_fragment(game) for game in recommendations],
             "count": len(recommendations),
-            "metrics": metrics.metrics
-        }
+            "cache_hit": bool(metrics.metrics.get("result_cache_hit")),
+            "partial": bool(metrics.metrics.get("partial")),
+            "metrics": metrics.metrics,
+            "stages": metrics.stages
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        recommend_admission.release(time.monotonic() - started)
+
+
+async def _until_disconnect(request: Request, events: AsyncIterator) -> AsyncIterator:
+    """Прокачивает события через очередь на один элемент: конвейер не убегает
+    вперёд медленного клиента, а при отключении клиента отменяется вместе
+    с незавершёнными запросами к Steam
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    finished = object()
+
+    async def produce():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await events.aclose()
+        await queue.put(finished)
+
+    async def watch():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        producer.cancel()
+
+    producer = asyncio.ensure_future(produce())
+    watcher = asyncio.ensure_future(watch())
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                # Конвейер завершён или отменён отключением клиента
+                getter.cancel()
+                break
+            item = getter.result()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        watcher.cancel()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Потоковый ответ, занявший слот допуска: слот освобождается, когда ответ
+    завершён, даже если клиент ушёл до первого чанка и генератор не запускался
+    """
+
+    def __init__(self, started: float, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = started
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            recommend_admission.release(time.monotonic() - self.started)
+
+
+def _format_event(event: Dict, fmt: str) -> bytes:
+    if fmt == "sse":
+        return b"event: " + event["event"].encode() + b"\ndata: " + encode(event) + b"\n\n"
+    return encode(event) + b"\n"
+
+
+@app.get("/recommend/{steam_id}/stream")
+async def stream_game_recommendations(
+        steam_id: str,
+        request: Request,
+        format: str = "ndjson",
+        timeout_ms: Optional[int] = None
+):
+    """Рекомендации потоком NDJSON или SSE (format=sse).
+
+    Порядок событий: library (топ сыгранных игр), preferences, ноль или больше match (кандидаты
+    по мере загрузки), ranking (итоговый порядок), metrics.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or sse")
+    deadline = _request_deadline(request, timeout_ms)
+    started = await _admit("stream", deadline)
+
+    async def events():
+        async for event in _until_disconnect(request, iter_recommendations(steam_id, deadline=deadline)):
+            if event["event"] == "match":
+                if event["games"]:
+                    yield _format_event({
+                        "event": "match",
+                        "games": [game_fragment(game) for game in event["games"]]
+                    }, format)
+            elif event["event"] == "result":
+                recommendations, metrics = event["recommendations"], event["metrics"]
+                yield _format_event({
+                    "event": "ranking",
+                    "recommendations": [game_fragment(game) for game in recommendations],
+                    "count": len(recommendations),
+                    "cache_hit": bool(metrics.metrics.get("result_cache_hit")),
+                    "partial": bool(metrics.metrics.get("partial"))
+                }, format)
+                await redis_service.add_metrics_async(steam_id, metrics.timestamp, metrics.dict())
+                yield _format_event({"event": "metrics", "metrics": metrics.metrics, "stages": metrics.stages}, format)
+            else:
+                yield _format_event(event, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    # Без буферизации в прокси, иначе первые события не дойдут до клиента сразу
+    return AdmittedStreamingResponse(
+        started, events(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/recommend/batch")
+async def get_batch_recommendations(batch: BatchRecommendationRequest, request: Request):
+    """Рекомендации для списка пользователей потоком NDJSON.
+
+    Строка на пользователя по мере готовности (status: ok | empty | error),
+    последняя строка - сводка пакета.
+    """
+    if not batch.steam_ids:
+        raise HTTPException(status_code=400, detail="steam_ids must not be empty")
+    if len(batch.steam_ids) > settings.RECOMMEND_BATCH_MAX_USERS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.RECOMMEND_BATCH_MAX_USERS} steam_ids per batch"
+        )
+
+    async def stream():
+        start_time = time.time()
+        trace = start_trace()
+        statuses = {"ok": 0, "empty": 0, "error": 0}
+        async for result in _until_disconnect(request, iter_batch_recommendations(batch.steam_ids)):
+            statuses[result.status] += 1
+            yield encode({
+                "steam_id": result.steam_id,
+                "status": result.status,
+                "recommendations": [game_fragment(game) for game in result.recommendations],
+                "count": len(result.recommendations),
+                "error": result.error
+            }) + b"\n"
+        yield encode({
+            "summary": {
+                "users": sum(statuses.values()),
+                **statuses,
+                "execution_time": time.time() - start_time,
+                "stages": {stage: round(seconds, 6) for stage, seconds in trace.stages.items()}
+            }
+        }) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 
 @app.get("/metrics/{steam_id}")
 async def get_recommendation_metrics(steam_id: str, limit: int = 10):
     try:
-        pattern = f"metrics:{steam_id}:*"
-        keys = redis_service.client.keys(pattern)
+        metrics = await redis_service.get_recent_metrics_async(steam_id, limit)
 
-        if not keys:
+        if not metrics:
             return {"message": "No metrics found for this user"}
 
-        keys = sorted(keys, reverse=True)[:limit]
-        metrics = []
-
-        for key in keys:
-            data = redis_service.get_cached_data(key)
-            if data:
-                metrics.append(data)
-
         return {
             "steam_id": steam_id,
             "count": len(metrics),
             "metrics": metrics
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/internal/metrics", response_class=PlainTextResponse)
+async def get_internal_metrics():
+    """Метрики процесса в формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def _require_profiling_token(x_profile: Optional[str] = Header(None)) -> None:
+    """Профили показывают пути кода: отдаём их только с X-Profile, равным PROFILING_TOKEN"""
+    if not settings.PROFILING_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token_matches(x_profile):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+@app.get("/internal/profiles", dependencies=[Depends(_require_profiling_token)])
+async def get_request_profiles(limit: int = Query(50, ge=1, le=1000)):
+    """Последние профили запросов без стеков"""
+    profiles = await redis_service.get_recent_profiles_async(limit)
+    return {"count": len(profiles), "profiles": profiles}
+
+
+@app.get(
+    "/internal/profiles/{profile_id}",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(_require_profiling_token)]
+)
+async def get_request_profile(profile_id: str):
+    """Стеки профиля в collapsed-формате для flamegraph.pl и speedscope"""
+    profile = await redis_service.get_profile_async(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(
+        profile["stacks"],
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed"'}
+    )
@@ -1,6 +1,5 @@
-from dataclasses import Field
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 
 class Game(BaseModel):
     steam_appid: int
@@ -13,12 +12,133 @@ class Game(BaseModel):
     def __str__(self):
         return f"{self.name} (ID: {self.steam_appid})"
 
-class RecommendationMetrics(BaseModel):
-    user_id: str
-    timestamp: float
-    execution_time: float
-    input_games_count: int
-    recommended_games_count: int
-    categories_used: List[str]
-    genres_used: List[str]
-    metrics: Dict[str, Any]
\ No newline at end of file
+class GameRecord:
+    """Game на горячем пути: без валидации pydantic, с готовыми JSON-фрагментами
+    для ответов (bytes), которые хранятся рядом с деталями в кэше: fragment -
+    игра в рекомендациях, detail_fragment - ответ /game
+    """
+    __slots__ = (
+        "steam_appid", "name", "categories", "genres", "recommendations", "release_year",
+        "fragment", "detail_fragment"
+    )
+
+    def __init__(
+            self,
+            steam_appid: int,
+            name: str,
+            categories: Optional[List[str]] = None,
+            genres: Optional[List[str]] = None,
+            recommendations: int = 0,
+            release_year: Optional[int] = None,
+            fragment: Optional[bytes] = None,
+            detail_fragment: Optional[bytes] = None
+    ):
+        self.steam_appid = steam_appid
+        self.name = name
+        self.categories = categories if categories is not None else []
+        self.genres = genres if genres is not None else []
+        self.recommendations = recommendations
+        self.release_year = release_year
+        self.fragment = fragment
+        self.detail_fragment = detail_fragment
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GameRecord":
+        """Из словаря кэша (Game.dict() и, возможно, строки fragment и detail_fragment)"""
+        fragment = data.get("fragment")
+        detail_fragment = data.get("detail_fragment")
+        return cls(
+            data["steam_appid"],
+            data["name"],
+            data.get("categories"),
+            data.get("genres"),
+            data.get("recommendations", 0),
+            data.get("release_year"),
+            fragment.encode() if fragment else None,
+            detail_fragment.encode() if detail_fragment else None
+        )
+
+    def dict(self) -> Dict[str, Any]:
+        """Поля в том же виде, что и Game.dict()"""
+        return {
+            "steam_appid": self.steam_appid,
+            "name": self.name,
+            "categories": self.categories,
+            "genres": self.genres,
+            "recommendations": self.recommendations,
+            "release_year": self.release_year,
+        }
+
+    def __eq__(self, other):
+        if isinstance(other, (GameRecord, Game)):
+            return self.dict() == other.dict()
+        return NotImplemented
+
+    def __str__(self):
+        return f"{self.name} (ID: {self.steam_appid})"
+
+    def __repr__(self):
+        return f"GameRecord({self.steam_appid!r}, {self.name!r})"
+
+
+class RecommendationMetrics:
+    """Метрики расчёта рекомендаций; создаются на каждый запрос, поэтому без pydantic"""
+    __slots__ = (
+        "user_id", "timestamp", "execution_time", "input_games_count", "recommended_games_count",
+        "categories_used", "genres_used", "metrics", "stages"
+    )
+
+    def __init__(
+            self,
+            user_id: str,
+            timestamp: float,
+            execution_time: float,
+            input_games_count: int,
+            recommended_games_count: int,
+            categories_used: List[str],
+            genres_used: List[str],
+            metrics: Dict[str, Any],
+            stages: Optional[Dict[str, float]] = None
+    ):
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.execution_time = execution_time
+        self.input_games_count = input_games_count
+        self.recommended_games_count = recommended_games_count
+        self.categories_used = categories_used
+        self.genres_used = genres_used
+        self.metrics = metrics
+        # Длительность этапов конвейера, секунды
+        self.stages = stages if stages is not None else {}
+
+    def dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class BatchRecommendation:
+    """Результат пакетных рекомендаций для одного пользователя; как и
+    RecommendationMetrics, создаётся на каждого пользователя пакета, поэтому без pydantic
+    """
+    __slots__ = ("steam_id", "status", "recommendations", "scores", "error")
+
+    def __init__(
+            self,
+            steam_id: str,
+            status: str,
+            recommendations: Optional[List[Union[GameRecord, Game]]] = None,
+            scores: Optional[Dict[int, float]] = None,
+            error: Optional[str] = None
+    ):
+        self.steam_id = steam_id
+        # ok | empty (нет сыгранных игр) | error
+        self.status = status
+        self.recommendations = recommendations if recommendations is not None else []
+        self.scores = scores if scores is not None else {}
+        self.error = error
+
+    def dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class BatchRecommendationRequest(BaseModel):
+    steam_ids: List[str]
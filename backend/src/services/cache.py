@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+# Значение, которым в кэше помечаются игры, для которых Steam вернул success: false
+NEGATIVE_MARKER = {"__negative__": True}
+
+# Ключ конверта stale-while-revalidate: {"__swr__": <мягкий срок, unix time>, "value": ...}
+SWR_FIELD = "__swr__"
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    stale: bool
+
+
+def is_negative(value: Any) -> bool:
+    return isinstance(value, dict) and value.get("__negative__") is True
+
+
+def wrap_swr(value: Any, soft_ttl: Optional[float]) -> Any:
+    """Оборачивает значение в конверт с мягким сроком годности"""
+    if soft_ttl is None:
+        return value
+    return {SWR_FIELD: time.time() + soft_ttl, "value": value}
+
+
+def unwrap_swr(raw: Any) -> CacheEntry:
+    """Достаёт значение из конверта; записи без конверта считаются свежими"""
+    if isinstance(raw, dict) and SWR_FIELD in raw:
+        return CacheEntry(raw.get("value"), raw[SWR_FIELD] <= time.time())
+    return CacheEntry(raw, False)
+
+
+def parse_namespace_ttls(raw: str) -> Dict[str, float]:
+    """Разбирает строку вида "game_details=300,popular_games=60" """
+    ttls = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        namespace, ttl = item.split("=", 1)
+        ttls[namespace.strip()] = float(ttl)
+    return ttls
+
+
+def key_namespace(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+class LocalCache:
+    """In-process L1 кэш с LRU-вытеснением и TTL по пространствам имён.
+
+    Кэшируются только ключи из namespace_ttls. Срок жизни записи - минимум
+    из TTL пространства и оставшегося TTL в Redis, так что L1 никогда не
+    переживает L2. Значения отдаются без копирования и должны считаться
+    read-only.
+    """
+
+    def __init__(self, max_items: int, namespace_ttls: Dict[str, float]):
+        self.max_items = max_items
+        self.namespace_ttls = namespace_ttls
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ttl_for(self, key: str, redis_ttl: Optional[float] = None) -> float:
+        ttl = self.namespace_ttls.get(key_namespace(key), 0)
+        if redis_ttl is not None:
+            ttl = min(ttl, redis_ttl)
+        return ttl
+
+    def caches(self, key: str) -> bool:
+        return key_namespace(key) in self.namespace_ttls
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        if not self.caches(key):
+            return False, None
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return False, None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                self.misses += 1
+                return False, None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key: str, value: Any, redis_ttl: Optional[float] = None) -> None:
+        ttl = self.ttl_for(key, redis_ttl)
+        if ttl <= 0 or self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,335 @@
+"""Снимок каталога игр в бинарном файле, общий для воркеров узла через mmap.
+
+Формат (little-endian):
+    заголовок  HEADER
+    тэги       TAG_ENTRY на тег: смещение и длина названия в куче
+    записи     RECORD на игру фиксированной ширины
+    индекс     u32 на слот: открытая адресация по appid, 0 - пустой слот,
+               иначе номер записи + 1
+    куча       названия игр и тегов (UTF-8), списки id тегов (u16) и
+               JSON-фрагменты игр для рекомендаций и ответа /game
+
+Сборка: python -m backend.src.services.catalog build [path]
+"""
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from ..config import settings
+from ..models.game import Game, GameRecord
+from ..utils.fragments import detail_fragment, game_fragment
+from ..utils.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PLCATLG\x00"
+FORMAT_VERSION = 3
+# magic, версия, игр, тегов, слотов индекса, время сборки, смещения секций, размер кучи
+HEADER = struct.Struct("<8sIIIId5Q")
+TAG_ENTRY = struct.Struct("<IH")
+# appid, отзывы, смещение и длина названия, смещение списка тегов,
+# год выпуска (0 - нет), число категорий и жанров, смещения и длины фрагментов
+# для рекомендаций и для /game
+RECORD = struct.Struct("<IIIHxxIHBBIIII")
+SLOT = struct.Struct("<I")
+TAG_ID = struct.Struct("<H")
+
+_HASH_MULTIPLIER = 2654435761
+
+
+def _slot(appid: int, mask: int) -> int:
+    return ((appid * _HASH_MULTIPLIER) & 0xFFFFFFFF) & mask
+
+
+def _encode_limited(text: str, limit: int = 0xFFFF) -> bytes:
+    """UTF-8 не длиннее limit байт, обрезанный по границе символа"""
+    encoded = text.encode()
+    if len(encoded) <= limit:
+        return encoded
+    return encoded[:limit].decode("utf-8", "ignore").encode()
+
+
+def build_catalog_snapshot(games: Iterable[Game], path: str) -> int:
+    """Пишет снимок во временный файл и атомарно подменяет им path.
+
+    Возвращает число игр в снимке.
+    """
+    unique = {game.steam_appid: game for game in games}
+    records = [unique[appid] for appid in sorted(unique)]
+
+    heap = bytearray()
+    tag_ids: Dict[str, int] = {}
+    tags: List[bytes] = []
+
+    def intern(tag: str) -> int:
+        if tag not in tag_ids:
+            tag_ids[tag] = len(tags)
+            tags.append(_encode_limited(tag))
+        return tag_ids[tag]
+
+    packed_records = []
+    for game in records:
+        name = _encode_limited(game.name)
+        name_offset = len(heap)
+        heap += name
+        tags_offset = len(heap)
+        for tag in list(game.categories[:255]) + list(game.genres[:255]):
+            heap += TAG_ID.pack(intern(tag))
+        fragment = game_fragment(game)
+        fragment_offset = len(heap)
+        heap += fragment
+        detail = detail_fragment(game)
+        detail_offset = len(heap)
+        heap += detail
+        packed_records.append(RECORD.pack(
+            game.steam_appid, min(max(game.recommendations, 0), 0xFFFFFFFF),
+            name_offset, len(name), tags_offset, game.release_year or 0,
+            min(len(game.categories), 255), min(len(game.genres), 255),
+            fragment_offset, len(fragment), detail_offset, len(detail)
+        ))
+
+    tag_entries = []
+    for tag in tags:
+        tag_entries.append(TAG_ENTRY.pack(len(heap), len(tag)))
+        heap += tag
+
+    capacity = 1
+    while capacity < max(2 * len(records), 8):
+        capacity *= 2
+    slots = [0] * capacity
+    for index, game in enumerate(records):
+        slot = _slot(game.steam_appid, capacity - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (capacity - 1)
+        slots[slot] = index + 1
+
+    tags_offset = HEADER.size
+    records_offset = tags_offset + TAG_ENTRY.size * len(tags)
+    index_offset = records_offset + RECORD.size * len(records)
+    heap_offset = index_offset + SLOT.size * capacity
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(records), len(tags), capacity, time.time(),
+        tags_offset, records_offset, index_offset, heap_offset, len(heap)
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".catalog-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(b"".join(tag_entries))
+            f.write(b"".join(packed_records))
+            f.write(struct.pack(f"<{capacity}I", *slots))
+            f.write(heap)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(records)
+
+
+class _Snapshot:
+    """Открытый снимок; не меняется после создания, поэтому читается без блокировок"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        (magic, version, self.count, tag_count, self.capacity, self.created_at,
+         tags_offset, self.records_offset, self.index_offset, self.heap_offset, _) = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported catalog snapshot {path}")
+        # Словарь тегов маленький - раскодируем его один раз
+        self.tags = []
+        for position in range(tag_count):
+            offset, length = TAG_ENTRY.unpack_from(self.buffer, tags_offset + position * TAG_ENTRY.size)
+            start = self.heap_offset + offset
+            self.tags.append(self.buffer[start:start + length].decode())
+
+    def find(self, appid: int) -> Optional[int]:
+        mask = self.capacity - 1
+        slot = _slot(appid, mask)
+        for _ in range(self.capacity):
+            entry = SLOT.unpack_from(self.buffer, self.index_offset + slot * SLOT.size)[0]
+            if not entry:
+                return None
+            if SLOT.unpack_from(self.buffer, self.records_offset + (entry - 1) * RECORD.size)[0] == appid:
+                return entry - 1
+            slot = (slot + 1) & mask
+        return None
+
+    def game(self, index: int) -> GameRecord:
+        (appid, recommendations, name_offset, name_length, tags_offset, release_year,
+         categories, genres, fragment_offset, fragment_length, detail_offset, detail_length) = RECORD.unpack_from(
+            self.buffer, self.records_offset + index * RECORD.size
+        )
+        start = self.heap_offset + name_offset
+        ids = struct.unpack_from(f"<{categories + genres}H", self.buffer, self.heap_offset + tags_offset)
+        fragment = self.heap_offset + fragment_offset
+        detail = self.heap_offset + detail_offset
+        return GameRecord(
+            steam_appid=appid,
+            name=self.buffer[start:start + name_length].decode(),
+            categories=[self.tags[tag_id] for tag_id in ids[:categories]],
+            genres=[self.tags[tag_id] for tag_id in ids[categories:]],
+            recommendations=recommendations,
+            release_year=release_year or None,
+            fragment=self.buffer[fragment:fragment + fragment_length],
+            detail_fragment=self.buffer[detail:detail + detail_length]
+        )
+
+
+class CatalogStore:
+    """Read-only каталог игр из mmap-снимка.
+
+    Страницы файла общие для всех процессов узла. Новый снимок, атомарно
+    подменённый на диске, подхватывается не чаще раза в check_interval
+    секунд; снимки старше max_age не используются.
+    """
+
+    def __init__(self, path: str, check_interval: float = 30.0, max_age: float = 86400.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._snapshot: Optional[_Snapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def reload(self) -> bool:
+        """Перечитывает снимок, если файл на диске сменился"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._snapshot = None
+                return False
+            current = self._snapshot
+            if current is not None and current.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                return False
+            try:
+                snapshot = _Snapshot(self.path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Failed to load catalog snapshot: {e}")
+                return False
+            # Старый mmap закроется сам, когда его перестанут читать
+            self._snapshot = snapshot
+            return True
+
+    def _current(self) -> Optional[_Snapshot]:
+        if not self.enabled:
+            return None
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot.created_at > self.max_age:
+            return None
+        return snapshot
+
+    def age(self) -> float:
+        """Возраст используемого снимка в секундах; inf - снимка нет"""
+        snapshot = self._current()
+        return time.time() - snapshot.created_at if snapshot is not None else float("inf")
+
+    def get(self, appid: int) -> Optional[GameRecord]:
+        snapshot = self._current()
+        if snapshot is None:
+            return None
+        index = snapshot.find(appid)
+        return snapshot.game(index) if index is not None else None
+
+    def __len__(self) -> int:
+        snapshot = self._snapshot
+        return snapshot.count if snapshot is not None else 0
+
+
+async def load_games_from_redis(batch_size: int = 500) -> List[GameRecord]:
+    """Все игры с деталями из Redis: SCAN по game_details:* и MGET пачками"""
+    from ..services.redis import redis_service
+    from ..services.steam import steam_service
+
+    keys = await redis_service.get_keys_by_pattern_async("game_details:*")
+    games = []
+    for offset in range(0, len(keys), batch_size):
+        batch = [key.decode() if isinstance(key, bytes) else key for key in keys[offset:offset + batch_size]]
+        for value in await redis_service.get_many_cached_data_async(batch):
+            game = steam_service._game_from_cache(value)
+            if game is not None:
+                games.append(game)
+    return games
+
+
+async def rebuild_catalog(path: str) -> Optional[int]:
+    """Пересобирает снимок из Redis; за сборку на узле отвечает один процесс"""
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            games = await load_games_from_redis()
+            return await asyncio.get_running_loop().run_in_executor(None, build_catalog_snapshot, games, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+async def run_catalog_builder(path: str, interval: float) -> None:
+    """Периодическая пересборка снимка (задача lifespan)"""
+    while True:
+        try:
+            count = await rebuild_catalog(path)
+            if count is not None:
+                catalog_store.reload()
+                logger.info(f"Catalog snapshot rebuilt: {count} games")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Catalog snapshot build failed: {e}")
+        await asyncio.sleep(interval)
+
+
+catalog_store = CatalogStore(
+    settings.CATALOG_SNAPSHOT_PATH,
+    settings.CATALOG_CHECK_INTERVAL,
+    settings.CATALOG_MAX_AGE
+)
+
+registry.gauge(
+    "playiter_catalog_games", "Games in the memory-mapped catalog snapshot",
+    lambda: {(): len(catalog_store)}
+)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print("usage: python -m backend.src.services.catalog build [path]", file=sys.stderr)
+        sys.exit(2)
+    target = sys.argv[2] if len(sys.argv) > 2 else settings.CATALOG_SNAPSHOT_PATH
+    if not target:
+        print("CATALOG_SNAPSHOT_PATH is not set", file=sys.stderr)
+        sys.exit(2)
+    built = build_catalog_snapshot(asyncio.run(load_games_from_redis()), target)
+    print(f"{built} games written to {target}")
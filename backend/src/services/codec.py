@@ -0,0 +1,190 @@
+import importlib.util
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .cache import SWR_FIELD, key_namespace
+
+# Опциональные зависимости: без них codec откатывается на json и без сжатия
+MSGPACK_AVAILABLE = importlib.util.find_spec("msgpack") is not None
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+LZ4_AVAILABLE = importlib.util.find_spec("lz4") is not None
+
+# Заголовок записи: MAGIC, версия формата, сериализатор, сжатие, раскладка.
+# Старые записи - JSON-текст, он не может начинаться с нулевого байта
+MAGIC = b"\x00"
+FORMAT_VERSION = 1
+HEADER_SIZE = 5
+
+SERIALIZERS = {"json": 0, "msgpack": 1, "orjson": 2}
+COMPRESSIONS = {"none": 0, "zstd": 1, "lz4": 2}
+# Раскладка значения: как есть или список записей в виде колонок
+LAYOUT_PLAIN = 0
+LAYOUT_COLUMNAR = 1
+
+# Поля, которые backend читает из кэшированных значений пространства имён
+DEFAULT_PROJECTIONS: Dict[str, Tuple[str, ...]] = {
+    "user_games": ("appid", "name", "playtime_forever", "rtime_last_played"),
+}
+
+
+def _serializer(name: str) -> Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]:
+    if name == "msgpack":
+        import msgpack
+        return (
+            lambda value: msgpack.packb(value, use_bin_type=True),
+            lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False),
+        )
+    if name == "orjson":
+        import orjson
+        return (lambda value: orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+    return (lambda value: json.dumps(value, separators=(",", ":")).encode(), json.loads)
+
+
+def _compressor(name: str) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    if name == "zstd":
+        import zstandard
+        compressor, decompressor = zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor()
+        return compressor.compress, decompressor.decompress
+    if name == "lz4":
+        import lz4.frame
+        return lz4.frame.compress, lz4.frame.decompress
+    return (lambda data: data), (lambda data: data)
+
+
+def _available(serializer: str, compression: str) -> Tuple[str, str]:
+    """Запрошенные форматы или ближайшие доступные в этом окружении"""
+    if serializer not in SERIALIZERS or (
+            serializer == "msgpack" and not MSGPACK_AVAILABLE) or (
+            serializer == "orjson" and not ORJSON_AVAILABLE):
+        serializer = "orjson" if ORJSON_AVAILABLE else "json"
+    if compression not in COMPRESSIONS or (
+            compression == "zstd" and not ZSTD_AVAILABLE) or (
+            compression == "lz4" and not LZ4_AVAILABLE):
+        compression = "none"
+    return serializer, compression
+
+
+# Место отсутствующего поля при разборе колонок
+_ABSENT = object()
+
+
+def to_columns(rows: List[Dict], fields: Sequence[str]) -> Dict:
+    """Записи по колонкам; индексы записей без поля - в missing, чтобы
+    при разборе не появлялись поля со значением None
+    """
+    columns = []
+    missing: Dict[str, List[int]] = {}
+    for field in fields:
+        column = []
+        for index, row in enumerate(rows):
+            if field in row:
+                column.append(row[field])
+            else:
+                column.append(None)
+                missing.setdefault(field, []).append(index)
+        columns.append(column)
+    packed = {"fields": list(fields), "columns": columns}
+    if missing:
+        packed["missing"] = missing
+    return packed
+
+
+def from_columns(packed: Dict) -> List[Dict]:
+    fields = packed["fields"]
+    missing = packed.get("missing")
+    if not missing:
+        return [dict(zip(fields, values)) for values in zip(*packed["columns"])]
+    columns = [list(column) for column in packed["columns"]]
+    for field, indexes in missing.items():
+        column = columns[fields.index(field)]
+        for index in indexes:
+            column[index] = _ABSENT
+    return [
+        {field: value for field, value in zip(fields, values) if value is not _ABSENT}
+        for values in zip(*columns)
+    ]
+
+
+class Codec:
+    """Кодирование значений кэша для Redis.
+
+    Запись - заголовок и сериализованное (msgpack/orjson/json), при размере
+    от min_compress_size сжатое (zstd/lz4) значение. Формат читается из
+    заголовка, поэтому записи в разных форматах и старый JSON без заголовка
+    читаются одинаково. Для пространств имён из projections списки записей
+    урезаются до нужных полей и хранятся по колонкам.
+    """
+
+    def __init__(
+            self,
+            serializer: str = "msgpack",
+            compression: str = "zstd",
+            min_compress_size: int = 1024,
+            projections: Optional[Dict[str, Tuple[str, ...]]] = None
+    ):
+        self.serializer, self.compression = _available(serializer, compression)
+        self.min_compress_size = min_compress_size
+        self.projections = DEFAULT_PROJECTIONS if projections is None else projections
+        self._dumps, _ = _serializer(self.serializer)
+        self._compress, _ = _compressor(self.compression)
+        self._loads = {}
+        self._decompress = {}
+
+    def project(self, key: str, value: Any) -> Any:
+        """Оставляет в списке записей только поля, которые читает backend"""
+        fields = self.projections.get(key_namespace(key))
+        if not fields or not isinstance(value, list):
+            return value
+        return [{field: row[field] for field in fields if field in row} for row in value]
+
+    def encode(self, key: str, stored: Any) -> bytes:
+        layout = LAYOUT_PLAIN
+        fields = self.projections.get(key_namespace(key))
+        if fields:
+            inner = stored.get("value") if isinstance(stored, dict) and SWR_FIELD in stored else stored
+            if isinstance(inner, list) and all(isinstance(row, dict) for row in inner):
+                columns = to_columns(inner, fields)
+                stored = {**stored, "value": columns} if inner is not stored else columns
+                layout = LAYOUT_COLUMNAR
+
+        payload = self._dumps(stored)
+        compression = "none"
+        if self.compression != "none" and len(payload) >= self.min_compress_size:
+            payload = self._compress(payload)
+            compression = self.compression
+        header = MAGIC + bytes((FORMAT_VERSION, SERIALIZERS[self.serializer], COMPRESSIONS[compression], layout))
+        return header + payload
+
+    def decode(self, data: Optional[bytes]) -> Any:
+        if not data:
+            return None
+        if data[:1] != MAGIC:
+            # Запись, сохранённая до появления заголовка
+            return json.loads(data)
+        if len(data) < HEADER_SIZE or data[1] != FORMAT_VERSION:
+            raise ValueError("Unsupported cache entry format")
+        serializer, compression, layout = data[2], data[3], data[4]
+
+        payload = data[HEADER_SIZE:]
+        if compression:
+            if compression not in self._decompress:
+                self._decompress[compression] = _compressor(_name(COMPRESSIONS, compression))[1]
+            payload = self._decompress[compression](payload)
+        if serializer not in self._loads:
+            self._loads[serializer] = _serializer(_name(SERIALIZERS, serializer))[1]
+        value = self._loads[serializer](payload)
+
+        if layout == LAYOUT_COLUMNAR:
+            if isinstance(value, dict) and SWR_FIELD in value:
+                value["value"] = from_columns(value["value"])
+            else:
+                value = from_columns(value)
+        return value
+
+
+def _name(ids: Dict[str, int], value: int) -> str:
+    for name, known in ids.items():
+        if known == value:
+            return name
+    raise ValueError(f"Unknown cache codec id {value}")
@@ -0,0 +1,393 @@
+"""Модель совместного владения играми: разреженная матрица item-item в mmap-файле.
+
+Вес игры в библиотеке - log1p(часов в игре); близость двух игр - косинус
+их векторов по библиотекам. У каждой игры хранится top-k соседей в формате
+CSR (little-endian):
+    заголовок  HEADER
+    appids     u32 на игру, по возрастанию - номер строки ищется бинарным поиском
+    indptr     u32 на игру + 1: границы строк
+    indices    u32 на соседа: номер строки соседа
+    weights    f32 на соседа: близость, строки отсортированы по её убыванию
+
+Сборка по всем библиотекам в Redis: python -m backend.src.services.coownership build [path]
+Периодическая досборка по журналу загрузок библиотек, с перечитыванием только
+изменившихся, - отдельным процессом: python -m backend.src.services.coownership run [path].
+Векторы всех библиотек и сборка матрицы живут в этом процессе, воркеры API
+только читают готовый файл через mmap.
+"""
+import asyncio
+import fcntl
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ..config import settings
+from ..utils.instrumentation import registry
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PLCOOWN\x00"
+FORMAT_VERSION = 1
+# magic, версия, игр, соседей всего, k, время сборки
+HEADER = struct.Struct("<8sIIIId")
+# Загрузки библиотек с отметкой не позже курсора перечитываются ещё раз:
+# часы воркеров могут немного расходиться
+CHANGES_OVERLAP = 60.0
+
+# Библиотека в модели: appid по возрастанию и веса игр
+LibraryVector = Tuple[np.ndarray, np.ndarray]
+
+
+def library_vector(games: Iterable[Dict], max_games: int) -> Optional[LibraryVector]:
+    """max_games самых сыгранных игр библиотеки; None - сыгранных меньше двух"""
+    played = sorted(
+        (game for game in games if game.get('playtime_forever', 0) > 0 and 'appid' in game),
+        key=lambda x: x['playtime_forever'],
+        reverse=True
+    )[:max_games]
+    if len(played) < 2:
+        return None
+    played.sort(key=lambda x: x['appid'])
+    appids = np.fromiter((game['appid'] for game in played), dtype=np.int64, count=len(played))
+    weights = np.fromiter(
+        (math.log1p(game['playtime_forever'] / 60) for game in played), dtype=np.float64, count=len(played)
+    )
+    return appids, weights
+
+
+def build_coownership_model(libraries: Iterable[LibraryVector], path: str, top_k: int, min_support: int = 1) -> Tuple[int, int]:
+    """Считает модель и атомарно подменяет ею path. Возвращает (игр, соседей)"""
+    libraries = list(libraries)
+    appids = np.unique(np.concatenate([vector for vector, _ in libraries])) if libraries else np.zeros(0, np.int64)
+    count = len(appids)
+
+    norms = np.zeros(count, dtype=np.float64)
+    pair_keys, pair_weights = [], []
+    for vector, weights in libraries:
+        rows = np.searchsorted(appids, vector)
+        norms[rows] += weights ** 2
+        left, right = np.triu_indices(len(rows), k=1)
+        pair_keys.append(rows[left] * count + rows[right])
+        pair_weights.append(weights[left] * weights[right])
+
+    if pair_keys:
+        keys, inverse = np.unique(np.concatenate(pair_keys), return_inverse=True)
+        products = np.bincount(inverse, weights=np.concatenate(pair_weights))
+        keep = np.bincount(inverse) >= min_support
+        keys, products = keys[keep], products[keep]
+    else:
+        keys, products = np.zeros(0, np.int64), np.zeros(0, np.float64)
+    left, right = keys // max(count, 1), keys % max(count, 1)
+    similarity = products / np.sqrt(norms[left] * norms[right])
+
+    # Матрица симметрична: каждая пара даёт соседа обеим играм
+    rows = np.concatenate([left, right])
+    columns = np.concatenate([right, left])
+    similarity = np.concatenate([similarity, similarity])
+    order = np.lexsort((columns, -similarity, rows))
+    rows, columns, similarity = rows[order], columns[order], similarity[order]
+    starts = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=count))])
+    keep = np.arange(len(rows)) - starts[rows] < top_k
+    rows, columns, similarity = rows[keep], columns[keep], similarity[keep]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=count))])
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, count, len(columns), top_k, time.time())
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".coownership-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(appids.astype("<u4").tobytes())
+            f.write(indptr.astype("<u4").tobytes())
+            f.write(columns.astype("<u4").tobytes())
+            f.write(similarity.astype("<f4").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return count, len(columns)
+
+
+class _Model:
+    """Открытая модель: массивы - представления поверх mmap, без копирования"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        magic, version, self.count, nnz, self.top_k, self.created_at = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported co-ownership model {path}")
+        offset = HEADER.size
+        self.appids = np.frombuffer(self.buffer, dtype="<u4", count=self.count, offset=offset)
+        offset += 4 * self.count
+        self.indptr = np.frombuffer(self.buffer, dtype="<u4", count=self.count + 1, offset=offset)
+        offset += 4 * (self.count + 1)
+        self.indices = np.frombuffer(self.buffer, dtype="<u4", count=nnz, offset=offset)
+        offset += 4 * nnz
+        self.weights = np.frombuffer(self.buffer, dtype="<f4", count=nnz, offset=offset)
+
+    def row(self, appid: int) -> Optional[int]:
+        position = int(np.searchsorted(self.appids, appid))
+        if position < self.count and self.appids[position] == appid:
+            return position
+        return None
+
+
+class CoOwnershipStore:
+    """Read-only модель совместного владения из mmap-файла; как и CatalogStore,
+    подхватывает новый файл не чаще раза в check_interval секунд
+    """
+
+    def __init__(self, path: str, check_interval: float = 30.0, max_age: float = 604800.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._model: Optional[_Model] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def reload(self) -> bool:
+        """Перечитывает модель, если файл на диске сменился"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._model = None
+                return False
+            current = self._model
+            if current is not None and current.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                return False
+            try:
+                model = _Model(self.path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Failed to load co-ownership model: {e}")
+                return False
+            self._model = model
+            return True
+
+    def _current(self) -> Optional[_Model]:
+        if not self.enabled:
+            return None
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        model = self._model
+        if model is None or time.time() - model.created_at > self.max_age:
+            return None
+        return model
+
+    def version(self) -> str:
+        """Версия используемой модели (время сборки) для ключей кэша; "" - модели нет"""
+        model = self._current()
+        return repr(model.created_at) if model is not None else ""
+
+    def neighbours(self, played: Dict[int, float], exclude: Set[int], limit: int) -> List[Tuple[int, float]]:
+        """Игры, которые чаще всего есть вместе с played (appid -> вес игры),
+        кроме exclude: (appid, близость 0..1) по убыванию близости
+        """
+        model = self._current()
+        total = sum(played.values())
+        if model is None or total <= 0 or limit <= 0:
+            return []
+
+        columns, scores = [], []
+        for appid, weight in played.items():
+            row = model.row(appid)
+            if row is None or weight <= 0:
+                continue
+            start, end = model.indptr[row], model.indptr[row + 1]
+            columns.append(model.indices[start:end])
+            scores.append(model.weights[start:end] * (weight / total))
+        if not columns:
+            return []
+
+        rows, inverse = np.unique(np.concatenate(columns), return_inverse=True)
+        sums = np.bincount(inverse, weights=np.concatenate(scores))
+        appids = model.appids[rows]
+        if exclude:
+            keep = ~np.isin(appids, np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+            appids, sums = appids[keep], sums[keep]
+        if len(sums) > limit:
+            top = np.argpartition(-sums, limit - 1)[:limit]
+            appids, sums = appids[top], sums[top]
+        order = np.lexsort((appids, -sums))
+        return list(zip(appids[order].tolist(), sums[order].tolist()))
+
+    def __len__(self) -> int:
+        model = self._model
+        return model.count if model is not None else 0
+
+
+class CoOwnershipBuilder:
+    """Держит векторы библиотек в памяти и дособирает модель по журналу
+    загрузок: первый цикл читает все user_games:*, следующие - только
+    библиотеки, загруженные после прошлого цикла, и выбрасывают библиотеки,
+    чьи user_games:* истекли.
+
+    Перечитываются только изменения, а матрица пар каждый раз считается
+    заново по всем векторам: top-k соседей зависит от норм всех игр, и
+    обновление счётчиков пар на месте держало бы в памяти все пары, а не
+    только векторы библиотек.
+    """
+
+    def __init__(self, max_games: int, top_k: int, min_support: int):
+        self.max_games = max_games
+        self.top_k = top_k
+        self.min_support = min_support
+        self.libraries: Dict[str, LibraryVector] = {}
+        self.cursor: Optional[float] = None
+
+    async def _load(self, steam_ids: List[str], batch_size: int = 500) -> None:
+        from .redis import redis_service
+
+        for offset in range(0, len(steam_ids), batch_size):
+            batch = steam_ids[offset:offset + batch_size]
+            libraries = await redis_service.get_many_cached_data_async([f"user_games:{steam_id}" for steam_id in batch])
+            for steam_id, games in zip(batch, libraries):
+                vector = library_vector(games, self.max_games) if isinstance(games, list) else None
+                if vector is None:
+                    self.libraries.pop(steam_id, None)
+                else:
+                    self.libraries[steam_id] = vector
+
+    async def update(self) -> bool:
+        """Подтягивает изменившиеся библиотеки; False - изменений не было"""
+        from .redis import redis_service
+
+        if self.cursor is None:
+            started = time.time()
+            keys = await redis_service.get_keys_by_pattern_async("user_games:*")
+            steam_ids = [(key.decode() if isinstance(key, bytes) else key).split(":", 1)[1] for key in keys]
+            await self._load(steam_ids)
+            self.cursor = started
+            return True
+
+        evicted = await self._evict_expired()
+        changes = await redis_service.get_changed_libraries_async(self.cursor - CHANGES_OVERLAP)
+        if not changes:
+            return evicted
+        await self._load([steam_id for steam_id, _ in changes])
+        self.cursor = max(self.cursor, max(changed_at for _, changed_at in changes))
+        return True
+
+    async def _evict_expired(self, batch_size: int = 500) -> bool:
+        """Убирает векторы библиотек, чьи user_games:* истекли; True - что-то убрано"""
+        from .redis import redis_service
+
+        steam_ids = list(self.libraries)
+        evicted = False
+        for offset in range(0, len(steam_ids), batch_size):
+            batch = steam_ids[offset:offset + batch_size]
+            exists = await redis_service.exist_many_async([f"user_games:{steam_id}" for steam_id in batch])
+            if exists is None:
+                # Redis недоступен - не путаем это с истёкшими ключами
+                return evicted
+            for steam_id, found in zip(batch, exists):
+                if not found:
+                    del self.libraries[steam_id]
+                    evicted = True
+        return evicted
+
+    async def rebuild(self, path: str) -> Optional[Tuple[int, int]]:
+        """Дособирает модель; за сборку на узле отвечает один процесс"""
+        lock_path = f"{path}.lock"
+        os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+        with open(lock_path, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                changed = await self.update()
+                # Без изменений модель всё равно пересобирается, пока не устарела
+                if not changed and _age(path) < settings.COOWNERSHIP_MAX_AGE / 2:
+                    return None
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, build_coownership_model, list(self.libraries.values()), path, self.top_k, self.min_support
+                )
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _age(path: str) -> float:
+    try:
+        return time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return math.inf
+
+
+async def run_coownership_builder(path: str, interval: float) -> None:
+    """Периодическая досборка модели (команда run)"""
+    while True:
+        try:
+            built = await coownership_builder.rebuild(path)
+            if built is not None:
+                coownership_store.reload()
+                logger.info(f"Co-ownership model rebuilt: {built[0]} games, {built[1]} neighbours")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Co-ownership model build failed: {e}")
+        await asyncio.sleep(interval)
+
+
+coownership_store = CoOwnershipStore(
+    settings.COOWNERSHIP_MODEL_PATH,
+    settings.COOWNERSHIP_CHECK_INTERVAL,
+    settings.COOWNERSHIP_MAX_AGE
+)
+coownership_builder = CoOwnershipBuilder(
+    settings.COOWNERSHIP_MAX_GAMES,
+    settings.COOWNERSHIP_TOP_K,
+    settings.COOWNERSHIP_MIN_SUPPORT
+)
+
+registry.gauge(
+    "playiter_coownership_games", "Games in the memory-mapped co-ownership model",
+    lambda: {(): len(coownership_store)}
+)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("build", "run"):
+        print("usage: python -m backend.src.services.coownership build|run [path]", file=sys.stderr)
+        sys.exit(2)
+    target = sys.argv[2] if len(sys.argv) > 2 else settings.COOWNERSHIP_MODEL_PATH
+    if not target:
+        print("COOWNERSHIP_MODEL_PATH is not set", file=sys.stderr)
+        sys.exit(2)
+    if sys.argv[1] == "run":
+        if settings.COOWNERSHIP_BUILD_INTERVAL <= 0:
+            print("COOWNERSHIP_BUILD_INTERVAL must be positive", file=sys.stderr)
+            sys.exit(2)
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(run_coownership_builder(target, settings.COOWNERSHIP_BUILD_INTERVAL))
+    else:
+        asyncio.run(coownership_builder.update())
+        games, neighbours = build_coownership_model(
+            coownership_builder.libraries.values(), target, coownership_builder.top_k, coownership_builder.min_support
+        )
+        print(f"{games} games, {neighbours} neighbours written to {target}")
@@ -0,0 +1,38 @@
+import importlib.util
+
+import httpx
+
+from ..config import settings
+from ..utils.aio import LoopLocal
+
+# HTTP/2 включаем только если установлен пакет h2 (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=settings.STEAM_HTTP2 and HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=settings.STEAM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.STEAM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.STEAM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        headers={
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        },
+        timeout=httpx.Timeout(15.0, connect=5.0),
+    )
+
+
+_clients: LoopLocal[httpx.AsyncClient] = LoopLocal(_create_client)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий keep-alive клиент для текущего event loop"""
+    return _clients.get()
+
+
+async def close_http_client() -> None:
+    client = _clients.pop()
+    if client is not None:
+        await client.aclose()
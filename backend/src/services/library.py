@@ -0,0 +1,242 @@
+"""Библиотеки пользователей, проиндексированные в Redis при загрузке из Steam.
+
+    user_library:{steam_id}:meta               hash: число игр и сыгранных, отпечаток, время загрузки
+    user_library:{steam_id}:games              hash appid -> запись игры
+    user_library:{steam_id}:rtime_last_played  zset appid по времени последнего запуска
+    user_library:{steam_id}:playtime_forever   zset appid по общему времени в игре
+
+/user и конвейер рекомендаций читают отсюда страницы и топы диапазонными
+запросами вместо разбора и сортировки всей библиотеки. Без Redis всё
+считается по списку игр из кэша user_games.
+"""
+import hashlib
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from ..config import settings
+from .redis import redis_service
+
+logger = logging.getLogger(__name__)
+
+# Порядок выдачи библиотеки -> поле игры и sorted set с ним
+SORT_FIELDS = {"recent": "rtime_last_played", "playtime": "playtime_forever"}
+RECORD_FIELDS = ("appid", "name", "playtime_forever", "rtime_last_played")
+# Сколько последних запущенных игр рассматривать и сколько из них брать в топ
+RECENT_WINDOW = 25
+TOP_PLAYED = 10
+# Шаг просмотра sorted set'а, когда фильтр не выражается диапазоном
+SCAN_CHUNK = 100
+
+
+class LibrarySummary(NamedTuple):
+    game_count: int
+    played_count: int
+    fingerprint: str
+    played_appids: Set[int]
+    top_played: List[Dict]
+
+
+class LibraryPage(NamedTuple):
+    game_count: int
+    games: List[Dict]
+    next_cursor: Optional[str]
+
+
+def library_fingerprint(played_games: List[Dict]) -> str:
+    """Хэш сыгранной части библиотеки: всё, от чего зависит выбор и вес игр"""
+    digest = hashlib.blake2b(digest_size=16)
+    for game in sorted(played_games, key=lambda x: x['appid']):
+        digest.update(
+            f"{game['appid']}:{game.get('playtime_forever', 0)}:{game.get('rtime_last_played', 0)};".encode()
+        )
+    return digest.hexdigest()
+
+
+def top_played(played_games: List[Dict]) -> List[Dict]:
+    """10 игр с наибольшим временем среди 25 последних запущенных"""
+    recently_played = sorted(
+        played_games,
+        key=lambda x: x.get('rtime_last_played', 0),
+        reverse=True
+    )[:RECENT_WINDOW]
+
+    return sorted(
+        recently_played,
+        key=lambda x: x.get('playtime_forever', 0),
+        reverse=True
+    )[:TOP_PLAYED]
+
+
+def summarize(games: List[Dict]) -> LibrarySummary:
+    """Сводка по полному списку игр (когда индекса нет)"""
+    played = [game for game in games if game.get('playtime_forever', 0) > 0]
+    return LibrarySummary(
+        game_count=len(games),
+        played_count=len(played),
+        fingerprint=library_fingerprint(played),
+        played_appids={game['appid'] for game in played},
+        top_played=top_played(played)
+    )
+
+
+def encode_cursor(score: float, appid: int) -> str:
+    """Курсор - позиция последней игры страницы: значение поля сортировки и appid"""
+    return f"{int(score)}:{appid}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    """(значение, appid) из курсора, None - первая страница; ValueError - курсор не наш"""
+    if not cursor:
+        return None
+    score, appid = cursor.split(":")
+    return int(score), int(appid)
+
+
+class UserLibraryService:
+    async def index_async(self, steam_id: str, games: List[Dict]) -> Optional[Dict]:
+        """Индексирует библиотеку; возвращает meta или None, если Redis недоступен"""
+        played = [game for game in games if game.get('playtime_forever', 0) > 0]
+        meta = {
+            "game_count": len(games),
+            "played_count": len(played),
+            "fingerprint": library_fingerprint(played),
+            "fetched_at": time.time(),
+        }
+        records = [{field: game[field] for field in RECORD_FIELDS if field in game} for game in games]
+        indexed = await redis_service.index_user_library_async(
+            steam_id, records, meta, tuple(SORT_FIELDS.values()), settings.USER_GAMES_HARD_TTL
+        )
+        return meta if indexed else None
+
+    async def _load(self, steam_id: str, raise_errors: bool) -> Tuple[Optional[Dict], List[Dict]]:
+        """meta индекса или, если его нет и построить не удалось, полный список игр"""
+        from .steam import steam_service
+
+        meta = await redis_service.get_user_library_meta_async(steam_id)
+        if meta is not None:
+            if time.time() - meta.get("fetched_at", 0) > settings.USER_GAMES_SOFT_TTL:
+                steam_service._schedule_refresh(
+                    f"user_games:{steam_id}", lambda: steam_service._fetch_user_games(steam_id)
+                )
+            return meta, []
+
+        # Индекс истёк или его ещё нет: загрузка из Steam строит его сама,
+        # а библиотеку из кэша user_games индексируем здесь
+        games = await steam_service.get_user_games_async(steam_id, raise_errors=raise_errors)
+        if not games:
+            return None, []
+        meta = await redis_service.get_user_library_meta_async(steam_id)
+        if meta is None:
+            meta = await self.index_async(steam_id, games)
+        return meta, games if meta is None else []
+
+    async def summary_async(self, steam_id: str, raise_errors: bool = False) -> LibrarySummary:
+        """Сводка для рекомендаций: счётчики, отпечаток, сыгранные appid и топ игр"""
+        meta, games = await self._load(steam_id, raise_errors)
+        if meta is None:
+            return summarize(games)
+
+        played_appids = await redis_service.range_user_library_async(
+            steam_id, "playtime_forever", min_score="(0"
+        )
+        recent: List[Dict] = []
+        offset = 0
+        while len(recent) < RECENT_WINDOW and offset < meta["game_count"]:
+            appids = await redis_service.range_user_library_async(
+                steam_id, "rtime_last_played", offset, SCAN_CHUNK
+            )
+            if not appids:
+                break
+            offset += len(appids)
+            for game in await redis_service.get_user_library_games_async(steam_id, appids):
+                if game and game.get('playtime_forever', 0) > 0:
+                    recent.append(game)
+
+        return LibrarySummary(
+            game_count=meta["game_count"],
+            played_count=meta["played_count"],
+            fingerprint=meta["fingerprint"],
+            played_appids=set(played_appids),
+            top_played=top_played(recent)
+        )
+
+    async def page_async(
+            self,
+            steam_id: str,
+            sort: str = "recent",
+            descending: bool = True,
+            min_playtime: int = 0,
+            cursor: Optional[str] = None,
+            limit: int = 20
+    ) -> Optional[LibraryPage]:
+        """Страница библиотеки в порядке sort; min_playtime - в минутах.
+        None - библиотеки нет
+        """
+        after = decode_cursor(cursor)
+        field = SORT_FIELDS[sort]
+        meta, games = await self._load(steam_id, raise_errors=False)
+        if meta is None:
+            if not games:
+                return None
+            return _page_from_list(games, field, descending, min_playtime, after, limit)
+
+        if min_playtime <= 0 or sort == "playtime":
+            # Фильтр по времени в игре для сортировки по нему же - диапазон по score
+            entries = await redis_service.range_user_library_after_async(
+                steam_id, field, after, limit + 1, descending,
+                min_score=str(min_playtime) if min_playtime > 0 else None
+            )
+            page = await redis_service.get_user_library_games_async(steam_id, [appid for appid, _ in entries[:limit]])
+            next_cursor = None
+            if len(entries) > limit:
+                appid, score = entries[limit - 1]
+                next_cursor = encode_cursor(score, appid)
+            return LibraryPage(meta["game_count"], [game for game in page if game], next_cursor)
+
+        # Последние запущенные с фильтром по времени: просматриваем индекс кусками,
+        # курсор - последняя просмотренная игра
+        page, position, exhausted = [], after, False
+        while len(page) < limit and not exhausted:
+            entries = await redis_service.range_user_library_after_async(
+                steam_id, field, position, SCAN_CHUNK, descending
+            )
+            exhausted = len(entries) < SCAN_CHUNK
+            games = await redis_service.get_user_library_games_async(steam_id, [appid for appid, _ in entries])
+            for number, ((appid, score), game) in enumerate(zip(entries, games), 1):
+                position = (score, appid)
+                if game and game.get('playtime_forever', 0) >= min_playtime:
+                    page.append(game)
+                    if len(page) == limit:
+                        exhausted = exhausted and number == len(entries)
+                        break
+        next_cursor = encode_cursor(*position) if position is not None and not exhausted else None
+        return LibraryPage(meta["game_count"], page, next_cursor)
+
+
+def _page_from_list(
+        games: List[Dict],
+        field: str,
+        descending: bool,
+        min_playtime: int,
+        after: Optional[Tuple[int, int]],
+        limit: int
+) -> LibraryPage:
+    """Та же страница по списку игр в памяти (без Redis), с теми же курсорами"""
+    # Порядок как у sorted set: по значению, равные - по appid как строке
+    def position(game: Dict) -> Tuple[int, str]:
+        return game.get(field) or 0, str(game['appid'])
+
+    ordered = sorted(games, key=position, reverse=descending)
+    if after is not None:
+        mark = (after[0], str(after[1]))
+        ordered = [game for game in ordered if (position(game) < mark if descending else position(game) > mark)]
+    matching = [game for game in ordered if game.get('playtime_forever', 0) >= min_playtime]
+    next_cursor = None
+    if len(matching) > limit:
+        last = matching[limit - 1]
+        next_cursor = encode_cursor(last.get(field) or 0, last['appid'])
+    return LibraryPage(len(games), matching[:limit], next_cursor)
+
+
+user_libraries = UserLibraryService()
@@ -0,0 +1,212 @@
+"""Фоновый прогрев каталога игр.
+
+Запуск отдельным процессом: python -m backend.src.services.prefetch
+или задачей lifespan при PREFETCH_ENABLED=true.
+"""
+import asyncio
+import heapq
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from ..config import settings
+from ..utils.instrumentation import registry
+from ..utils.ratelimit import PRIORITY_BACKGROUND, TokenBucket, set_priority
+from ..utils.tag_index import tag_index
+from .cache import CacheEntry, is_negative
+from .redis import redis_service
+from .singleflight import steam_flights
+from .steam import steam_service
+
+logger = logging.getLogger(__name__)
+
+prefetch_requests = registry.counter(
+    "playiter_prefetch_requests_total", "Steam requests made by the catalog prefetcher", ("result",)
+)
+
+
+class CatalogPrefetcher:
+    """Периодически обновляет популярные игры и заранее загружает детали
+    кандидатов и игр из недавно закэшированных библиотек.
+
+    Очередь упорядочена по приоритету: популярность игры, умноженная на
+    близость истечения её записи в кэше. Запросы к Steam ограничены бюджетом
+    в минуту. Цикл выполняет одна реплика - та, что держит аренду в Redis.
+    """
+
+    LEASE = "catalog_prefetch"
+
+    def __init__(
+            self,
+            budget_per_minute: float,
+            concurrency: int = 2,
+            refresh_ahead: float = 600.0,
+            library_sample: int = 200,
+            lease_ttl_ms: int = 60000
+    ):
+        self.budget = TokenBucket(budget_per_minute / 60, max(1, concurrency))
+        self.concurrency = max(1, concurrency)
+        self.refresh_ahead = refresh_ahead
+        self.library_sample = library_sample
+        self.lease_ttl_ms = lease_ttl_ms
+        self._queue: List[Tuple[float, int]] = []
+        self.leader = False
+        self.total = 0
+        self.warm = 0
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def coverage(self) -> float:
+        return self.warm / self.total if self.total else 0.0
+
+    async def run_forever(self, interval: float) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Catalog prefetch cycle failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def run_once(self) -> bool:
+        """Один цикл прогрева, если удалось взять аренду. False - цикл идёт на другой реплике"""
+        token = await redis_service.acquire_lock_async(self.LEASE, self.lease_ttl_ms)
+        if token is None:
+            return False
+
+        self.leader = True
+        cycle = asyncio.ensure_future(self._cycle())
+        try:
+            while not cycle.done():
+                await asyncio.wait({cycle}, timeout=self.lease_ttl_ms / 3000)
+                if not cycle.done() and not await redis_service.extend_lock_async(self.LEASE, token, self.lease_ttl_ms):
+                    logger.warning("Catalog prefetch lease lost, stopping the cycle")
+                    break
+            else:
+                await cycle
+        finally:
+            if not cycle.done():
+                cycle.cancel()
+                await asyncio.wait({cycle})
+            self._queue.clear()
+            self.leader = False
+            await redis_service.release_lock_async(self.LEASE, token)
+        return True
+
+    async def _cycle(self) -> None:
+        set_priority(PRIORITY_BACKGROUND)
+        # Бюджет тратится на чарт, только когда запись в кэше устарела
+        entry = await redis_service.get_cached_entry_async("popular_games")
+        if entry and entry.value and not entry.stale:
+            popular_games = entry.value
+        else:
+            await self.budget.acquire()
+            popular_games = await steam_flights.do("popular_games", steam_service._fetch_popular_games)
+            prefetch_requests.inc("popular_games")
+
+        popularity = await self._popularity(popular_games)
+        appids = list(popularity)
+        keys = [f"game_details:{appid}" for appid in appids]
+        entries = await redis_service.get_many_cached_entries_async(keys)
+        ttls = await redis_service.get_ttls_async(keys)
+
+        self._queue = []
+        self.total, self.warm = len(appids), 0
+        for appid, entry, ttl in zip(appids, entries, ttls):
+            urgency = self._urgency(entry, ttl)
+            if urgency is None:
+                self.warm += 1
+            else:
+                self._queue.append((-urgency * (0.5 + 0.5 * popularity[appid]), appid))
+        heapq.heapify(self._queue)
+        logger.info(f"Catalog prefetch: {len(self._queue)} of {self.total} games queued")
+
+        await asyncio.gather(*(self._drain() for _ in range(self.concurrency)))
+        await tag_index.save_snapshot()
+
+    async def _popularity(self, popular_games: List[Dict]) -> Dict[int, float]:
+        """Популярность 0..1: место в чарте и доля библиотек, где есть игра"""
+        popularity: Dict[int, float] = {}
+        for rank, game in enumerate(popular_games):
+            popularity[game['appid']] = 1 - rank / len(popular_games)
+
+        # Последние загруженные библиотеки из журнала изменений (он ведётся
+        # для модели совместного владения), иначе - первые ключи SCAN
+        steam_ids = await redis_service.get_recent_libraries_async(self.library_sample)
+        if steam_ids:
+            keys = [f"user_games:{steam_id}" for steam_id in steam_ids]
+        else:
+            keys = await redis_service.get_keys_by_pattern_async("user_games:*", limit=self.library_sample)
+            keys = [key.decode() if isinstance(key, bytes) else key for key in keys]
+        owners = Counter()
+        for library in await redis_service.get_many_cached_data_async(keys):
+            if isinstance(library, list):
+                owners.update({game['appid'] for game in library if 'appid' in game})
+        if owners:
+            most_owned = max(owners.values())
+            for appid, count in owners.items():
+                # Владение - слабее сигнал, чем чарт
+                popularity[appid] = max(popularity.get(appid, 0.0), 0.5 * count / most_owned)
+        return popularity
+
+    def _urgency(self, entry: Optional[CacheEntry], ttl: Optional[float]) -> Optional[float]:
+        """Насколько срочно обновить запись 0..1; None - запись свежая или
+        известно, что игры нет
+        """
+        if entry is None:
+            return 1.0
+        if is_negative(entry.value):
+            return None
+        if entry.stale:
+            return 0.9
+        if ttl is None:
+            return None
+        until_stale = ttl - (settings.GAME_DETAILS_HARD_TTL - settings.GAME_DETAILS_SOFT_TTL)
+        if until_stale > self.refresh_ahead:
+            return None
+        return 0.8 * (1 - max(until_stale, 0) / self.refresh_ahead)
+
+    async def _drain(self) -> None:
+        while self._queue:
+            _, appid = heapq.heappop(self._queue)
+            await self.budget.acquire()
+            try:
+                await steam_flights.do(
+                    f"game_details:{appid}",
+                    lambda appid=appid: steam_service._fetch_game_details(appid)
+                )
+            except Exception as e:
+                logger.warning(f"Prefetch failed for appid {appid}: {e}")
+                prefetch_requests.inc("error")
+            else:
+                prefetch_requests.inc("game_details")
+                self.warm += 1
+
+
+prefetcher = CatalogPrefetcher(
+    settings.PREFETCH_BUDGET_PER_MINUTE,
+    settings.PREFETCH_CONCURRENCY,
+    settings.PREFETCH_REFRESH_AHEAD,
+    settings.PREFETCH_LIBRARY_SAMPLE,
+    settings.PREFETCH_LEASE_TTL_MS
+)
+
+registry.gauge(
+    "playiter_prefetch_queue_depth", "Games waiting in the catalog prefetch queue",
+    lambda: {(): prefetcher.queue_depth()}
+)
+registry.gauge(
+    "playiter_catalog_warm_coverage", "Share of candidate games with fresh cached details",
+    lambda: {(): prefetcher.coverage()}
+)
+registry.gauge(
+    "playiter_prefetch_leader", "1 if this process holds the prefetch lease",
+    lambda: {(): 1 if prefetcher.leader else 0}
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(prefetcher.run_forever(settings.PREFETCH_INTERVAL))
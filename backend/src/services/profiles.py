@@ -0,0 +1,213 @@
+"""Профили предпочтений пользователей в Redis.
+
+    user_profile:{steam_id}  отпечаток библиотеки, снимок времени в игре по appid,
+                             самые сыгранные игры с их тегами и веса тегов
+
+Профиль обновляется по разнице с прошлым снимком, когда из Steam приходит
+свежая библиотека: детали загружаются только для игр, впервые попавших в
+топ, веса тегов меняются только на вклад вошедших и вышедших из топа игр.
+Конвейер рекомендаций читает профиль одним запросом вместо загрузки
+деталей каждой игры топа.
+"""
+import asyncio
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from ..config import settings
+from ..models.game import GameRecord
+from ..utils.instrumentation import registry
+from .library import LibrarySummary, library_fingerprint, top_played
+from .redis import redis_service
+from .singleflight import steam_flights
+
+profile_updates = registry.counter(
+    "playiter_profile_updates_total", "Preference profile updates by kind", ("kind",)
+)
+
+PROFILE_GAME_FIELDS = ("appid", "name", "playtime_forever", "rtime_last_played")
+# Меньшие веса - остаток от вычитаний, а не тег
+WEIGHT_EPSILON = 1e-9
+
+
+class PreferenceProfile(NamedTuple):
+    fingerprint: str
+    # str(appid) -> [playtime_forever, rtime_last_played] сыгранных игр
+    snapshot: Dict[str, List[int]]
+    # Самые сыгранные игры с категориями и жанрами
+    games: List[Dict]
+    # Веса тегов: сумма log1p(часов) игр топа с этим тегом
+    categories: Dict[str, float]
+    genres: Dict[str, float]
+    updated_at: float
+
+    def played(self) -> List[Tuple[Dict, GameRecord]]:
+        """Пары (игра из библиотеки, её детали) для ScoringEngine"""
+        return [
+            (game, GameRecord(
+                steam_appid=game['appid'],
+                name=game.get('name') or f"AppID {game['appid']}",
+                categories=game['categories'],
+                genres=game['genres']
+            ))
+            for game in self.games
+        ]
+
+
+def tag_weight(game: Dict) -> float:
+    """Вклад игры в вес её тегов; давность и веса запроса учитывает скоринг"""
+    return math.log1p(game.get('playtime_forever', 0) / 60)
+
+
+def ranked_tags(weights: Dict[str, float]) -> List[str]:
+    """Теги по убыванию веса"""
+    return sorted(weights, key=lambda tag: (-weights[tag], tag))
+
+
+def _snapshot(played_games: Sequence[Dict]) -> Dict[str, List[int]]:
+    return {
+        str(game['appid']): [game.get('playtime_forever', 0), game.get('rtime_last_played', 0)]
+        for game in played_games
+    }
+
+
+def _apply(profile_weights: Tuple[Dict[str, float], Dict[str, float]], game: Dict, sign: int) -> None:
+    weight = sign * tag_weight(game)
+    for weights, tags in zip(profile_weights, (game['categories'], game['genres'])):
+        for tag in tags:
+            value = weights.get(tag, 0.0) + weight
+            if value > WEIGHT_EPSILON:
+                weights[tag] = value
+            else:
+                weights.pop(tag, None)
+
+
+class UserProfileService:
+    @staticmethod
+    def _key(steam_id: str) -> str:
+        return f"user_profile:{steam_id}"
+
+    @staticmethod
+    def _catchup_key(steam_id: str) -> str:
+        # Догоняние по сводке видит только топ библиотеки: не делим его
+        # результат с обновлением по полной библиотеке
+        return f"user_profile_catchup:{steam_id}"
+
+    @staticmethod
+    def _decode(raw) -> Optional[PreferenceProfile]:
+        if not isinstance(raw, dict):
+            return None
+        try:
+            return PreferenceProfile(**raw)
+        except TypeError:
+            # Запись старого формата - пересоберём
+            return None
+
+    async def get_many_async(self, steam_ids: List[str], libraries: List[LibrarySummary]) -> List[PreferenceProfile]:
+        """Профили, соответствующие сводкам библиотек: один MGET, устаревшие обновляются"""
+        raws = await redis_service.get_many_cached_data_async([self._key(steam_id) for steam_id in steam_ids])
+
+        async def resolve(steam_id: str, library: LibrarySummary, raw) -> PreferenceProfile:
+            profile = self._decode(raw)
+            if profile is not None and profile.fingerprint == library.fingerprint:
+                return profile
+            return await steam_flights.do(
+                self._catchup_key(steam_id),
+                lambda: self._update(steam_id, library.top_played, library.fingerprint, profile, partial=True)
+            )
+
+        return list(await asyncio.gather(*(
+            resolve(steam_id, library, raw) for steam_id, library, raw in zip(steam_ids, libraries, raws)
+        )))
+
+    async def get_async(self, steam_id: str, library: LibrarySummary) -> PreferenceProfile:
+        return (await self.get_many_async([steam_id], [library]))[0]
+
+    async def update_from_games_async(self, steam_id: str, games: List[Dict]) -> PreferenceProfile:
+        """Обновляет профиль по свежей библиотеке из GetOwnedGames"""
+        played = [game for game in games if game.get('playtime_forever', 0) > 0]
+        fingerprint = library_fingerprint(played)
+
+        async def update() -> PreferenceProfile:
+            previous = self._decode(await redis_service.get_cached_data_async(self._key(steam_id)))
+            return await self._update(steam_id, played, fingerprint, previous)
+
+        return await steam_flights.do(self._key(steam_id), update)
+
+    async def _update(
+            self,
+            steam_id: str,
+            played_games: List[Dict],
+            fingerprint: str,
+            previous: Optional[PreferenceProfile],
+            partial: bool = False
+    ) -> PreferenceProfile:
+        """Новый профиль из прошлого и сыгранных игр: всех или, при partial,
+        только топа - тогда снимок остальных игр остаётся от прошлого профиля
+        """
+        if previous is not None and previous.fingerprint == fingerprint:
+            profile_updates.inc("unchanged")
+            return previous
+
+        snapshot = _snapshot(played_games)
+        if partial and previous is not None:
+            snapshot = {**previous.snapshot, **snapshot}
+        top = [{field: game[field] for field in PROFILE_GAME_FIELDS if field in game} for game in top_played(played_games)]
+        if previous is None:
+            categories, genres = {}, {}
+            known: Dict[int, Dict] = {}
+        else:
+            categories, genres = dict(previous.categories), dict(previous.genres)
+            known = {game['appid']: game for game in previous.games}
+
+        # Игры топа с прежним временем в игре остаются как есть, вклад
+        # остальных прежних игр топа вычитается
+        kept = {
+            game['appid'] for game in top
+            if game['appid'] in known and previous.snapshot.get(str(game['appid'])) == snapshot[str(game['appid'])]
+        }
+        for appid, game in known.items():
+            if appid not in kept:
+                _apply((categories, genres), game, -1)
+
+        # Теги берём из прошлого профиля, детали загружаем только для новых в топе
+        missing = [game['appid'] for game in top if game['appid'] not in known]
+        if missing:
+            from .steam import steam_service
+
+            details = dict(zip(missing, await steam_service.get_game_details_many_async(missing)))
+        else:
+            details = {}
+
+        games = []
+        for game in top:
+            appid = game['appid']
+            if appid in known:
+                game = {**game, "categories": known[appid]['categories'], "genres": known[appid]['genres']}
+            else:
+                found = details.get(appid)
+                game = {
+                    **game,
+                    "categories": list(found.categories) if found else [],
+                    "genres": list(found.genres) if found else [],
+                }
+            if appid not in kept:
+                _apply((categories, genres), game, 1)
+            games.append(game)
+
+        profile = PreferenceProfile(
+            fingerprint=fingerprint,
+            snapshot=snapshot,
+            games=games,
+            categories=categories,
+            genres=genres,
+            updated_at=time.time()
+        )
+        profile_updates.inc("rebuild" if previous is None else "incremental")
+        # Детали, которых Steam не вернул, не запоминаем - профиль пересоберётся
+        if all(appid in known or details.get(appid) for appid in missing):
+            await redis_service.cache_data_async(self._key(steam_id), profile._asdict(), ttl=settings.USER_PROFILE_TTL)
+        return profile
+
+
+user_profiles = UserProfileService()
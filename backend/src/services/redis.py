@@ -1,31 +1,603 @@
+import asyncio
 import json
+import logging
+import time
+import uuid
 import redis
-from typing import List
+import redis.asyncio as aioredis
+from typing import Any, Dict, List, Optional, Tuple
 
 from ..config import settings
+from ..utils.aio import LoopLocal
+from ..utils.instrumentation import record_cache_lookup, registry, trace_incr
+from .codec import Codec
+from .cache import CacheEntry, LocalCache, NEGATIVE_MARKER, parse_namespace_ttls, unwrap_swr, wrap_swr
+
+logger = logging.getLogger(__name__)
+
+# Журнал загрузок библиотек: steam_id -> время, читается сборщиком модели
+# совместного владения и прогревом каталога
+LIBRARY_CHANGES_KEY = "library_changes"
+# Индекс профилей запросов: id профиля -> время
+PROFILES_INDEX_KEY = "profiles_index"
+
+# Удаляет блокировку, только если она всё ещё принадлежит владельцу токена
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Продлевает блокировку, только если она всё ещё принадлежит владельцу токена
+EXTEND_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# GCRA: в ключе - теоретическое время прибытия (TAT) следующего запроса, мс.
+# Выдаёт до ARGV[3] токенов, пока TAT не опережает текущее время больше чем
+# на допуск ARGV[2]; иначе возвращает, сколько мс ждать одного токена
+RATE_LIMIT_SCRIPT = """
+local time = redis.call('time')
+local now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('get', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local granted = math.min(tonumber(ARGV[3]), math.floor((now + tolerance - tat) / interval))
+if granted < 1 then
+    return {0, tostring(tat + interval - tolerance - now)}
+end
+tat = tat + granted * interval
+redis.call('set', KEYS[1], tostring(tat), 'PX', math.ceil(tat - now) + 1000)
+return {granted, '0'}
+"""
+
 
 class RedisService:
     def __init__(self):
         self.client = redis.Redis.from_url(settings.REDIS_URL)
+        self._async_clients = LoopLocal(lambda: aioredis.Redis.from_url(settings.REDIS_URL))
+        # L1: in-process кэш перед Redis
+        self.local = LocalCache(
+            settings.L1_CACHE_MAX_ITEMS,
+            parse_namespace_ttls(settings.L1_CACHE_TTLS)
+        )
+        # Формат значений в Redis: сериализация, сжатие, проекция полей
+        self.codec = Codec(
+            settings.REDIS_CODEC,
+            settings.REDIS_COMPRESSION,
+            settings.REDIS_COMPRESS_MIN_BYTES
+        )
+        # Идентификатор процесса, чтобы не обрабатывать собственные инвалидации
+        self.instance_id = uuid.uuid4().hex
+
+    @property
+    def aclient(self) -> aioredis.Redis:
+        """Асинхронный клиент с пулом соединений текущего event loop"""
+        return self._async_clients.get()
+
+    async def close_async(self) -> None:
+        client = self._async_clients.pop()
+        if client is not None:
+            await client.aclose()
 
-    def cache_data(self, key: str, value: dict, ttl: int = 3600) -> bool:
+    def _decode(self, data: Optional[bytes]) -> Any:
+        return self.codec.decode(data)
+
+    @staticmethod
+    def _remaining_ttl(pttl: int) -> Optional[float]:
+        # PTTL: -1 - ключ без срока жизни, -2 - ключа нет
+        return pttl / 1000 if pttl >= 0 else None
+
+    def cache_data(self, key: str, value: dict, ttl: int = 3600, soft_ttl: Optional[int] = None) -> bool:
+        """Кладёт значение в кэш; с soft_ttl запись после мягкого срока считается устаревшей"""
         try:
-            serialized = json.dumps(value)
-            return self.client.setex(key, ttl, serialized)
+            stored = wrap_swr(self.codec.project(key, value), soft_ttl)
+            result = self.client.setex(key, ttl, self.codec.encode(key, stored))
+            self.local.set(key, stored, ttl)
+            self._publish_invalidation(key)
+            return result
         except Exception:
             return False
 
     def get_cached_data(self, key: str) -> dict:
+        found, raw = self.local.get(key)
+        if not found:
+            try:
+                with self.client.pipeline(transaction=False) as pipe:
+                    data, pttl = pipe.get(key).pttl(key).execute()
+                raw = self._decode(data)
+            except Exception:
+                return None
+            if raw is not None:
+                self.local.set(key, raw, self._remaining_ttl(pttl))
+        return unwrap_swr(raw).value
+
+    def get_keys_by_pattern(self, pattern: str) -> List[str]:
+        """Ключи по шаблону через SCAN (без блокирующего KEYS)"""
+        try:
+            return list(self.client.scan_iter(match=pattern, count=1000))
+        except Exception:
+            return []
+
+    async def cache_data_async(self, key: str, value: dict, ttl: int = 3600, soft_ttl: Optional[int] = None) -> bool:
+        try:
+            stored = wrap_swr(self.codec.project(key, value), soft_ttl)
+            result = await self.aclient.setex(key, ttl, self.codec.encode(key, stored))
+            self.local.set(key, stored, ttl)
+            await self._publish_invalidation_async(key)
+            return result
+        except Exception:
+            return False
+
+    async def cache_negative_async(self, key: str, ttl: int) -> bool:
+        """Запоминает отсутствие данных (например, success: false от Steam)"""
+        return await self.cache_data_async(key, NEGATIVE_MARKER, ttl)
+
+    async def get_cached_data_async(self, key: str) -> dict:
+        entry = await self.get_cached_entry_async(key)
+        return entry.value if entry else None
+
+    async def get_cached_entry_async(self, key: str) -> Optional[CacheEntry]:
+        """Значение вместе с признаком устаревания (stale-while-revalidate)"""
+        found, raw = self.local.get(key)
+        if self.local.caches(key):
+            record_cache_lookup("l1", found)
+        if not found:
+            started = time.perf_counter()
+            try:
+                async with self.aclient.pipeline(transaction=False) as pipe:
+                    data, pttl = await pipe.get(key).pttl(key).execute()
+                raw = self._decode(data)
+            except Exception:
+                return None
+            finally:
+                trace_incr("redis_seconds", time.perf_counter() - started)
+            record_cache_lookup("redis", raw is not None)
+            if raw is not None:
+                self.local.set(key, raw, self._remaining_ttl(pttl))
+        return unwrap_swr(raw) if raw is not None else None
+
+    async def get_many_cached_data_async(self, keys: List[str]) -> List[Optional[dict]]:
+        """Читает несколько ключей за один round trip, сохраняя порядок"""
+        entries = await self.get_many_cached_entries_async(keys)
+        return [entry.value if entry else None for entry in entries]
+
+    async def get_many_cached_entries_async(self, keys: List[str]) -> List[Optional[CacheEntry]]:
+        if not keys:
+            return []
+
+        raws: List[Any] = [None] * len(keys)
+        remote = []
+        l1_hits = l1_misses = 0
+        for index, key in enumerate(keys):
+            found, raw = self.local.get(key)
+            if found:
+                raws[index] = raw
+                l1_hits += 1
+            else:
+                remote.append(index)
+                l1_misses += self.local.caches(key)
+        record_cache_lookup("l1", True, l1_hits)
+        record_cache_lookup("l1", False, l1_misses)
+
+        if remote:
+            started = time.perf_counter()
+            try:
+                async with self.aclient.pipeline(transaction=False) as pipe:
+                    pipe.mget([keys[index] for index in remote])
+                    for index in remote:
+                        pipe.pttl(keys[index])
+                    values, *pttls = await pipe.execute()
+            except Exception:
+                values, pttls = [None] * len(remote), [-2] * len(remote)
+            trace_incr("redis_seconds", time.perf_counter() - started)
+            redis_hits = sum(1 for data in values if data)
+            record_cache_lookup("redis", True, redis_hits)
+            record_cache_lookup("redis", False, len(remote) - redis_hits)
+
+            for index, data, pttl in zip(remote, values, pttls):
+                try:
+                    raw = self._decode(data)
+                except Exception:
+                    continue
+                if raw is not None:
+                    raws[index] = raw
+                    self.local.set(keys[index], raw, self._remaining_ttl(pttl))
+
+        return [unwrap_swr(raw) if raw is not None else None for raw in raws]
+
+    async def delete_async(self, key: str) -> bool:
+        self.local.invalidate(key)
         try:
-            data = self.client.get(key)
-            return json.loads(data.decode()) if data else None
+            await self.aclient.delete(key)
+            await self._publish_invalidation_async(key)
+            return True
         except Exception:
+            return False
+
+    async def acquire_lock_async(self, name: str, ttl_ms: int) -> Optional[str]:
+        """Короткая блокировка SET NX PX. None - блокировку держит кто-то другой"""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.aclient.set(f"lock:{name}", token, nx=True, px=ttl_ms)
+        except Exception as e:
+            # Без Redis координировать нечего - работаем как единственный владелец
+            logger.warning(f"Redis lock error for {name}: {e}")
+            return token
+        return token if acquired else None
+
+    async def release_lock_async(self, name: str, token: str) -> None:
+        try:
+            await self.aclient.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{name}", token)
+        except Exception as e:
+            logger.warning(f"Redis unlock error for {name}: {e}")
+
+    async def extend_lock_async(self, name: str, token: str, ttl_ms: int) -> bool:
+        """Продлевает блокировку; False - она истекла или перешла к другому"""
+        try:
+            return bool(await self.aclient.eval(EXTEND_LOCK_SCRIPT, 1, f"lock:{name}", token, ttl_ms))
+        except Exception as e:
+            logger.warning(f"Redis lock extend error for {name}: {e}")
+            return False
+
+    async def reserve_rate_tokens_async(
+            self, name: str, interval_ms: float, tolerance_ms: float, count: int
+    ) -> Optional[Tuple[int, float]]:
+        """Берёт до count токенов общего лимита name: (выдано, сколько мс ждать,
+        если не выдано ни одного). None - Redis недоступен
+        """
+        try:
+            granted, wait_ms = await self.aclient.eval(
+                RATE_LIMIT_SCRIPT, 1, f"ratelimit:{name}", interval_ms, tolerance_ms, count
+            )
+        except Exception as e:
+            logger.warning(f"Redis rate limit error for {name}: {e}")
             return None
+        return int(granted), float(wait_ms)
 
-    def get_keys_by_pattern(self, pattern: str) -> List[str]:
+    async def get_ttls_async(self, keys: List[str]) -> List[Optional[float]]:
+        """Оставшийся срок жизни ключей в секундах (None - ключа нет или срока нет)"""
+        if not keys:
+            return []
+        try:
+            async with self.aclient.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.pttl(key)
+                pttls = await pipe.execute()
+        except Exception:
+            return [None] * len(keys)
+        return [self._remaining_ttl(pttl) for pttl in pttls]
+
+    async def exist_many_async(self, keys: List[str]) -> Optional[List[bool]]:
+        """Есть ли ключи в Redis (EXISTS в одном pipeline); None - Redis недоступен"""
+        if not keys:
+            return []
+        try:
+            async with self.aclient.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.exists(key)
+                return [bool(found) for found in await pipe.execute()]
+        except Exception:
+            return None
+
+    async def get_keys_by_pattern_async(self, pattern: str, limit: Optional[int] = None) -> List[str]:
+        """Ключи по шаблону через SCAN; с limit сканирование останавливается на limit ключах"""
+        keys = []
+        try:
+            async for key in self.aclient.scan_iter(match=pattern, count=1000):
+                keys.append(key)
+                if limit is not None and len(keys) >= limit:
+                    break
+        except Exception:
+            return []
+        return keys
+
+    @staticmethod
+    def _metrics_index_key(user_id: str) -> str:
+        return f"metrics_index:{user_id}"
+
+    async def add_metrics_async(self, user_id: str, timestamp: float, value: dict) -> bool:
+        """Сохраняет метрики запроса и индексирует их в sorted set пользователя по времени.
+
+        Записи старше METRICS_RETENTION и сверх METRICS_MAX_PER_USER вычищаются
+        из индекса в том же pipeline; сами ключи истекают по TTL.
+        """
+        key = f"metrics:{user_id}:{int(timestamp * 1000)}"
+        index_key = self._metrics_index_key(user_id)
+        retention = settings.METRICS_RETENTION
+        try:
+            async with self.aclient.pipeline(transaction=False) as pipe:
+                pipe.setex(key, retention, json.dumps(value))
+                pipe.zadd(index_key, {key: timestamp})
+                pipe.zremrangebyscore(index_key, "-inf", f"({timestamp - retention}")
+                pipe.zremrangebyrank(index_key, 0, -settings.METRICS_MAX_PER_USER - 1)
+                pipe.expire(index_key, retention)
+                await pipe.execute()
+            return True
+        except Exception:
+            return False
+
+    async def get_recent_metrics_async(self, user_id: str, limit: int = 10) -> List[dict]:
+        """Последние метрики пользователя: ZREVRANGE по индексу и один MGET"""
+        if limit <= 0:
+            return []
+        try:
+            keys = await self.aclient.zrevrange(self._metrics_index_key(user_id), 0, limit - 1)
+            if not keys:
+                return []
+            values = await self.aclient.mget(keys)
+        except Exception:
+            return []
+
+        metrics = []
+        for data in values:
+            try:
+                value = self._decode(data)
+            except Exception:
+                continue
+            if value is not None:
+                metrics.append(value)
+        return metrics
+
+    async def add_profile_async(self, profile_id: str, timestamp: float, value: dict, ttl: int, max_stored: int) -> bool:
+        """Сохраняет профиль запроса и индексирует его по времени, как метрики"""
+        key = f"profile:{profile_id}"
+        try:
+            async with self.aclient.pipeline(transaction=False) as pipe:
+                pipe.setex(key, ttl, json.dumps(value))
+                pipe.zadd(PROFILES_INDEX_KEY, {profile_id: timestamp})
+                pipe.zremrangebyscore(PROFILES_INDEX_KEY, "-inf", f"({timestamp - ttl}")
+                pipe.zremrangebyrank(PROFILES_INDEX_KEY, 0, -max_stored - 1)
+                await pipe.execute()
+            return True
+        except Exception:
+            return False
+
+    async def get_recent_profiles_async(self, limit: int = 50) -> List[dict]:
+        """Последние профили (без стеков) по убыванию времени"""
+        if limit <= 0:
+            return []
+        try:
+            ids = await self.aclient.zrevrange(PROFILES_INDEX_KEY, 0, limit - 1)
+            if not ids:
+                return []
+            values = await self.aclient.mget([f"profile:{profile_id.decode()}" for profile_id in ids])
+        except Exception:
+            return []
+        profiles = []
+        for data in values:
+            if data:
+                profile = json.loads(data)
+                profile.pop("stacks", None)
+                profiles.append(profile)
+        return profiles
+
+    async def get_profile_async(self, profile_id: str) -> Optional[dict]:
+        try:
+            data = await self.aclient.get(f"profile:{profile_id}")
+        except Exception:
+            return None
+        return json.loads(data) if data else None
+
+    @staticmethod
+    def _library_key(steam_id: str, part: str) -> str:
+        return f"user_library:{steam_id}:{part}"
+
+    async def index_user_library_async(
+            self,
+            steam_id: str,
+            games: List[Dict],
+            meta: Dict[str, Any],
+            fields: Tuple[str, ...],
+            ttl: int
+    ) -> bool:
+        """Заменяет индексы библиотеки одной транзакцией: meta (hash), записи
+        игр по appid (hash) и sorted set'ы appid по каждому из полей fields
+        """
+        keys = [self._library_key(steam_id, part) for part in ("meta", "games", *fields)]
+        try:
+            async with self.aclient.pipeline(transaction=True) as pipe:
+                pipe.delete(*keys)
+                pipe.hset(keys[0], mapping={name: json.dumps(value) for name, value in meta.items()})
+                if games:
+                    pipe.hset(keys[1], mapping={
+                        game['appid']: self.codec.encode("user_library", game) for game in games
+                    })
+                    for key, field in zip(keys[2:], fields):
+                        pipe.zadd(key, {game['appid']: game.get(field) or 0 for game in games})
+                for key in keys:
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to index library of {steam_id}: {e}")
+            return False
+
+    async def get_user_library_meta_async(self, steam_id: str) -> Optional[Dict[str, Any]]:
+        """meta библиотеки; None - библиотека не проиндексирована или Redis недоступен"""
+        try:
+            raw = await self.aclient.hgetall(self._library_key(steam_id, "meta"))
+        except Exception:
+            return None
+        if not raw:
+            return None
+        return {
+            (name.decode() if isinstance(name, bytes) else name): json.loads(value)
+            for name, value in raw.items()
+        }
+
+    async def range_user_library_async(
+            self,
+            steam_id: str,
+            field: str,
+            offset: int = 0,
+            count: int = -1,
+            descending: bool = True,
+            min_score: Optional[str] = None
+    ) -> List[int]:
+        """appid из sorted set'а по полю: count штук начиная с offset (-1 - все),
+        с min_score - только со значением не меньше него ("(0" - строго больше 0)
+        """
+        key = self._library_key(steam_id, field)
+        try:
+            if min_score is None:
+                stop = -1 if count < 0 else offset + count - 1
+                if descending:
+                    members = await self.aclient.zrevrange(key, offset, stop)
+                else:
+                    members = await self.aclient.zrange(key, offset, stop)
+            elif descending:
+                members = await self.aclient.zrevrangebyscore(key, "+inf", min_score, start=offset, num=count)
+            else:
+                members = await self.aclient.zrangebyscore(key, min_score, "+inf", start=offset, num=count)
+        except Exception:
+            return []
+        return [int(member) for member in members]
+
+    async def range_user_library_after_async(
+            self,
+            steam_id: str,
+            field: str,
+            after: Optional[Tuple[int, int]],
+            count: int,
+            descending: bool = True,
+            min_score: Optional[str] = None
+    ) -> List[Tuple[int, float]]:
+        """count пар (appid, значение) из sorted set'а по полю строго после
+        позиции after = (значение, appid), с min_score - не меньше него.
+
+        Диапазон начинается со значения after, поэтому вставки и удаления
+        до него страницу не сдвигают. Равные значения Redis упорядочивает
+        по appid: если after всё ещё в индексе с тем же значением, равные
+        до него включительно пропускаются по его рангу, иначе могут
+        повториться, но не потеряются.
+        """
+        key = self._library_key(steam_id, field)
+        lower = min_score if min_score is not None else "-inf"
         try:
-            return self.client.keys(pattern)
+            skip = 0
+            if after is None:
+                start = "+inf" if descending else lower
+            else:
+                score, appid = after
+                start = str(score)
+                async with self.aclient.pipeline(transaction=False) as pipe:
+                    pipe.zscore(key, appid)
+                    if descending:
+                        pipe.zrevrank(key, appid)
+                        pipe.zcount(key, f"({score}", "+inf")
+                    else:
+                        pipe.zrank(key, appid)
+                        pipe.zcount(key, "-inf", f"({score}")
+                    current, rank, ahead = await pipe.execute()
+                if current is not None and current == score and rank is not None:
+                    skip = rank - ahead + 1
+            if descending:
+                members = await self.aclient.zrevrangebyscore(
+                    key, start, lower, start=skip, num=count, withscores=True
+                )
+            else:
+                members = await self.aclient.zrangebyscore(
+                    key, start, "+inf", start=skip, num=count, withscores=True
+                )
         except Exception:
             return []
+        return [(int(member), value) for member, value in members]
+
+    async def get_user_library_games_async(self, steam_id: str, appids: List[int]) -> List[Optional[Dict]]:
+        """Записи игр библиотеки по appid (HMGET), None - записи нет"""
+        if not appids:
+            return []
+        try:
+            values = await self.aclient.hmget(self._library_key(steam_id, "games"), appids)
+        except Exception:
+            return [None] * len(appids)
+        games = []
+        for data in values:
+            try:
+                games.append(self._decode(data))
+            except Exception:
+                games.append(None)
+        return games
+
+    async def mark_library_changed_async(self, steam_id: str, timestamp: float, retention: float) -> bool:
+        """Отмечает загрузку библиотеки в журнале изменений (sorted set по времени).
+
+        Записи старше retention вычищаются в том же pipeline.
+        """
+        try:
+            async with self.aclient.pipeline(transaction=False) as pipe:
+                pipe.zadd(LIBRARY_CHANGES_KEY, {steam_id: timestamp})
+                pipe.zremrangebyscore(LIBRARY_CHANGES_KEY, "-inf", f"({timestamp - retention}")
+                await pipe.execute()
+            return True
+        except Exception:
+            return False
+
+    async def get_changed_libraries_async(self, since: float) -> Optional[List[Tuple[str, float]]]:
+        """(steam_id, время) библиотек, загруженных после since; None - Redis недоступен"""
+        try:
+            changes = await self.aclient.zrangebyscore(LIBRARY_CHANGES_KEY, f"({since}", "+inf", withscores=True)
+        except Exception:
+            return None
+        return [(member.decode() if isinstance(member, bytes) else member, score) for member, score in changes]
+
+    async def get_recent_libraries_async(self, limit: int) -> List[str]:
+        """steam_id последних limit загруженных библиотек из журнала изменений"""
+        try:
+            members = await self.aclient.zrevrange(LIBRARY_CHANGES_KEY, 0, limit - 1)
+        except Exception:
+            return []
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+    def _invalidation_message(self, key: str) -> str:
+        return json.dumps({"origin": self.instance_id, "key": key})
+
+    def _publish_invalidation(self, key: str) -> None:
+        if settings.L1_INVALIDATION_ENABLED:
+            self.client.publish(settings.L1_INVALIDATION_CHANNEL, self._invalidation_message(key))
+
+    async def _publish_invalidation_async(self, key: str) -> None:
+        if settings.L1_INVALIDATION_ENABLED:
+            await self.aclient.publish(settings.L1_INVALIDATION_CHANNEL, self._invalidation_message(key))
+
+    async def listen_invalidations(self) -> None:
+        """Сбрасывает записи L1, изменённые другими воркерами (Redis pub/sub)"""
+        while True:
+            try:
+                pubsub = self.aclient.pubsub()
+                await pubsub.subscribe(settings.L1_INVALIDATION_CHANNEL)
+                try:
+                    async for message in pubsub.listen():
+                        if message.get("type") != "message":
+                            continue
+                        try:
+                            payload = json.loads(message["data"])
+                        except (TypeError, ValueError):
+                            continue
+                        if payload.get("origin") != self.instance_id:
+                            self.local.invalidate(payload.get("key", ""))
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Пока подписки не было, инвалидации могли потеряться
+                logger.warning(f"L1 invalidation listener error: {e}")
+                self.local.clear()
+                await asyncio.sleep(1)
+
+
+redis_service = RedisService()
 
-redis_service = RedisService()
\ No newline at end of file
+registry.gauge(
+    "playiter_l1_cache_items", "Entries in the in-process L1 cache",
+    lambda: {(): len(redis_service.local)}
+)
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Set
+
+from ..config import settings
+from ..utils.aio import LoopLocal
+from ..utils.instrumentation import detach_trace, registry
+from ..utils.ratelimit import PRIORITY_BACKGROUND, set_priority
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundRefresher:
+    """Фоновое обновление устаревших записей кэша (stale-while-revalidate).
+
+    Одновременно обновляется не больше max_concurrency ключей на event loop,
+    повторные запросы на уже запланированный ключ игнорируются.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self._semaphores = LoopLocal(lambda: asyncio.Semaphore(max_concurrency))
+        self._pending: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "served_stale": 0,
+            "refresh_scheduled": 0,
+            "refresh_succeeded": 0,
+            "refresh_failed": 0,
+        }
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def mark_served_stale(self) -> None:
+        with self._lock:
+            self.stats["served_stale"] += 1
+
+    def schedule(self, key: str, refresh: Callable[[], Awaitable]) -> bool:
+        """Планирует обновление ключа в текущем event loop"""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            self.stats["refresh_scheduled"] += 1
+
+        task = asyncio.get_running_loop().create_task(self._run(key, refresh))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, key: str, refresh: Callable[[], Awaitable]) -> None:
+        # Обновление не должно попадать в разбивку запроса, который его запланировал,
+        # и уступает лимит Steam интерактивным запросам
+        detach_trace()
+        set_priority(PRIORITY_BACKGROUND)
+        try:
+            async with self._semaphores.get():
+                await refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Background refresh failed for {key}: {e}")
+            with self._lock:
+                self.stats["refresh_failed"] += 1
+        else:
+            with self._lock:
+                self.stats["refresh_succeeded"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    async def drain(self) -> None:
+        """Ждёт завершения запланированных обновлений текущего event loop"""
+        loop = asyncio.get_running_loop()
+        tasks = [task for task in self._tasks if task.get_loop() is loop]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+refresher = BackgroundRefresher(settings.SWR_REFRESH_CONCURRENCY)
+
+registry.gauge(
+    "playiter_swr_events", "Stale-while-revalidate events since start",
+    lambda: {(event,): value for event, value in refresher.stats.items()},
+    ("event",)
+)
+registry.gauge(
+    "playiter_swr_refresh_pending", "Background refreshes scheduled or running",
+    lambda: {(): refresher.pending()}
+)
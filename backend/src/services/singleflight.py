@@ -0,0 +1,115 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple, TypeVar
+
+from ..config import settings
+from .redis import redis_service
+
+T = TypeVar("T")
+
+# Повторная проверка кэша: (найдено, значение)
+Recheck = Callable[[], Awaitable[Tuple[bool, T]]]
+
+
+class _FlightAbandoned(Exception):
+    """Лидер был отменён - ожидающие должны повторить попытку сами"""
+
+
+class SingleFlight:
+    """Объединяет одновременные загрузки одного ключа в одну.
+
+    Внутри процесса ожидание идёт через concurrent.futures.Future, поэтому
+    работает между корутинами разных event loop'ов и потоками. Если включён
+    distributed-режим и передан recheck, лидер дополнительно берёт короткую
+    блокировку в Redis: остальные воркеры в это время опрашивают кэш.
+    Сама загрузка выполняется в отдельной задаче, которую не прерывает
+    отмена ни одного из ожидающих, включая лидера.
+    """
+
+    def __init__(self, distributed: bool = False, lock_ttl_ms: int = 10000, poll_interval: float = 0.1):
+        self.distributed = distributed
+        self.lock_ttl_ms = lock_ttl_ms
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        # Ссылки на задачи загрузок, чтобы их не собрал сборщик мусора
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], recheck: Optional[Recheck] = None) -> T:
+        while True:
+            with self._lock:
+                future = self._inflight.get(key)
+                leader = future is None
+                if leader:
+                    future = concurrent.futures.Future()
+                    self._inflight[key] = future
+
+            if leader:
+                # Загрузка идёт в своей задаче: отмена или срок запроса лидера
+                # ограничивают только его ожидание, а не общую загрузку
+                task = asyncio.ensure_future(self._run(key, future, fn, recheck))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            try:
+                # shield: отмена одного ожидающего не должна отменять общий future
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _FlightAbandoned:
+                continue
+
+    async def _run(
+            self,
+            key: str,
+            future: concurrent.futures.Future,
+            fn: Callable[[], Awaitable[T]],
+            recheck: Optional[Recheck]
+    ) -> None:
+        try:
+            result = await self._lead(key, fn, recheck)
+        except asyncio.CancelledError:
+            # Задачу отменили вместе с её event loop
+            if not future.done():
+                future.set_exception(_FlightAbandoned())
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[T]], recheck: Optional[Recheck]) -> T:
+        if not (self.distributed and recheck):
+            return await fn()
+
+        lock_name = f"singleflight:{key}"
+        deadline = time.monotonic() + self.lock_ttl_ms / 1000
+        token = await redis_service.acquire_lock_async(lock_name, self.lock_ttl_ms)
+        while token is None and time.monotonic() < deadline:
+            # Загрузкой уже занят другой воркер - ждём результат в кэше
+            await asyncio.sleep(self.poll_interval)
+            found, value = await recheck()
+            if found:
+                return value
+            token = await redis_service.acquire_lock_async(lock_name, self.lock_ttl_ms)
+
+        try:
+            return await fn()
+        finally:
+            if token is not None:
+                await redis_service.release_lock_async(lock_name, token)
+
+
+steam_flights = SingleFlight(
+    distributed=settings.SINGLEFLIGHT_DISTRIBUTED,
+    lock_ttl_ms=settings.SINGLEFLIGHT_LOCK_TTL_MS,
+    poll_interval=settings.SINGLEFLIGHT_POLL_INTERVAL
+)
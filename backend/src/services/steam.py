@@ -1,21 +1,75 @@
-import requests
-from typing import List, Dict, Optional
+import asyncio
+import httpx
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Tuple
 from ..config import settings
 from ..services.redis import redis_service
-from ..models.game import Game
+from ..services.cache import is_negative
+from ..services.catalog import catalog_store
+from ..services.library import user_libraries
+from ..services.profiles import user_profiles
+from ..services.singleflight import steam_flights
+from ..services.refresh import refresher
+from ..services.http import get_http_client
+from ..models.game import GameRecord
+from ..utils.aio import run_sync
+from ..utils.deadline import remaining
+from ..utils.fragments import cache_payload
+from ..utils.ratelimit import SharedRateLimiter, current_priority
+from ..utils.tag_index import tag_index
+from ..utils.resilience import AIMDLimiter, Backoff, CircuitBreaker, CLOSED, HALF_OPEN, OPEN, parse_retry_after
+from ..utils.instrumentation import (
+    registry, record_cache_lookup, record_rate_limit_wait, record_steam_error, record_steam_request, record_steam_retry
+)
 import logging
 import time
 
 logger = logging.getLogger(__name__)
 
+ENDPOINTS = ("GetOwnedGames", "appdetails", "GetMostPlayedGames")
+
+
+class SteamUnavailable(httpx.HTTPError):
+    """Steam не вызывался или ответ не дождались: предохранитель разомкнут,
+    истёк срок запроса к backend или время ушло на ожидание лимита
+    """
+
+
+def make_rate_limiter(endpoint: str, rate: float, burst: float) -> SharedRateLimiter:
+    return SharedRateLimiter(
+        endpoint, rate, burst,
+        reserve=redis_service.reserve_rate_tokens_async if settings.STEAM_RATE_DISTRIBUTED else None,
+        background_share=settings.STEAM_RATE_BACKGROUND_SHARE,
+        local_batch=settings.STEAM_RATE_LOCAL_BATCH,
+        local_ttl=settings.STEAM_RATE_LOCAL_TTL
+    )
+
 
 class SteamService:
     def __init__(self):
-        self.base_url = "https://api.steampowered.com"
-        self.store_url = "https://store.steampowered.com/api"
+        self.base_url = settings.STEAM_API_URL
+        self.store_url = settings.STEAM_STORE_URL
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
+        # Лимиты запросов на endpoint, общие для кластера через Redis
+        self.rate_limiters = {
+            "appdetails": make_rate_limiter("appdetails", settings.STEAM_STORE_RATE, settings.STEAM_STORE_BURST),
+            "GetOwnedGames": make_rate_limiter("GetOwnedGames", settings.STEAM_WEBAPI_RATE, settings.STEAM_WEBAPI_BURST),
+            "GetMostPlayedGames": make_rate_limiter(
+                "GetMostPlayedGames", settings.STEAM_WEBAPI_RATE, settings.STEAM_WEBAPI_BURST
+            ),
+        }
+        self.backoff = Backoff(settings.STEAM_RETRY_BASE_DELAY, settings.STEAM_RETRY_MAX_DELAY)
+        self.concurrency = {
+            endpoint: AIMDLimiter(
+                settings.STEAM_CONCURRENCY_INITIAL, settings.STEAM_CONCURRENCY_MIN, settings.STEAM_CONCURRENCY_MAX
+            )
+            for endpoint in ENDPOINTS
+        }
+        self.breakers = {
+            endpoint: CircuitBreaker(settings.STEAM_BREAKER_FAILURES, settings.STEAM_BREAKER_RESET)
+            for endpoint in ENDPOINTS
+        }
         # Whitelist для категорий и жанров
         # Whitelist для категорий (точные названия из Steam)
         self.category_whitelist = {
@@ -52,121 +106,398 @@ class SteamService:
         return [genre for genre in genres if genre in self.genre_whitelist]
 
     def get_user_games(self, steam_id: str) -> List[Dict]:
+        return run_sync(self.get_user_games_async(steam_id))
+
+    def get_game_details(self, appid: int) -> Optional[GameRecord]:
+        return run_sync(self.get_game_details_async(appid))
+
+    def get_game_details_many(self, appids: List[int]) -> List[Optional[GameRecord]]:
+        return run_sync(self.get_game_details_many_async(appids))
+
+    def get_popular_games(self) -> List[Dict]:
+        return run_sync(self.get_popular_games_async())
+
+    async def _request(self, endpoint: str, url: str, **kwargs) -> httpx.Response:
+        """GET к Steam с общим лимитом, повторами, AIMD-лимитом и предохранителем endpoint'а.
+
+        429, 5xx и сетевые ошибки повторяются с экспоненциальной задержкой
+        (или по Retry-After), пока укладываемся в STEAM_REQUEST_DEADLINE;
+        Retry-After дольше задержки backoff или оставшегося срока - сразу
+        SteamUnavailable.
+        Срок запроса к backend сюда не доходит: загрузку ждут и другие
+        запросы (single-flight), каждый ограничивает ожидание сам (_flight).
+        Разомкнутый предохранитель и срок, ушедший на ожидание лимита, -
+        SteamUnavailable; последний ответ с ошибкой возвращается как есть.
+        Предохранитель считает только ошибки самого Steam и сети.
+        """
+        breaker = self.breakers[endpoint]
+        if not breaker.allow():
+            record_steam_retry(endpoint, "circuit_open")
+            raise SteamUnavailable(f"{endpoint}: circuit open, retry in {breaker.retry_in():.1f}s")
+
+        limiter = self.concurrency[endpoint]
+        deadline = time.monotonic() + settings.STEAM_REQUEST_DEADLINE
+        timeout = kwargs.pop("timeout", None)
+        attempt = 0
+        while True:
+            priority = current_priority()
+            waited, source = await self.rate_limiters[endpoint].acquire(priority)
+            record_rate_limit_wait(endpoint, priority, source, waited)
+            async with limiter:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Срок ушёл на локальное ожидание, Steam тут ни при чём
+                    raise SteamUnavailable(f"{endpoint}: deadline exceeded")
+                started = time.perf_counter()
+                try:
+                    response = await get_http_client().get(
+                        url, headers=self.headers,
+                        timeout=min(timeout, remaining) if timeout else remaining,
+                        **kwargs
+                    )
+                except httpx.TransportError as e:
+                    record_steam_request(endpoint, "error", time.perf_counter() - started)
+                    response, error = None, e
+                else:
+                    record_steam_request(endpoint, str(response.status_code), time.perf_counter() - started)
+                    error = None
+
+            retry_after = None
+            if response is not None:
+                if response.status_code == 429:
+                    limiter.on_throttle()
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if retry_after is not None and (
+                            retry_after > self.backoff.max_delay or time.monotonic() + retry_after >= deadline
+                    ):
+                        # Раньше Retry-After не повторяем: пусть отдаётся устаревшее значение
+                        breaker.record_failure()
+                        record_steam_retry(endpoint, "retry_after_too_long")
+                        raise SteamUnavailable(f"{endpoint}: throttled, retry after {retry_after:.0f}s")
+                elif response.status_code < 500:
+                    limiter.on_success()
+                    breaker.record_success()
+                    return response
+
+            attempt += 1
+            delay = self.backoff.delay(attempt, retry_after)
+            if attempt >= settings.STEAM_RETRY_ATTEMPTS or time.monotonic() + delay >= deadline:
+                breaker.record_failure()
+                if breaker.state == OPEN:
+                    logger.warning(f"Steam {endpoint} circuit opened for {breaker.reset_timeout}s")
+                if error is not None:
+                    raise error
+                return response
+
+            reason = str(response.status_code) if response is not None else "error"
+            record_steam_retry(endpoint, reason)
+            logger.info(f"Retrying Steam {endpoint} ({reason}) in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def _recheck_cache(self, cache_key: str) -> Tuple[bool, Any]:
+        cached = await redis_service.get_cached_data_async(cache_key)
+        return bool(cached), cached
+
+    async def _recheck_game_cache(self, cache_key: str) -> Tuple[bool, Optional[GameRecord]]:
+        cached = await redis_service.get_cached_data_async(cache_key)
+        return bool(cached), self._game_from_cache(cached)
+
+    @staticmethod
+    def _game_from_cache(data: Optional[Dict]) -> Optional[GameRecord]:
+        if not data or is_negative(data):
+            return None
+        return GameRecord.from_dict(data)
+
+    async def _flight(self, cache_key: str, fetch: Callable[[], Awaitable], recheck=None):
+        """Загрузка через single-flight; ожидание ограничено сроком этого запроса,
+        сама загрузка идёт в задаче single-flight и ограничена только
+        STEAM_REQUEST_DEADLINE, даже если срок истёк у её лидера
+        """
+        left = remaining()
+        if left is None:
+            return await steam_flights.do(cache_key, fetch, recheck=recheck)
+        if left <= 0:
+            raise SteamUnavailable(f"{cache_key}: deadline exceeded")
+        try:
+            return await asyncio.wait_for(steam_flights.do(cache_key, fetch, recheck=recheck), left)
+        except asyncio.TimeoutError:
+            raise SteamUnavailable(f"{cache_key}: deadline exceeded")
+
+    def _schedule_refresh(self, cache_key: str, fetch: Callable[[], Awaitable]) -> None:
+        """Отдаём устаревшее значение, а свежее загружаем в фоне"""
+        refresher.mark_served_stale()
+        refresher.schedule(cache_key, lambda: steam_flights.do(cache_key, fetch))
+
+    async def get_user_games_async(self, steam_id: str, raise_errors: bool = False) -> List[Dict]:
+        """Библиотека пользователя; при ошибке Steam - пустой список
+        или исключение, если raise_errors (пакетным рекомендациям нужно
+        отличать сбой от пустой библиотеки)
+        """
         cache_key = f"user_games:{steam_id}"
-        if cached := redis_service.get_cached_data(cache_key):
-            return cached
+        entry = await redis_service.get_cached_entry_async(cache_key)
+        if entry and entry.value:
+            if entry.stale:
+                self._schedule_refresh(cache_key, lambda: self._fetch_user_games(steam_id))
+            return entry.value
 
         try:
-            response = requests.get(
-                f"{self.base_url}/IPlayerService/GetOwnedGames/v1/",
-                params={
-                    'key': settings.STEAM_API_KEY,
-                    'steamid': steam_id,
-                    'include_appinfo': 1,
-                    'include_played_free_games': 1
-                },
-                headers=self.headers,
-                timeout=10
+            return await self._flight(
+                cache_key,
+                lambda: self._fetch_user_games(steam_id),
+                recheck=lambda: self._recheck_cache(cache_key)
             )
-            response.raise_for_status()
-            games = response.json().get('response', {}).get('games', [])
-            redis_service.cache_data(cache_key, games, ttl=86400)
-            return games
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
+            # ValueError - ответ 200 с битым или обрезанным JSON
             logger.error(f"Steam API error: {e}")
+            record_steam_error("GetOwnedGames")
+            if raise_errors:
+                raise
             return []
 
-    def get_game_details(self, appid: int) -> Optional[Game]:
+    async def _fetch_user_games(self, steam_id: str) -> List[Dict]:
+        cache_key = f"user_games:{steam_id}"
+        response = await self._request(
+            "GetOwnedGames",
+            f"{self.base_url}/IPlayerService/GetOwnedGames/v1/",
+            params={
+                'key': settings.STEAM_API_KEY,
+                'steamid': steam_id,
+                'include_appinfo': 1,
+                'include_played_free_games': 1
+            },
+            timeout=10
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if not isinstance(payload, dict):
+            raise ValueError(f"Unexpected GetOwnedGames response for {steam_id}")
+        games = payload.get('response', {}).get('games', [])
+        await redis_service.cache_data_async(
+            cache_key, games,
+            ttl=settings.USER_GAMES_HARD_TTL,
+            soft_ttl=settings.USER_GAMES_SOFT_TTL
+        )
+        await user_libraries.index_async(steam_id, games)
+        # Журнал загрузок нужен только сборщику модели совместного владения
+        if settings.COOWNERSHIP_MODEL_PATH:
+            await redis_service.mark_library_changed_async(steam_id, time.time(), settings.USER_GAMES_HARD_TTL)
+        # Профиль предпочтений догоняет библиотеку в фоне, по разнице с прошлым снимком
+        refresher.schedule(f"user_profile:{steam_id}", lambda: user_profiles.update_from_games_async(steam_id, games))
+        return games
+
+    def _catalog_first(self) -> bool:
+        """Читать ли mmap-каталог до L1/Redis.
+
+        Снимок моложе soft TTL деталей не старее свежей записи кэша. Более
+        старый - только запас после промаха кэша, иначе он скрывал бы
+        обновления stale-while-revalidate и прогрева.
+        """
+        return catalog_store.enabled and catalog_store.age() < settings.GAME_DETAILS_SOFT_TTL
+
+    def _catalog_games(self, appids: List[int]) -> Dict[int, GameRecord]:
+        games = {}
+        for appid in appids:
+            game = catalog_store.get(appid)
+            if game is not None:
+                games[appid] = game
+        record_cache_lookup("catalog", True, len(games))
+        record_cache_lookup("catalog", False, len(appids) - len(games))
+        return games
+
+    async def get_game_details_async(self, appid: int) -> Optional[GameRecord]:
         """Получаем детали игры с фильтрацией категорий и жанров"""
+        catalog_first = self._catalog_first()
+        if catalog_first:
+            game = self._catalog_games([appid]).get(appid)
+            if game is not None:
+                return game
+
         cache_key = f"game_details:{appid}"
-        cached = redis_service.get_cached_data(cache_key)
-        if cached:
-            return Game(**cached)
+        entry = await redis_service.get_cached_entry_async(cache_key)
+        if entry and entry.value:
+            if entry.stale:
+                self._schedule_refresh(cache_key, lambda: self._fetch_game_details(appid))
+            return self._game_from_cache(entry.value)
 
-        try:
-            time.sleep(0.5)
-            url = f"{self.store_url}/appdetails?appids={appid}"
-            response = requests.get(url, headers=self.headers, timeout=15)
+        if catalog_store.enabled and not catalog_first:
+            game = self._catalog_games([appid]).get(appid)
+            if game is not None:
+                return game
+        return await self._load_game_details(appid)
 
-            if response.status_code == 429:
-                logger.warning("Rate limit exceeded, waiting...")
-                time.sleep(5)
-                response = requests.get(url, headers=self.headers, timeout=15)
+    async def get_game_details_many_async(self, appids: List[int], cached_only: bool = False) -> List[Optional[GameRecord]]:
+        """Детали для списка игр: mmap-каталог (свежий - до кэша, старый -
+        после промаха), один MGET по кэшу и параллельная загрузка промахов
+        (при cached_only промахи не загружаются).
 
-            response.raise_for_status()
+        Результат идёт в порядке входных appids, None - для игр без данных.
+        """
+        unique_appids = list(dict.fromkeys(appids))
+        games: Dict[int, Optional[GameRecord]] = {}
+        catalog_first = self._catalog_first()
+        if catalog_first:
+            games.update(self._catalog_games(unique_appids))
+            unique_appids = [appid for appid in unique_appids if appid not in games]
 
-            data = response.json().get(str(appid), {})
-            if not data or not data.get('success', False):
-                return None
+        entries = await redis_service.get_many_cached_entries_async(
+            [f"game_details:{appid}" for appid in unique_appids]
+        )
 
-            game_data = data.get('data', {})
+        misses = []
+        for appid, entry in zip(unique_appids, entries):
+            if entry and entry.value:
+                if entry.stale:
+                    self._schedule_refresh(
+                        f"game_details:{appid}",
+                        lambda appid=appid: self._fetch_game_details(appid)
+                    )
+                games[appid] = self._game_from_cache(entry.value)
+            else:
+                misses.append(appid)
 
-            # Обработка года выпуска
-            release_year = None
-            release_date = game_data.get('release_date', {}).get('date', '')
-            if release_date:
-                try:
-                    release_year = int(release_date.split(',')[-1].strip())
-                except (ValueError, AttributeError):
-                    pass
-
-            # Обработка и фильтрация категорий
-            categories = []
-            for cat in game_data.get('categories', []):
-                if isinstance(cat, dict) and 'description' in cat:
-                    categories.append(cat['description'])
-            categories = self._filter_categories(categories)
-
-            # Обработка и фильтрация жанров
-            genres = []
-            for genre in game_data.get('genres', []):
-                if isinstance(genre, dict) and 'description' in genre:
-                    genres.append(genre['description'])
-            genres = self._filter_genres(genres)
-
-            # Обработка рекомендаций
-            recommendations = game_data.get('recommendations', {}).get('total', 0)
-            if not isinstance(recommendations, int):
-                recommendations = 0
-
-            game = Game(
-                steam_appid=appid,
-                name=game_data.get('name', f"Game {appid}"),
-                categories=categories,
-                genres=genres,
-                recommendations=recommendations,
-                release_year=release_year
-            )
+        if misses and catalog_store.enabled and not catalog_first:
+            found = self._catalog_games(misses)
+            games.update(found)
+            misses = [appid for appid in misses if appid not in found]
 
-            redis_service.cache_data(cache_key, game.dict(), 3600)
-            return game
+        if misses and not cached_only:
+            fetched = await asyncio.gather(*(self._load_game_details(appid) for appid in misses))
+            games.update(zip(misses, fetched))
 
-        except requests.exceptions.RequestException as e:
+        return [games.get(appid) for appid in appids]
+
+    async def _load_game_details(self, appid: int) -> Optional[GameRecord]:
+        """Загрузка промаха через single-flight: один запрос к Steam на appid"""
+        cache_key = f"game_details:{appid}"
+        try:
+            return await self._flight(
+                cache_key,
+                lambda: self._fetch_game_details(appid),
+                recheck=lambda: self._recheck_game_cache(cache_key)
+            )
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"Request error for appid {appid}: {e}")
+            record_steam_error("appdetails")
         except Exception as e:
             logger.error(f"Error processing game {appid}: {e}")
+            record_steam_error("appdetails")
 
         return None
 
-    def get_popular_games(self) -> List[Dict]:
+    async def _fetch_game_details(self, appid: int) -> Optional[GameRecord]:
+        """Загружает детали игры из Store API и кладёт их в кэш"""
+        cache_key = f"game_details:{appid}"
+        url = f"{self.store_url}/appdetails"
+        params = {'appids': appid}
+        response = await self._request(
+            "appdetails", url, params=params, timeout=15
+        )
+        response.raise_for_status()
+
+        game = self._parse_game_details(appid, response.json())
+        if game is None:
+            await redis_service.cache_negative_async(cache_key, settings.NEGATIVE_CACHE_TTL)
+            return None
+
+        await redis_service.cache_data_async(
+            cache_key, cache_payload(game),
+            ttl=settings.GAME_DETAILS_HARD_TTL,
+            soft_ttl=settings.GAME_DETAILS_SOFT_TTL
+        )
+        tag_index.update_game(game)
+        return game
+
+    def _parse_game_details(self, appid: int, payload: Dict) -> Optional[GameRecord]:
+        """Разбирает ответ appdetails в GameRecord"""
+        data = payload.get(str(appid), {})
+        if not data or not data.get('success', False):
+            return None
+
+        game_data = data.get('data', {})
+
+        # Обработка года выпуска
+        release_year = None
+        release_date = game_data.get('release_date', {}).get('date', '')
+        if release_date:
+            try:
+                release_year = int(release_date.split(',')[-1].strip())
+            except (ValueError, AttributeError):
+                pass
+
+        # Обработка и фильтрация категорий
+        categories = []
+        for cat in game_data.get('categories', []):
+            if isinstance(cat, dict) and 'description' in cat:
+                categories.append(cat['description'])
+        categories = self._filter_categories(categories)
+
+        # Обработка и фильтрация жанров
+        genres = []
+        for genre in game_data.get('genres', []):
+            if isinstance(genre, dict) and 'description' in genre:
+                genres.append(genre['description'])
+        genres = self._filter_genres(genres)
+
+        # Обработка рекомендаций
+        recommendations = game_data.get('recommendations', {}).get('total', 0)
+        if not isinstance(recommendations, int):
+            recommendations = 0
+
+        return GameRecord(
+            steam_appid=appid,
+            name=game_data.get('name', f"Game {appid}"),
+            categories=categories,
+            genres=genres,
+            recommendations=recommendations,
+            release_year=release_year
+        )
+
+    async def get_popular_games_async(self) -> List[Dict]:
         """Получаем список популярных игр"""
         cache_key = "popular_games"
-        cached = redis_service.get_cached_data(cache_key)
-        if cached:
-            return cached
+        entry = await redis_service.get_cached_entry_async(cache_key)
+        if entry and entry.value:
+            if entry.stale:
+                self._schedule_refresh(cache_key, self._fetch_popular_games)
+            return entry.value
 
         try:
-            url = f"{self.base_url}/ISteamChartsService/GetMostPlayedGames/v1/"
-            response = requests.get(url, headers=self.headers, timeout=15)
-            response.raise_for_status()
-
-            games = response.json().get('response', {}).get('ranks', [])
-            redis_service.cache_data(cache_key, games, 7200)
-            return games
-
+            return await self._flight(
+                cache_key,
+                self._fetch_popular_games,
+                recheck=lambda: self._recheck_cache(cache_key)
+            )
         except Exception as e:
             logger.error(f"Error fetching popular games: {e}")
+            record_steam_error("GetMostPlayedGames")
             return []
 
+    async def _fetch_popular_games(self) -> List[Dict]:
+        cache_key = "popular_games"
+        url = f"{self.base_url}/ISteamChartsService/GetMostPlayedGames/v1/"
+        response = await self._request("GetMostPlayedGames", url, timeout=15)
+        response.raise_for_status()
+
+        games = response.json().get('response', {}).get('ranks', [])
+        await redis_service.cache_data_async(
+            cache_key, games,
+            ttl=settings.POPULAR_GAMES_HARD_TTL,
+            soft_ttl=settings.POPULAR_GAMES_SOFT_TTL
+        )
+        tag_index.set_candidates([game['appid'] for game in games])
+        return games
+
+steam_service = SteamService()
+
+_BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
 
-steam_service = SteamService()
\ No newline at end of file
+registry.gauge(
+    "playiter_steam_circuit_state", "Steam circuit breaker state: 0 closed, 1 half-open, 2 open",
+    lambda: {(endpoint,): _BREAKER_STATES[breaker.state] for endpoint, breaker in steam_service.breakers.items()},
+    ("endpoint",)
+)
+registry.gauge(
+    "playiter_steam_concurrency_limit", "AIMD concurrency limit for Steam requests",
+    lambda: {(endpoint,): limiter.limit for endpoint, limiter in steam_service.concurrency.items()},
+    ("endpoint",)
+)
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import weakref
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LoopLocal(Generic[T]):
+    """Хранит по одному объекту на каждый event loop.
+
+    Пулы соединений httpx и redis.asyncio привязаны к циклу, в котором
+    созданы, поэтому uvicorn и фоновый цикл синхронного фасада получают
+    собственные экземпляры.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._items: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, T]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        loop = asyncio.get_running_loop()
+        item = self._items.get(loop)
+        if item is None:
+            with self._lock:
+                item = self._items.get(loop)
+                if item is None:
+                    item = self._factory()
+                    self._items[loop] = item
+        return item
+
+    def pop(self) -> Optional[T]:
+        """Убирает объект текущего цикла (например, перед его закрытием)"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            return self._items.pop(loop, None)
+
+
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_loop_lock = threading.Lock()
+
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None or _sync_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="sync-facade-loop", daemon=True)
+            thread.start()
+            _sync_loop = loop
+        return _sync_loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """Выполняет корутину из синхронного кода в общем фоновом цикле"""
+    future = asyncio.run_coroutine_threadsafe(coro, _get_sync_loop())
+    return future.result()
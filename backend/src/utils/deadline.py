@@ -0,0 +1,29 @@
+import contextvars
+import time
+from typing import Optional
+
+# Срок запроса по time.monotonic(); наследуется задачами, созданными в его контексте
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def deadline_after(seconds: float) -> float:
+    return time.monotonic() + seconds
+
+
+def set_deadline(deadline: Optional[float]) -> None:
+    _deadline.set(deadline)
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Секунд до срока запроса (может быть отрицательным); None - срока нет"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
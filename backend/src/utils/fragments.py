@@ -0,0 +1,94 @@
+"""Ответы API из заранее закодированных JSON-фрагментов.
+
+Публичное представление игры (с store_url) и ответ /game меняются только
+вместе с её деталями, поэтому кодируются один раз при загрузке деталей и
+хранятся в кэше и в снимке каталога рядом с ними. Ответ собирается склейкой байтов: верхний уровень кодируется
+здесь, фрагменты игр (bytes) вставляются как есть, без моделей и jsonable_encoder.
+"""
+import importlib.util
+import json
+from typing import Any, Dict, Union
+
+from fastapi.responses import Response
+
+from ..models.game import Game, GameRecord
+
+STORE_URL = "https://store.steampowered.com/app/{}"
+
+# orjson - опциональная зависимость, без неё кодируем стандартным json
+if importlib.util.find_spec("orjson") is not None:
+    import orjson
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def public_payload(game: Union[Game, GameRecord]) -> Dict[str, Any]:
+    """Игра в ответах рекомендаций"""
+    return {
+        "name": game.name,
+        "appid": game.steam_appid,
+        "categories": game.categories,
+        "genres": game.genres,
+        "recommendations": game.recommendations,
+        "release_year": game.release_year,
+        "store_url": STORE_URL.format(game.steam_appid)
+    }
+
+
+def game_fragment(game: Union[Game, GameRecord]) -> bytes:
+    """Фрагмент игры; у GameRecord кодируется один раз и запоминается"""
+    fragment = getattr(game, "fragment", None)
+    if fragment is None:
+        fragment = dumps(public_payload(game))
+        if isinstance(game, GameRecord):
+            game.fragment = fragment
+    return fragment
+
+
+def detail_fragment(game: Union[Game, GameRecord]) -> bytes:
+    """Ответ /game; у GameRecord кодируется один раз и запоминается"""
+    fragment = getattr(game, "detail_fragment", None)
+    if fragment is None:
+        fragment = dumps(game.dict())
+        if isinstance(game, GameRecord):
+            game.detail_fragment = fragment
+    return fragment
+
+
+def cache_payload(game: Union[Game, GameRecord]) -> Dict[str, Any]:
+    """Детали игры для кэша вместе с фрагментами ответов"""
+    return {
+        **game.dict(),
+        "fragment": game_fragment(game).decode(),
+        "detail_fragment": detail_fragment(game).decode()
+    }
+
+
+def encode(payload: Dict[str, Any]) -> bytes:
+    """JSON-объект, в котором значения bytes (готовый JSON) и списки из них
+    вставляются как есть, остальные значения кодируются
+    """
+    parts = []
+    for key, value in payload.items():
+        if isinstance(value, bytes):
+            encoded = value
+        elif isinstance(value, list) and value and isinstance(value[0], bytes):
+            encoded = b"[" + b",".join(value) + b"]"
+        else:
+            encoded = dumps(value)
+        parts.append(dumps(key) + b":" + encoded)
+    return b"{" + b",".join(parts) + b"}"
+
+
+class FragmentJSONResponse(Response):
+    """JSON-ответ из словаря с фрагментами (см. encode) или готовых байтов"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return encode(content)
@@ -0,0 +1,267 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Границы корзин гистограмм латентности, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # значения меток -> (счётчики по корзинам, сумма, количество)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(label_values) or ([0] * len(self.buckets), 0.0, 0)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[label_values] = (counts, total + value, count + 1)
+
+    def count(self, *label_values: str) -> int:
+        item = self._values.get(label_values)
+        return item[2] if item else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Gauge:
+    """Значения снимаются в момент отдачи метрик функцией callback"""
+
+    def __init__(self, name: str, help: str, callback: Callable[[], Dict[LabelValues, float]], labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for values, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], Dict[LabelValues, float]], labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, callback, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "playiter_recommendation_stage_seconds", "Duration of recommendation pipeline stages", ("stage",)
+)
+steam_request_seconds = registry.histogram(
+    "playiter_steam_request_seconds", "Steam API request latency", ("endpoint", "status")
+)
+steam_rate_limited = registry.counter(
+    "playiter_steam_rate_limited_total", "Steam API 429 responses", ("endpoint",)
+)
+steam_errors = registry.counter(
+    "playiter_steam_errors_total", "Failed Steam API calls", ("endpoint",)
+)
+steam_retries = registry.counter(
+    "playiter_steam_retries_total", "Steam API retries and calls rejected by the circuit breaker", ("endpoint", "reason")
+)
+rate_limit_wait_seconds = registry.histogram(
+    "playiter_rate_limit_wait_seconds", "Time spent waiting for the Steam rate limiter", ("endpoint", "priority")
+)
+rate_limit_tokens = registry.counter(
+    "playiter_rate_limit_tokens_total", "Steam rate limit tokens by source (local batch, Redis, per-process fallback)",
+    ("endpoint", "source")
+)
+cache_lookups = registry.counter(
+    "playiter_cache_lookups_total", "Cache lookups by tier and result", ("tier", "result")
+)
+result_cache_lookups = registry.counter(
+    "playiter_recommendation_cache_total", "Recommendation result cache lookups", ("result",)
+)
+
+
+def _cache_hit_ratios() -> Dict[LabelValues, float]:
+    ratios = {}
+    for tier in ("l1", "redis"):
+        hits = cache_lookups.value(tier, "hit")
+        total = hits + cache_lookups.value(tier, "miss")
+        if total:
+            ratios[(tier,)] = hits / total
+    return ratios
+
+
+registry.gauge("playiter_cache_hit_ratio", "Cache hit ratio by tier", _cache_hit_ratios, ("tier",))
+
+
+class RequestTrace:
+    """Разбивка одного запроса: длительности этапов и счётчики"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def incr(self, name: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0.0) + amount
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def start_trace() -> RequestTrace:
+    """Начинает трассировку в текущем контексте (наследуется дочерними задачами)"""
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+
+def detach_trace() -> None:
+    """Отвязывает контекст от запроса - для фоновых задач, созданных внутри него"""
+    _current_trace.set(None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def trace_incr(name: str, amount: float = 1.0) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.incr(name, amount)
+
+
+@contextmanager
+def span(stage: str):
+    """Замеряет этап конвейера: в гистограмму и в трассировку запроса"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(stage, elapsed)
+
+
+async def timed(stage: str, awaitable):
+    with span(stage):
+        return await awaitable
+
+
+def record_cache_lookup(tier: str, hit: bool, count: int = 1) -> None:
+    if count <= 0:
+        return
+    cache_lookups.inc(tier, "hit" if hit else "miss", amount=count)
+    trace_incr(f"{tier}_{'hits' if hit else 'misses'}", count)
+    # Промах L1 всегда уходит в Redis, поэтому общий промах - это промах Redis
+    if hit:
+        trace_incr("cache_hits", count)
+    elif tier == "redis":
+        trace_incr("cache_misses", count)
+
+
+def record_steam_request(endpoint: str, status: str, seconds: float) -> None:
+    steam_request_seconds.observe(seconds, endpoint, status)
+    trace_incr("steam_seconds", seconds)
+    trace_incr("steam_requests")
+    if status == "429":
+        steam_rate_limited.inc(endpoint)
+        trace_incr("rate_limited")
+
+
+def record_steam_error(endpoint: str) -> None:
+    steam_errors.inc(endpoint)
+    trace_incr("api_errors")
+
+
+def record_steam_retry(endpoint: str, reason: str) -> None:
+    steam_retries.inc(endpoint, reason)
+    trace_incr("circuit_open" if reason == "circuit_open" else "steam_retries")
+
+
+def record_rate_limit_wait(endpoint: str, priority: str, source: str, seconds: float) -> None:
+    rate_limit_wait_seconds.observe(seconds, endpoint, priority)
+    rate_limit_tokens.inc(endpoint, source)
+    if seconds > 0:
+        trace_incr("rate_limit_wait_seconds", seconds)
@@ -0,0 +1,275 @@
+"""Профилирование отдельных запросов по требованию.
+
+ProfilingMiddleware включает сэмплирующий профайлер для доли запросов
+PROFILING_SAMPLE_RATE или для запроса с заголовком X-Profile, равным
+PROFILING_TOKEN. Отдельный поток раз в PROFILING_INTERVAL_MS снимает стек
+потока event loop: если сейчас выполняется задача запроса (или созданная
+из него), записывается стек потока, иначе - цепочка await корневой задачи
+с листом [await]. Получаются wall-clock профили в collapsed-формате
+("a;b;c N"), которые понимают flamegraph.pl и speedscope.
+
+Выключенный профайлер стоит одной проверки настроек на запрос; поток
+сэмплирования и фабрика задач живут, только пока есть профилируемые запросы.
+"""
+import asyncio
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter as StackCounter
+from typing import Dict, List, Optional, Tuple
+
+from ..config import settings
+from .instrumentation import registry
+
+profiles_taken = registry.counter(
+    "playiter_profiles_total", "Profiled requests by trigger", ("trigger",)
+)
+
+PROFILE_HEADER = b"x-profile"
+REQUEST_ID_HEADER = b"x-request-id"
+PROFILE_ID_HEADER = b"x-profile-id"
+AWAIT_MARKER = "[await]"
+# X-Request-Id клиента - только поле профиля, ключ Redis всегда свой
+MAX_REQUEST_ID_LENGTH = 128
+
+# Кадр, из которого event loop вызывает шаг задачи: всё, что ниже, - сам loop
+_HANDLE_RUN_CODE = asyncio.events.Handle._run.__code__
+
+_session: contextvars.ContextVar[Optional["ProfileSession"]] = contextvars.ContextVar("profile_session", default=None)
+_labels: Dict[object, str] = {}
+
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+        label = f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+        _labels[code] = label
+    return label
+
+
+def _thread_stack(frame) -> List[str]:
+    """Стек потока от шага задачи до текущего кадра"""
+    codes = []
+    while frame is not None and frame.f_code is not _HANDLE_RUN_CODE:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return [_label(code) for code in reversed(codes)]
+
+
+def _await_chain(task: asyncio.Task) -> List[str]:
+    """Цепочка await приостановленной задачи: корутины от корня до ожидаемого"""
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        code = getattr(awaitable, "cr_code", None) or getattr(awaitable, "gi_code", None) \
+            or getattr(awaitable, "ag_code", None)
+        if code is None:
+            break
+        stack.append(_label(code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None) \
+            or getattr(awaitable, "ag_await", None)
+    stack.append(AWAIT_MARKER)
+    return stack
+
+
+class ProfileSession:
+    """Сэмплы одного запроса: задачи запроса и счётчики стеков"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, root: asyncio.Task, interval: float):
+        self.loop = loop
+        self.root = root
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet([root])
+        self.stacks: StackCounter = StackCounter()
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def sample(self, frames: Dict[int, object]) -> None:
+        """Вызывается из потока сэмплирования"""
+        frame = frames.get(self.thread_id)
+        task = asyncio.current_task(self.loop)
+        if frame is not None and task is not None and task in self.tasks:
+            stack = _thread_stack(frame)
+        else:
+            stack = _await_chain(self.root)
+        with self._lock:
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Sampler:
+    """Поток сэмплирования, общий для всех профилируемых запросов процесса"""
+
+    def __init__(self):
+        self._sessions: List[ProfileSession] = []
+        # loop -> (прежняя фабрика задач, число активных сессий в нём)
+        self._factories: Dict[asyncio.AbstractEventLoop, Tuple[Optional[object], int]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, session: ProfileSession) -> None:
+        """Вызывается в event loop запроса"""
+        loop = session.loop
+        with self._lock:
+            previous, count = self._factories.get(loop, (loop.get_task_factory(), 0))
+            if count == 0:
+                loop.set_task_factory(_task_factory(previous))
+            self._factories[loop] = (previous, count + 1)
+            self._sessions.append(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, session: ProfileSession) -> None:
+        loop = session.loop
+        with self._lock:
+            self._sessions.remove(session)
+            previous, count = self._factories[loop]
+            if count == 1:
+                loop.set_task_factory(previous)
+                del self._factories[loop]
+            else:
+                self._factories[loop] = (previous, count - 1)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                sessions = list(self._sessions)
+                if not sessions:
+                    self._thread = None
+                    return
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            for session in sessions:
+                session.sample(frames)
+            del frames
+            interval = min(session.interval for session in sessions)
+            time.sleep(max(interval - (time.perf_counter() - started), 0.0))
+
+
+def _task_factory(previous):
+    """Фабрика задач, запоминающая задачи, созданные из профилируемого запроса"""
+
+    def factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        session = _session.get()
+        if session is not None:
+            session.tasks.add(task)
+        return task
+
+    return factory
+
+
+sampler = Sampler()
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def token_matches(value: Optional[str]) -> bool:
+    """Совпадает ли значение X-Profile с PROFILING_TOKEN; без токена - никогда"""
+    token = settings.PROFILING_TOKEN
+    return bool(token) and value is not None and hmac.compare_digest(value.encode(), token.encode())
+
+
+def _trigger(scope) -> Optional[str]:
+    """Почему профилировать запрос: header, sample или None"""
+    if token_matches(_header(scope, PROFILE_HEADER)):
+        return "header"
+    rate = settings.PROFILING_SAMPLE_RATE
+    if rate > 0 and random.random() < rate:
+        return "sample"
+    return None
+
+
+def _request_id(scope) -> Optional[str]:
+    request_id = _header(scope, REQUEST_ID_HEADER)
+    return request_id[:MAX_REQUEST_ID_LENGTH] if request_id else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: профилирует выбранные запросы и сохраняет профили в Redis"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or (settings.PROFILING_SAMPLE_RATE <= 0 and not settings.PROFILING_TOKEN)
+            or scope["path"].startswith("/internal/")
+        ):
+            await self.app(scope, receive, send)
+            return
+        trigger = _trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", ()), (PROFILE_ID_HEADER, profile_id.encode())]}
+            await send(message)
+
+        session = ProfileSession(
+            asyncio.get_running_loop(),
+            asyncio.current_task(),
+            settings.PROFILING_INTERVAL_MS / 1000
+        )
+        token = _session.set(session)
+        started_at = time.time()
+        started = time.perf_counter()
+        sampler.start(session)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop(session)
+            _session.reset(token)
+            duration = time.perf_counter() - started
+            profiles_taken.inc(trigger)
+            await _store(profile_id, {
+                "id": profile_id,
+                "request_id": _request_id(scope),
+                "method": scope.get("method"),
+                "path": scope["path"],
+                "status": status,
+                "trigger": trigger,
+                "started_at": started_at,
+                "duration_ms": round(duration * 1000, 3),
+                "interval_ms": settings.PROFILING_INTERVAL_MS,
+                "samples": session.samples,
+                "pid": os.getpid(),
+                "stacks": session.collapsed(),
+            })
+
+
+async def _store(profile_id: str, profile: dict) -> None:
+    from ..services.redis import redis_service
+
+    await redis_service.add_profile_async(
+        profile_id, profile["started_at"], profile, settings.PROFILING_TTL, settings.PROFILING_MAX_STORED
+    )
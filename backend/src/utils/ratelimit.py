@@ -0,0 +1,154 @@
+import asyncio
+import contextvars
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from .aio import LoopLocal
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не более capacity подряд.
+
+    Токены резервируются под threading.Lock, а ожидание делается через
+    asyncio.sleep, поэтому один bucket можно делить между event loop'ами
+    и потоками без привязки к конкретному циклу.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """Списывает токены (возможно, в долг) и возвращает время ожидания"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def set_priority(priority: str) -> None:
+    """Класс приоритета для запросов к Steam из текущего контекста (наследуется задачами)"""
+    _priority.set(priority)
+
+
+# reserve(имя, мс на токен, допуск в мс, сколько токенов) -> (выдано, ждать мс) или None, если хранилище недоступно
+Reserve = Callable[[str, float, float, int], Awaitable[Optional[Tuple[int, float]]]]
+
+
+class SharedRateLimiter:
+    """Лимит запросов, общий для всех воркеров и узлов (GCRA в Redis).
+
+    Токены берутся из Redis пачками до local_batch штук (по числу ждущих в
+    процессе) и живут локально не дольше local_ttl секунд, так что не каждый
+    запрос платит за поход в Redis. Фоновые запросы могут занять лишь
+    background_share всплеска: когда интерактивного трафика много, они ждут.
+    Без Redis (reserve=None или ошибка) работает локальный TokenBucket.
+    """
+
+    FALLBACK_PERIOD = 5.0
+
+    def __init__(
+            self,
+            name: str,
+            rate: float,
+            burst: float,
+            reserve: Optional[Reserve] = None,
+            background_share: float = 0.5,
+            local_batch: int = 4,
+            local_ttl: float = 1.0
+    ):
+        self.name = name
+        self.interval_ms = 1000.0 / rate
+        self.tolerance_ms = {
+            PRIORITY_INTERACTIVE: max(burst, 1.0) * self.interval_ms,
+            PRIORITY_BACKGROUND: max(burst * background_share, 1.0) * self.interval_ms,
+        }
+        self.fallback = TokenBucket(rate, burst)
+        self.reserve = reserve
+        self.local_batch = max(local_batch, 1)
+        self.local_ttl = local_ttl
+        # приоритет -> (токенов на руках, когда они сгорают)
+        self._local: Dict[str, Tuple[int, float]] = {}
+        self._waiting: Dict[str, int] = {}
+        self._fallback_until = 0.0
+        self._fetching = LoopLocal(lambda: {priority: asyncio.Lock() for priority in self.tolerance_ms})
+        self._lock = threading.Lock()
+
+    def _take_local(self, priority: str) -> bool:
+        with self._lock:
+            tokens, expires = self._local.get(priority, (0, 0.0))
+            if tokens <= 0 or time.monotonic() >= expires:
+                return False
+            self._local[priority] = (tokens - 1, expires)
+            return True
+
+    async def _fetch(self, priority: str) -> bool:
+        """Берёт пачку токенов из Redis; если токенов нет - ждёт, сколько сказал Redis"""
+        wanted = min(self.local_batch, self._waiting[priority])
+        result = await self.reserve(self.name, self.interval_ms, self.tolerance_ms[priority], wanted)
+        if result is None:
+            self._fallback_until = time.monotonic() + self.FALLBACK_PERIOD
+            return False
+        granted, wait_ms = result
+        if granted <= 0:
+            await asyncio.sleep(max(wait_ms, 1.0) / 1000)
+            return False
+        if granted > 1:
+            with self._lock:
+                now = time.monotonic()
+                tokens, expires = self._local.get(priority, (0, 0.0))
+                tokens = tokens if now < expires else 0
+                self._local[priority] = (tokens + granted - 1, now + self.local_ttl)
+        return True
+
+    async def acquire(self, priority: Optional[str] = None) -> Tuple[float, str]:
+        """Ждёт токен; возвращает время ожидания и откуда взят токен: local | redis | fallback"""
+        priority = priority or current_priority()
+        if priority not in self.tolerance_ms:
+            priority = PRIORITY_INTERACTIVE
+        started = time.monotonic()
+        with self._lock:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+        try:
+            while True:
+                if self._take_local(priority):
+                    return time.monotonic() - started, "local"
+                if self.reserve is None or time.monotonic() < self._fallback_until:
+                    await self.fallback.acquire()
+                    return time.monotonic() - started, "fallback"
+
+                # За токенами в Redis ходит один запрос на цикл и приоритет, остальные ждут его пачку
+                async with self._fetching.get()[priority]:
+                    if self._take_local(priority):
+                        return time.monotonic() - started, "local"
+                    if await self._fetch(priority):
+                        return time.monotonic() - started, "redis"
+        finally:
+            with self._lock:
+                self._waiting[priority] -= 1
@@ -1,14 +1,80 @@
-from typing import List, Dict, Tuple
-from ..models.game import Game, RecommendationMetrics
+import asyncio
+import hashlib
+import json
+from typing import AsyncIterator, Iterable, List, Dict, Optional, Set, Tuple
+from ..config import settings
+from ..models.game import BatchRecommendation, Game, GameRecord, RecommendationMetrics
+from ..services.library import LibrarySummary, user_libraries
+from ..services.coownership import coownership_store
+from ..services.profiles import ranked_tags, tag_weight, user_profiles
+from ..services.redis import redis_service
 from ..services.steam import steam_service, logger
-from concurrent.futures import ThreadPoolExecutor
+from ..utils.aio import run_sync
+from ..utils.deadline import expired, remaining, set_deadline
+from ..utils.fragments import cache_payload
+from ..utils.instrumentation import current_trace, result_cache_lookups, span, start_trace, timed
+from ..utils.scoring import ScoringEngine, ScoringWeights, default_weights
+from ..utils.tag_index import tag_index
 import time
-from ..services.redis import redis_service
+
+# Сколько кандидатов запрашивать за один вызов get_game_details_many
+CANDIDATE_BATCH_SIZE = 25
+
+# Версия алгоритма в ключе кэша готовых рекомендаций: увеличивать при любом
+# изменении отбора или ранжирования, чтобы старые результаты не отдавались
+ALGORITHM_VERSION = 2
+
+scoring_engine = ScoringEngine(tag_index)
+
+
+def get_recommendations(
+        steam_id: str,
+        mode: Optional[str] = None,
+        weights: Optional[ScoringWeights] = None
+) -> Tuple[List[Game], RecommendationMetrics]:
+    """Синхронный фасад над get_recommendations_async"""
+    return run_sync(get_recommendations_async(steam_id, mode, weights))
+
+
+async def get_recommendations_async(
+        steam_id: str,
+        mode: Optional[str] = None,
+        weights: Optional[ScoringWeights] = None,
+        deadline: Optional[float] = None
+) -> Tuple[List[Game], RecommendationMetrics]:
+    """Улучшенный алгоритм рекомендаций с фильтрацией по времени игры и метриками.
+
+    mode: "scored" - векторный скоринг, "legacy" - фильтр по тегам и сортировка
+    по отзывам, "compare" - legacy со сверкой против скоринга. По умолчанию
+    берётся settings.RECOMMENDATION_MODE, weights - settings.SCORING_WEIGHTS.
+    deadline - срок по time.monotonic(), см. iter_recommendations.
+    """
+    async for event in iter_recommendations(steam_id, mode, weights, stream_matches=False, deadline=deadline):
+        if event["event"] == "result":
+            return event["recommendations"], event["metrics"]
+    raise RuntimeError("Recommendation pipeline finished without a result")
 
 
-def get_recommendations(steam_id: str) -> Tuple[List[Game], RecommendationMetrics]:
-    """Улучшенный алгоритм рекомендаций с фильтрацией по времени игры и метриками"""
+async def iter_recommendations(
+        steam_id: str,
+        mode: Optional[str] = None,
+        weights: Optional[ScoringWeights] = None,
+        stream_matches: bool = True,
+        deadline: Optional[float] = None
+) -> AsyncIterator[Dict]:
+    """Конвейер рекомендаций, отдающий промежуточные результаты по мере готовности.
+
+    События: library - размер библиотеки и самые сыгранные игры (сразу после
+    загрузки библиотеки); preferences - категории и жанры пользователя; match - кандидаты
+    с общими тегами, по мере загрузки их деталей (без ранжирования, только
+    при stream_matches); result - итоговый список и метрики. Генератор
+    продвигается только по запросу потребителя, а его закрытие или отмена
+    отменяет незавершённые загрузки из Steam.
+    """
     start_time = time.time()
+    start_trace()
+    # Срок видят и запросы к Steam внутри конвейера
+    set_deadline(deadline)
     metrics = {
         "input_games_count": 0,
         "filtered_games_count": 0,
@@ -18,105 +84,464 @@ def get_recommendations(steam_id: str) -> Tuple[List[Game], RecommendationMetric
         "cache_hits": 0,
         "cache_misses": 0,
         "api_errors": 0,
-        "execution_time": 0
+        "execution_time": 0,
+        "partial": False
     }
 
     try:
-        # 1. Параллельно получаем данные
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            user_games_future = executor.submit(steam_service.get_user_games, steam_id)
-            popular_games_future = executor.submit(steam_service.get_popular_games)
+        # 1. Параллельно получаем данные: сводку по индексу библиотеки
+        # (только сыгранные игры и топ) и популярные игры
+        library, popular_games = await asyncio.gather(
+            timed("fetch_user_games", user_libraries.summary_async(steam_id)),
+            timed("fetch_popular_games", steam_service.get_popular_games_async())
+        )
 
-            user_games = user_games_future.result()
-            popular_games = popular_games_future.result()
+        metrics["input_games_count"] = library.game_count
+        metrics["filtered_games_count"] = library.played_count
 
-        metrics["input_games_count"] = len(user_games)
+        if not library.played_count:
+            logger.warning(f"No played games found for user {steam_id}")
+            yield _result([], _create_metrics(steam_id, start_time, metrics, [], []))
+            return
 
-        # 2. Фильтруем игры с нулевым временем
-        user_games = [
-            game for game in user_games
-            if game.get('playtime_forever', 0) > 0
-        ]
-        metrics["filtered_games_count"] = len(user_games)
+        top_played = library.top_played
+        yield {
+            "event": "library",
+            "game_count": metrics["input_games_count"],
+            "played_count": library.played_count,
+            "top_games": [
+                {"appid": game['appid'], "name": game.get('name', f"AppID {game['appid']}"),
+                 "playtime_hours": game.get('playtime_forever', 0) // 60}
+                for game in top_played
+            ]
+        }
 
-        if not user_games:
-            logger.warning(f"No played games found for user {steam_id}")
-            return [], _create_metrics(steam_id, start_time, metrics, [], [])
-
-        # 3. Собираем топ игр
-        recently_played = sorted(
-            user_games,
-            key=lambda x: x.get('rtime_last_played', 0),
-            reverse=True
-        )[:25]
-
-        top_played = sorted(
-            recently_played,
-            key=lambda x: x.get('playtime_forever', 0),
-            reverse=True
-        )[:10]
-
-        # 4. Собираем категории и жанры из топовых игр
-        user_preferences = set()  # Будет содержать и категории, и жанры
-        categories = set()
-        genres = set()
-        user_appids = {g['appid'] for g in user_games}
-
-        for game in top_played:
-            details = steam_service.get_game_details(game['appid'])
-            if details:
-                if details.categories:
-                    categories.update(details.categories)
-                    user_preferences.update(details.categories)
-                if details.genres:
-                    genres.update(details.genres)
-                    user_preferences.update(details.genres)
+        mode = mode or settings.RECOMMENDATION_MODE
+        weights = weights or default_weights()
+        cache_key = result_cache_key(steam_id, mode, weights, library.fingerprint, popular_games)
+        if cache_key:
+            with span("result_cache"):
+                cached = await redis_service.get_cached_data_async(cache_key)
+            result_cache_lookups.inc("hit" if cached else "miss")
+            if cached:
+                yield _preferences(cached["categories"], cached["genres"])
+                yield _result(*_from_result_cache(steam_id, start_time, metrics, cached))
+                return
+            metrics["result_cache_hit"] = False
+
+        with span("build_preferences"):
+            # 4. Категории и жанры топовых игр - из профиля предпочтений
+            # (он пересчитывается, только если библиотека изменилась)
+            profile = await user_profiles.get_async(steam_id, library)
+            categories = ranked_tags(profile.categories)
+            genres = ranked_tags(profile.genres)
+            # Будет содержать и категории, и жанры
+            user_preferences = set(categories) | set(genres)
+            user_appids = library.played_appids
 
         metrics["categories_found"] = len(categories)
         metrics["genres_found"] = len(genres)
+        yield _preferences(categories, genres)
 
         if not user_preferences:
-            return [], _create_metrics(steam_id, start_time, metrics, list(categories), list(genres))
+            yield _result([], _create_metrics(steam_id, start_time, metrics, list(categories), list(genres)))
+            return
 
-        # 5. Фильтруем популярные игры с учетом и категорий, и жанров
-        recommended = []
+        # 5. Отбираем кандидатов среди популярных игр
+        await tag_index.load_snapshot()
         metrics["popular_games_considered"] = len(popular_games)
+        tag_index.set_candidates([game['appid'] for game in popular_games])
 
-        for game in popular_games:
-            if len(recommended) >= 25:
-                break
-
-            if game['appid'] not in user_appids:
-                details = steam_service.get_game_details(game['appid'])
-                if details:
-                    # Проверяем совпадение по категориям ИЛИ жанрам
-                    has_match = any(
-                        pref in details.categories or pref in details.genres
-                        for pref in user_preferences
-                    )
+        if stream_matches:
+            # Кандидаты, чьи теги уже известны, совпадают сразу
+            known = tag_index.match(user_preferences, user_appids, limit=len(tag_index.candidates))
+            if known:
+                yield _matches(await steam_service.get_game_details_many_async(known), user_preferences, user_appids)
 
-                    if has_match:
-                        recommended.append(details)
+        played = profile.played()
+        if mode == "scored":
+            candidates = _load_unknown_candidates(user_appids)
+        else:
+            candidates = _load_legacy_candidates(user_preferences, user_appids)
+        async for loaded in _until_deadline(candidates, metrics):
+            if stream_matches:
+                yield _matches(loaded, user_preferences, user_appids)
 
-        # 6. Сортируем по рейтингу и году
-        recommended.sort(
-            key=lambda x: (-x.recommendations, -x.release_year if x.release_year else 0)
-        )
+        if mode == "scored":
+            recommended = await _select_scored(played, user_appids, weights, metrics)
+        else:
+            recommended = await _select_legacy(user_preferences, user_appids)
+            if mode == "compare":
+                await _compare_with_scoring(recommended, played, user_appids, metrics)
+        await tag_index.save_snapshot()
 
         metrics["execution_time"] = time.time() - start_time
+        if expired():
+            metrics["partial"] = True
 
-        return recommended[:30], _create_metrics(
+        trace = current_trace()
+        # Результат, собранный с ошибками Steam или к сроку, не кэшируем: он может быть неполным
+        if cache_key and not metrics.get("partial") and not (trace and trace.counters.get("api_errors")):
+            await redis_service.cache_data_async(cache_key, {
+                "games": [cache_payload(game) for game in recommended],
+                "metrics": dict(metrics),
+                "categories": list(categories),
+                "genres": list(genres)
+            }, ttl=settings.RECOMMENDATION_CACHE_TTL)
+
+        result = _result(recommended, _create_metrics(
             steam_id,
             start_time,
             metrics,
             list(categories),
             list(genres)
-        )
+        ))
 
     except Exception as e:
         logger.error(f"Recommendation error: {e}")
         metrics["execution_time"] = time.time() - start_time
-        return [], _create_metrics(steam_id, start_time, metrics, [], [])
+        metrics["partial"] = expired()
+        result = _result([], _create_metrics(steam_id, start_time, metrics, [], []))
+
+    yield result
+
+
+def _preferences(categories: Iterable[str], genres: Iterable[str]) -> Dict:
+    return {"event": "preferences", "categories": sorted(categories), "genres": sorted(genres)}
+
+
+def _matches(games: Iterable[Optional[Game]], user_preferences: Set[str], user_appids: Set[int]) -> Dict:
+    return {
+        "event": "match",
+        "games": [
+            game for game in games
+            if game and game.steam_appid not in user_appids
+            and not user_preferences.isdisjoint(game.categories + game.genres)
+        ]
+    }
+
+
+def _result(recommended: List[Game], metrics: RecommendationMetrics) -> Dict:
+    return {"event": "result", "recommendations": recommended, "metrics": metrics}
+
+
+def popular_games_version(popular_games: List[Dict]) -> str:
+    """Версия снимка популярных игр - хэш списка appid в порядке рейтинга"""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(",".join(str(game['appid']) for game in popular_games).encode())
+    return digest.hexdigest()
+
+
+def result_cache_key(
+        steam_id: str,
+        mode: str,
+        weights: ScoringWeights,
+        fingerprint: str,
+        popular_games: List[Dict]
+) -> Optional[str]:
+    """Ключ кэша готовых рекомендаций или None, если результат не кэшируется.
+
+    Ключ меняется при изменении библиотеки, популярных игр, режима, весов,
+    модели совместного владения или ALGORITHM_VERSION, поэтому явная
+    инвалидация не нужна: старые записи просто истекают.
+    """
+    if settings.RECOMMENDATION_CACHE_TTL <= 0 or mode == "compare" or not popular_games:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (
+        str(ALGORITHM_VERSION),
+        mode,
+        json.dumps(weights.dict(), sort_keys=True),
+        popular_games_version(popular_games),
+        coownership_store.version(),
+        fingerprint
+    ):
+        digest.update(part.encode() + b"|")
+    return f"recommendation_result:{steam_id}:{digest.hexdigest()}"
+
+
+def _from_result_cache(
+        steam_id: str,
+        start_time: float,
+        metrics: Dict,
+        cached: Dict
+) -> Tuple[List[Game], RecommendationMetrics]:
+    """Рекомендации из кэша: метрики исходного расчёта плюс счётчики этого запроса"""
+    result_metrics = dict(cached["metrics"])
+    result_metrics.update(
+        input_games_count=metrics["input_games_count"],
+        filtered_games_count=metrics["filtered_games_count"],
+        result_cache_hit=True,
+        execution_time=time.time() - start_time
+    )
+    return [GameRecord.from_dict(game) for game in cached["games"]], _create_metrics(
+        steam_id, start_time, result_metrics, cached["categories"], cached["genres"]
+    )
+
+
+def get_batch_recommendations(
+        steam_ids: Iterable[str],
+        weights: Optional[ScoringWeights] = None
+) -> List[BatchRecommendation]:
+    """Синхронный фасад над iter_batch_recommendations"""
+    async def collect():
+        return [result async for result in iter_batch_recommendations(steam_ids, weights)]
+    return run_sync(collect())
+
+
+async def iter_batch_recommendations(
+        steam_ids: Iterable[str],
+        weights: Optional[ScoringWeights] = None,
+        limit: int = 25
+) -> AsyncIterator[BatchRecommendation]:
+    """Рекомендации (скоринг) для группы пользователей с общим каталогом.
+
+    Популярные игры и детали кандидатов загружаются один раз на весь пакет,
+    библиотеки - параллельно, пользователи пачки скорятся одним матричным
+    произведением. Результаты отдаются по мере готовности пачек; сбой одного
+    пользователя попадает в его результат и не прерывает остальных.
+    """
+    steam_ids = list(dict.fromkeys(steam_ids))
+    if not steam_ids:
+        return
+    weights = weights or default_weights()
+
+    popular_games = await timed("fetch_popular_games", steam_service.get_popular_games_async())
+    if not popular_games:
+        for steam_id in steam_ids:
+            yield BatchRecommendation(steam_id=steam_id, status="error", error="popular games unavailable")
+        return
+
+    await tag_index.load_snapshot()
+    tag_index.set_candidates([game['appid'] for game in popular_games])
+    async for _ in _load_unknown_candidates(set()):
+        pass
+
+    semaphore = asyncio.Semaphore(settings.RECOMMEND_BATCH_CONCURRENCY)
+
+    async def fetch_library(steam_id: str) -> LibrarySummary:
+        async with semaphore:
+            return await user_libraries.summary_async(steam_id, raise_errors=True)
+
+    def fetch_chunk(chunk: List[str]) -> asyncio.Future:
+        return asyncio.ensure_future(timed("fetch_user_games", asyncio.gather(
+            *(fetch_library(steam_id) for steam_id in chunk), return_exceptions=True
+        )))
+
+    chunk_size = max(1, settings.RECOMMEND_BATCH_CHUNK_SIZE)
+    chunks = [steam_ids[i:i + chunk_size] for i in range(0, len(steam_ids), chunk_size)]
+    pending = fetch_chunk(chunks[0])
+    try:
+        for position, chunk in enumerate(chunks):
+            libraries = await pending
+            # Библиотеки следующей пачки грузятся, пока считается текущая
+            pending = fetch_chunk(chunks[position + 1]) if position + 1 < len(chunks) else None
+            for result in await _score_chunk(chunk, libraries, weights, limit):
+                yield result
+        await tag_index.save_snapshot()
+    finally:
+        # Клиент ушёл или пакет прерван - не держим загрузки следующей пачки
+        if pending is not None and not pending.done():
+            pending.cancel()
+
+
+async def _score_chunk(
+        steam_ids: List[str],
+        libraries: List,
+        weights: ScoringWeights,
+        limit: int
+) -> List[BatchRecommendation]:
+    """Скоринг пачки пользователей против общего каталога кандидатов"""
+    results: Dict[str, BatchRecommendation] = {}
+    users: List[Tuple[str, LibrarySummary]] = []
+    for steam_id, library in zip(steam_ids, libraries):
+        if isinstance(library, BaseException):
+            if not isinstance(library, Exception):
+                raise library
+            results[steam_id] = BatchRecommendation(
+                steam_id=steam_id, status="error", error=str(library) or type(library).__name__
+            )
+            continue
+        if not library.played_count:
+            results[steam_id] = BatchRecommendation(steam_id=steam_id, status="empty")
+            continue
+        users.append((steam_id, library))
+
+    if users:
+        with span("build_preferences"):
+            profiles = await user_profiles.get_many_async(
+                [steam_id for steam_id, _ in users], [library for _, library in users]
+            )
+
+        with span("rank"):
+            ranked = scoring_engine.rank_many(
+                [profile.played() for profile in profiles],
+                [library.played_appids for _, library in users],
+                limit,
+                weights
+            )
+
+        with span("fetch_candidates"):
+            ranked_appids = [appid for user_ranked in ranked for appid, _ in user_ranked]
+            games = dict(zip(ranked_appids, await steam_service.get_game_details_many_async(ranked_appids)))
+
+        for (steam_id, _), user_ranked in zip(users, ranked):
+            results[steam_id] = BatchRecommendation(
+                steam_id=steam_id,
+                status="ok",
+                recommendations=[games[appid] for appid, _ in user_ranked if games.get(appid)],
+                scores={appid: round(score, 4) for appid, score in user_ranked}
+            )
+
+    return [results[steam_id] for steam_id in steam_ids]
+
+
+async def _load_legacy_candidates(user_preferences: Set[str], user_appids: Set[int]) -> AsyncIterator[List[Game]]:
+    """Догружает детали кандидатов, которых ещё нет в индексе, пачками в порядке
+    популярности: как только в просмотренном префиксе набралось 25 совпадений,
+    остальные не нужны. Отдаёт загруженные игры после каждой пачки.
+    """
+    candidate_appids = tag_index.candidates
+    for offset in range(0, len(candidate_appids), CANDIDATE_BATCH_SIZE):
+        if len(tag_index.match(user_preferences, user_appids, limit=25, upto=offset)) >= 25:
+            break
+
+        unknown = [
+            appid for appid in candidate_appids[offset:offset + CANDIDATE_BATCH_SIZE]
+            if appid not in user_appids and not tag_index.knows(appid)
+        ]
+        if unknown:
+            with span("fetch_candidates"):
+                games = await steam_service.get_game_details_many_async(unknown)
+                tag_index.update_games(games)
+            yield [game for game in games if game]
+
+
+async def _select_legacy(user_preferences: Set[str], user_appids: Set[int]) -> List[Game]:
+    """Первые 25 популярных игр с общим тегом, отсортированные по отзывам и году"""
+    with span("fetch_candidates"):
+        matched = tag_index.match(user_preferences, user_appids, limit=25)
+        recommended = [
+            details for details in await steam_service.get_game_details_many_async(matched)
+            if details
+        ]
+
+    with span("rank"):
+        # 6. Сортируем по рейтингу и году
+        recommended.sort(
+            key=lambda x: (-x.recommendations, -x.release_year if x.release_year else 0)
+        )
+    return recommended[:30]
+
+
+async def _select_scored(
+        played: List[Tuple[Dict, Optional[Game]]],
+        user_appids: Set[int],
+        weights: ScoringWeights,
+        metrics: Dict,
+        limit: int = 25
+) -> List[Game]:
+    """Скоринг всех кандидатов: теги с весами по времени игры и давности плюс популярность.
+
+    Детали кандидатов к этому моменту загружены _load_unknown_candidates.
+    Кандидаты дополняются соседями игр пользователя по совместному
+    владению, детали которых уже есть в кэше (без запросов к Steam).
+    """
+    with span("co_ownership"):
+        neighbours = dict(coownership_store.neighbours(
+            {game['appid']: tag_weight(game) for game, _ in played},
+            user_appids,
+            settings.COOWNERSHIP_CANDIDATES
+        ))
+        extra = []
+        if neighbours:
+            extra = [
+                game for game in await steam_service.get_game_details_many_async(list(neighbours), cached_only=True)
+                if game
+            ]
+            tag_index.update_games(extra)
+    metrics["co_owned_candidates"] = len(extra)
+
+    with span("rank"):
+        if neighbours:
+            ranked = scoring_engine.rank_with_neighbours(played, user_appids, limit, weights, neighbours, extra)
+        else:
+            ranked = scoring_engine.rank(played, user_appids, limit, weights)
+
+    with span("fetch_candidates"):
+        games = await steam_service.get_game_details_many_async([appid for appid, _ in ranked])
+    metrics["scores"] = {str(appid): round(score, 4) for appid, score in ranked}
+    return [game for game in games if game]
+
+
+async def _compare_with_scoring(
+        recommended: List[Game],
+        played: List[Tuple[Dict, Optional[Game]]],
+        user_appids: Set[int],
+        metrics: Dict
+) -> None:
+    """Режим сверки: скоринг с бинарными весами должен отобрать те же игры,
+    что и старый фильтр - первые совпадения в порядке популярности
+    """
+    async for _ in _load_unknown_candidates(user_appids):
+        pass
+    ranked = scoring_engine.rank(played, user_appids, len(tag_index.candidates), ScoringWeights.binary())
+    eligible = {appid for appid, _ in ranked}
+    expected = [appid for appid in tag_index.candidates if appid in eligible][:25]
+    legacy_ids = {game.steam_appid for game in recommended}
+    metrics["compare_overlap"] = len(legacy_ids & set(expected))
+    metrics["compare_equivalent"] = legacy_ids == set(expected)
+
+
+async def _until_deadline(candidates: AsyncIterator[List[Game]], metrics: Dict) -> AsyncIterator[List[Game]]:
+    """Отдаёт пачки кандидатов, пока до срока запроса больше RECOMMEND_RANK_RESERVE_MS:
+    остаток оставлен на ранжирование. Дальше загрузка отменяется, а результат
+    помечается partial - ранжируются уже известные кандидаты.
+    """
+    reserve = settings.RECOMMEND_RANK_RESERVE_MS / 1000
+    try:
+        while True:
+            left = remaining()
+            timeout = None if left is None else left - reserve
+            if timeout is not None and timeout <= 0:
+                metrics["partial"] = True
+                return
+            try:
+                loaded = await asyncio.wait_for(candidates.__anext__(), timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                metrics["partial"] = True
+                return
+            yield loaded
+    finally:
+        await candidates.aclose()
+
+
+async def _load_unknown_candidates(user_appids: Set[int]) -> AsyncIterator[List[Game]]:
+    """Загружает детали всех кандидатов, которых ещё нет в индексе.
+
+    Пачки грузятся параллельно и отдаются по мере готовности; если
+    потребитель ушёл, незавершённые загрузки отменяются.
+    """
+    unknown = [
+        appid for appid in tag_index.candidates
+        if appid not in user_appids and not tag_index.knows(appid)
+    ]
+    tasks = [
+        asyncio.ensure_future(steam_service.get_game_details_many_async(unknown[i:i + CANDIDATE_BATCH_SIZE]))
+        for i in range(0, len(unknown), CANDIDATE_BATCH_SIZE)
+    ]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            with span("fetch_candidates"):
+                games = await completed
+                tag_index.update_games(games)
+            yield [game for game in games if game]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
 
 def _create_metrics(
@@ -127,6 +552,12 @@ def _create_metrics(
         genres: List[str]
 ) -> RecommendationMetrics:
     """Создает объект метрик с разделением категорий и жанров"""
+    trace = current_trace()
+    stages = {}
+    if trace is not None:
+        stages = {stage: round(seconds, 6) for stage, seconds in trace.stages.items()}
+        for name, value in trace.counters.items():
+            metrics[name] = int(value) if float(value).is_integer() else round(value, 6)
     return RecommendationMetrics(
         user_id=steam_id,
         timestamp=start_time,
@@ -135,5 +566,6 @@ def _create_metrics(
         recommended_games_count=metrics.get("filtered_games_count", 0),
         categories_used=categories,
         genres_used=genres,
-        metrics=metrics
+        metrics=metrics,
+        stages=stages
     )
\ No newline at end of file
@@ -0,0 +1,260 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Deque, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата; None - нет или не разобрать"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class Backoff:
+    """Экспоненциальная задержка с полным jitter: uniform(0, min(max_delay, base * 2^attempt)).
+
+    Retry-After сервера важнее расчётной задержки и не сокращается: слишком
+    долгий Retry-After вызывающий обрабатывает сам (не повторяет запрос).
+    """
+
+    def __init__(self, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class ConcurrencyLimiter:
+    """Не больше limit одновременных владельцев, остальные ждут в очереди.
+
+    Как и TokenBucket, состояние защищено threading.Lock, а ожидающие
+    будятся через свой event loop, так что лимитер общий для всех циклов.
+    """
+
+    def __init__(self, limit: float):
+        self.limit = max(limit, 1.0)
+        self.in_flight = 0
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> float:
+        """Занимает слот; возвращает время ожидания"""
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return 0.0
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+
+        started = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, waiter))
+                except ValueError:
+                    # Слот уже передан нам - отдаём его следующему
+                    self.in_flight -= 1
+                    self._wake()
+            raise
+        return time.monotonic() - started
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self) -> None:
+        """Передаёт свободные слоты ожидающим (вызывается под lock)"""
+        while self._waiters and self.in_flight < int(self.limit):
+            loop, waiter = self._waiters.popleft()
+            self.in_flight += 1
+            loop.call_soon_threadsafe(_resolve, waiter)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class AIMDLimiter(ConcurrencyLimiter):
+    """Лимит одновременных запросов, подстраиваемый по AIMD.
+
+    Каждый успешный ответ увеличивает лимит на increase / limit (примерно
+    +increase за «окно» запросов), ответ 429 умножает его на decrease.
+    """
+
+    def __init__(
+            self,
+            initial: float,
+            min_limit: float = 1.0,
+            max_limit: float = 100.0,
+            increase: float = 1.0,
+            decrease: float = 0.5,
+            cooldown: float = 1.0
+    ):
+        self.min_limit = max(min_limit, 1.0)
+        self.max_limit = max(max_limit, self.min_limit)
+        super().__init__(min(max(initial, self.min_limit), self.max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        # После снижения новые 429 от запросов, ушедших до него, не снижают лимит снова
+        self.cooldown = cooldown
+        self._decreased_at = float("-inf")
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self._wake()
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased_at < self.cooldown:
+                return
+            self._decreased_at = now
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+
+
+class Overloaded(Exception):
+    """Запрос не допущен: все слоты заняты и очередь полна или ждать слишком долго"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"overloaded, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Допуск запросов: max_in_flight выполняются, до max_queue ждут слот
+    не дольше queue_timeout, остальным сразу Overloaded с оценкой, когда
+    повторить (по среднему времени обслуживания и длине очереди).
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int = 0, queue_timeout: float = 1.0):
+        self.slots = ConcurrencyLimiter(max_in_flight)
+        self.max_queue = max(max_queue, 0)
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        # Скользящее среднее времени обслуживания, секунды
+        self.service_time = 1.0
+
+    def retry_after(self) -> float:
+        return max(1.0, math.ceil(self.service_time * (self.waiting + 1) / self.slots.limit))
+
+    async def acquire(self, timeout: Optional[float] = None) -> float:
+        """Ждёт слот не дольше min(timeout, queue_timeout); возвращает время в очереди"""
+        if self.slots.in_flight < int(self.slots.limit) and not self.waiting:
+            return await self.slots.acquire()
+        # Считаем ожидающих сами: wait_for ставит их в очередь слотов не сразу
+        if self.slots.in_flight >= int(self.slots.limit) and self.waiting >= self.max_queue:
+            raise Overloaded(self.retry_after())
+        wait = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        self.waiting += 1
+        try:
+            return await asyncio.wait_for(self.slots.acquire(), max(wait, 0.0))
+        except asyncio.TimeoutError:
+            raise Overloaded(self.retry_after())
+        finally:
+            self.waiting -= 1
+
+    def release(self, service_time: float) -> None:
+        self.service_time = 0.9 * self.service_time + 0.1 * service_time
+        self.slots.release()
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class CircuitBreaker:
+    """Предохранитель: после failure_threshold сбоев подряд размыкается на
+    reset_timeout секунд и отклоняет вызовы сразу. Затем пропускает
+    half_open_max пробных вызовов: успех замыкает цепь, сбой - снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_max: int = 1):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.half_open_max = max(half_open_max, 1)
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def retry_in(self) -> float:
+        """Сколько секунд цепь ещё будет разомкнута"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def allow(self) -> bool:
+        """Можно ли сделать вызов; в полуоткрытом состоянии занимает пробный слот"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._probes = 0
+            if self._state == HALF_OPEN:
+                now = time.monotonic()
+                # Пробный вызов, так и не сообщивший результат, не держит цепь вечно
+                if self._probes >= self.half_open_max and now - self._probe_at < self.reset_timeout:
+                    return False
+                if self._probes >= self.half_open_max:
+                    self._probes = 0
+                self._probes += 1
+                self._probe_at = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._state = CLOSED
+            self._probes = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probes = 0
@@ -0,0 +1,229 @@
+import heapq
+import json
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from ..config import settings
+from ..models.game import Game
+from .tag_index import TagIndex
+
+
+class ScoringWeights(BaseModel):
+    """Веса скоринга рекомендаций"""
+    # Вклад совпадения по тегам и по популярности (log1p числа отзывов)
+    tag_weight: float = 1.0
+    popularity_weight: float = 0.3
+    # Множители для категорий и жанров в векторе предпочтений
+    category_weight: float = 0.5
+    genre_weight: float = 1.0
+    # Вес игры пользователя: log1p(часов) ** playtime_power * затухание по давности
+    playtime_power: float = 1.0
+    recency_half_life_days: float = 90.0
+    # Кандидаты с тег-скором не выше порога не рекомендуются
+    min_tag_score: float = 0.0
+    # Вклад близости к играм пользователя по совместному владению (0..1)
+    coownership_weight: float = 0.5
+
+    @classmethod
+    def binary(cls) -> "ScoringWeights":
+        """Веса, при которых положительный скор = хотя бы один общий тег.
+
+        Набор рекомендаций тогда совпадает с фильтром старого алгоритма -
+        режим для проверки эквивалентности.
+        """
+        return cls(
+            tag_weight=1.0, popularity_weight=0.0,
+            category_weight=1.0, genre_weight=1.0,
+            playtime_power=0.0, recency_half_life_days=0.0,
+            coownership_weight=0.0
+        )
+
+
+def load_weights(raw: str) -> ScoringWeights:
+    """Веса из JSON-строки настроек (пустая строка - значения по умолчанию)"""
+    return ScoringWeights(**json.loads(raw)) if raw.strip() else ScoringWeights()
+
+
+class CandidateMatrix:
+    """Multi-hot матрица кандидатов x тегов, построенная по срезу TagIndex"""
+
+    def __init__(self, index: TagIndex):
+        version, appids, rows, popularity, tag_count = index.candidate_rows()
+        self.version = version
+        self.appids = np.asarray(appids, dtype=np.int64)
+        self.known = np.fromiter((tags is not None for tags in rows), dtype=bool, count=len(rows))
+        self.matrix = np.zeros((len(rows), tag_count), dtype=np.float32)
+        for row, tags in enumerate(rows):
+            if tags:
+                self.matrix[row, list(tags)] = 1.0
+        log_popularity = np.log1p(np.asarray(popularity, dtype=np.float32))
+        peak = float(log_popularity.max()) if len(log_popularity) else 0.0
+        self.popularity = log_popularity / peak if peak > 0 else log_popularity
+        self.popularity_peak = peak
+        self._positions = {int(appid): row for row, appid in enumerate(appids)}
+
+    def mask_for(self, appids: Iterable[int]) -> np.ndarray:
+        mask = np.zeros(len(self.appids), dtype=bool)
+        for appid in appids:
+            row = self._positions.get(appid)
+            if row is not None:
+                mask[row] = True
+        return mask
+
+
+class ScoringEngine:
+    """Векторный скоринг кандидатов: одно матрично-векторное произведение на запрос"""
+
+    def __init__(self, index: TagIndex):
+        self.index = index
+        self._matrix: Optional[CandidateMatrix] = None
+        self._lock = threading.Lock()
+
+    def candidate_matrix(self) -> CandidateMatrix:
+        """Матрица перестраивается, только если индекс изменился"""
+        with self._lock:
+            if self._matrix is None or self._matrix.version != self.index.version:
+                self._matrix = CandidateMatrix(self.index)
+            return self._matrix
+
+    def game_weight(self, game: Dict, weights: ScoringWeights, now: float) -> float:
+        hours = game.get('playtime_forever', 0) / 60
+        weight = math.log1p(hours) ** weights.playtime_power
+        last_played = game.get('rtime_last_played', 0)
+        if weights.recency_half_life_days > 0 and last_played:
+            age_days = max(now - last_played, 0) / 86400
+            weight *= 0.5 ** (age_days / weights.recency_half_life_days)
+        return weight
+
+    def preference_vector(
+            self,
+            played: List[Tuple[Dict, Optional[Game]]],
+            weights: ScoringWeights,
+            tag_count: int,
+            now: Optional[float] = None
+    ) -> np.ndarray:
+        """Вектор предпочтений по тегам из пар (игра из библиотеки, её детали)"""
+        now = now or time.time()
+        vector = np.zeros(tag_count, dtype=np.float32)
+        for game, details in played:
+            if details is None:
+                continue
+            weight = self.game_weight(game, weights, now)
+            for tags, tag_weight in ((details.categories, weights.category_weight), (details.genres, weights.genre_weight)):
+                for tag in tags:
+                    tag_id = self.index.tag_id(tag)
+                    if tag_id is not None and tag_id < tag_count:
+                        vector[tag_id] += weight * tag_weight
+        peak = float(vector.max()) if tag_count else 0.0
+        return vector / peak if peak > 0 else vector
+
+    def rank(
+            self,
+            played: List[Tuple[Dict, Optional[Game]]],
+            exclude: Set[int],
+            limit: int,
+            weights: ScoringWeights
+    ) -> List[Tuple[int, float]]:
+        """Топ-limit кандидатов (appid, скор) по убыванию скора"""
+        return self.rank_many([played], [exclude], limit, weights)[0]
+
+    def rank_many(
+            self,
+            played: List[List[Tuple[Dict, Optional[Game]]]],
+            exclude: List[Set[int]],
+            limit: int,
+            weights: ScoringWeights
+    ) -> List[List[Tuple[int, float]]]:
+        """rank для нескольких пользователей: одно матричное произведение
+        кандидатов на матрицу предпочтений вместо произведения на пользователя
+        """
+        candidates = self.candidate_matrix()
+        if not len(candidates.appids):
+            return [[] for _ in played]
+
+        tag_count = candidates.matrix.shape[1]
+        now = time.time()
+        preferences = np.stack([
+            self.preference_vector(user_played, weights, tag_count, now) for user_played in played
+        ], axis=1) if played else np.zeros((tag_count, 0), dtype=np.float32)
+        tag_scores = candidates.matrix @ preferences
+        scores = weights.tag_weight * tag_scores + weights.popularity_weight * candidates.popularity[:, None]
+
+        results = []
+        for column, user_exclude in enumerate(exclude):
+            results.append(self._top(
+                candidates, scores[:, column], tag_scores[:, column], user_exclude, limit, weights
+            ))
+        return results
+
+    def rank_with_neighbours(
+            self,
+            played: List[Tuple[Dict, Optional[Game]]],
+            exclude: Set[int],
+            limit: int,
+            weights: ScoringWeights,
+            neighbours: Dict[int, float],
+            extra: Iterable[Game] = ()
+    ) -> List[Tuple[int, float]]:
+        """rank по кандидатам индекса и extra - играм вне него (соседям по
+        совместному владению) - с одной формулой скора. Кандидатам из
+        neighbours добавляется coownership_weight * близость.
+        """
+        candidates = self.candidate_matrix()
+        tag_count = candidates.matrix.shape[1]
+        preferences = self.preference_vector(played, weights, tag_count)
+
+        scored: Dict[int, float] = {}
+        if len(candidates.appids):
+            tag_scores = candidates.matrix @ preferences
+            scores = weights.tag_weight * tag_scores + weights.popularity_weight * candidates.popularity
+            eligible = candidates.known & (tag_scores > weights.min_tag_score) & ~candidates.mask_for(exclude)
+            for row in np.flatnonzero(eligible):
+                scored[int(candidates.appids[row])] = float(scores[row])
+
+        for game in extra:
+            if game.steam_appid in exclude or game.steam_appid in scored:
+                continue
+            tag_ids = {self.index.tag_id(tag) for tag in (*game.categories, *game.genres)}
+            tag_score = float(sum(preferences[tag_id] for tag_id in tag_ids if tag_id is not None and tag_id < tag_count))
+            if tag_score <= weights.min_tag_score:
+                continue
+            peak = candidates.popularity_peak
+            popularity = min(math.log1p(game.recommendations) / peak, 1.0) if peak > 0 else 0.0
+            scored[game.steam_appid] = weights.tag_weight * tag_score + weights.popularity_weight * popularity
+
+        for appid, similarity in neighbours.items():
+            if appid in scored:
+                scored[appid] += weights.coownership_weight * similarity
+        # При равном скоре - порядок кандидатов индекса, затем extra
+        return heapq.nlargest(limit, scored.items(), key=lambda item: item[1])
+
+    @staticmethod
+    def _top(
+            candidates: CandidateMatrix,
+            scores: np.ndarray,
+            tag_scores: np.ndarray,
+            exclude: Set[int],
+            limit: int,
+            weights: ScoringWeights
+    ) -> List[Tuple[int, float]]:
+        eligible = candidates.known & (tag_scores > weights.min_tag_score) & ~candidates.mask_for(exclude)
+        scores = np.where(eligible, scores, -np.inf)
+
+        count = int(eligible.sum())
+        if count == 0:
+            return []
+        k = min(limit, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        # Стабильная сортировка: при равном скоре раньше идёт более популярный кандидат
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(candidates.appids[row]), float(scores[row])) for row in top]
+
+
+def default_weights() -> ScoringWeights:
+    return load_weights(settings.SCORING_WEIGHTS)
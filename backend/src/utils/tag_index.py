@@ -0,0 +1,210 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..config import settings
+from ..models.game import Game
+from ..services.redis import redis_service
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = "tag_index"
+
+
+def iter_bits(bits: int):
+    """Позиции установленных битов по возрастанию"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class TagIndex:
+    """Инвертированный индекс категорий и жанров по кандидатам в рекомендации.
+
+    Кандидаты - список popular_games; позиция кандидата в нём равна номеру
+    бита, а posting list тега - целое число-битсет. Объединение постингов
+    даёт совпадения сразу в порядке популярности, как и линейный перебор.
+    Теги интернируются в целые id, теги игр хранятся и для не-кандидатов,
+    чтобы смена списка популярных игр не требовала повторной загрузки.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tag_ids: Dict[str, int] = {}
+        self._tags: List[str] = []
+        self._game_tags: Dict[int, Tuple[int, ...]] = {}
+        self._popularity: Dict[int, int] = {}
+        self._candidates: List[int] = []
+        self._positions: Dict[int, int] = {}
+        self._postings: List[int] = []
+        self.version = 0
+        self.loaded = False
+        self._saved_version = 0
+        self._saved_at = 0.0
+
+    def _intern(self, tag: str) -> int:
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = len(self._tags)
+            self._tag_ids[tag] = tag_id
+            self._tags.append(tag)
+            self._postings.append(0)
+        return tag_id
+
+    def _rebuild_postings(self) -> None:
+        self._postings = [0] * len(self._tags)
+        for appid, position in self._positions.items():
+            for tag_id in self._game_tags.get(appid, ()):
+                self._postings[tag_id] |= 1 << position
+
+    def set_candidates(self, appids: List[int]) -> None:
+        """Задаёт список кандидатов в порядке популярности"""
+        appids = list(dict.fromkeys(appids))
+        with self._lock:
+            if appids == self._candidates:
+                return
+            self._candidates = appids
+            self._positions = {appid: position for position, appid in enumerate(appids)}
+            self._rebuild_postings()
+            self.version += 1
+
+    def update_game(self, game: Game) -> None:
+        self.update_games([game])
+
+    def update_games(self, games: Iterable[Optional[Game]]) -> None:
+        with self._lock:
+            changed = False
+            for game in games:
+                if game is None:
+                    continue
+                if self._popularity.get(game.steam_appid) != game.recommendations:
+                    self._popularity[game.steam_appid] = game.recommendations
+                    changed = True
+
+                tags = tuple(sorted({self._intern(tag) for tag in (*game.categories, *game.genres)}))
+                old_tags = self._game_tags.get(game.steam_appid)
+                if old_tags == tags:
+                    continue
+                self._game_tags[game.steam_appid] = tags
+                changed = True
+
+                position = self._positions.get(game.steam_appid)
+                if position is None:
+                    continue
+                bit = 1 << position
+                for tag_id in old_tags or ():
+                    self._postings[tag_id] &= ~bit
+                for tag_id in tags:
+                    self._postings[tag_id] |= bit
+            if changed:
+                self.version += 1
+
+    def knows(self, appid: int) -> bool:
+        return appid in self._game_tags
+
+    def tag_id(self, tag: str) -> Optional[int]:
+        return self._tag_ids.get(tag)
+
+    def candidate_rows(self) -> Tuple[int, List[int], List[Optional[Tuple[int, ...]]], List[int], int]:
+        """Согласованный срез индекса для построения матрицы кандидатов:
+        (версия, кандидаты, id тегов каждого кандидата или None, популярность, число тегов)
+        """
+        with self._lock:
+            return (
+                self.version,
+                list(self._candidates),
+                [self._game_tags.get(appid) for appid in self._candidates],
+                [self._popularity.get(appid, 0) for appid in self._candidates],
+                len(self._tags),
+            )
+
+    @property
+    def candidates(self) -> List[int]:
+        return self._candidates
+
+    def match(self, tags: Iterable[str], exclude: Set[int], limit: int, upto: Optional[int] = None) -> List[int]:
+        """Кандидаты с хотя бы одним тегом из tags, кроме exclude, по популярности.
+
+        upto ограничивает поиск первыми upto кандидатами.
+        """
+        with self._lock:
+            bits = 0
+            for tag in tags:
+                tag_id = self._tag_ids.get(tag)
+                if tag_id is not None:
+                    bits |= self._postings[tag_id]
+            for appid in exclude:
+                position = self._positions.get(appid)
+                if position is not None:
+                    bits &= ~(1 << position)
+            if upto is not None:
+                bits &= (1 << upto) - 1
+            candidates = self._candidates
+
+        result = []
+        for position in iter_bits(bits):
+            if len(result) >= limit:
+                break
+            result.append(candidates[position])
+        return result
+
+    def to_snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "tags": list(self._tags),
+                "candidates": list(self._candidates),
+                "games": {str(appid): list(tags) for appid, tags in self._game_tags.items()},
+                "popularity": {str(appid): value for appid, value in self._popularity.items()},
+            }
+
+    def load_from_snapshot(self, snapshot: Dict) -> None:
+        with self._lock:
+            self._tags = list(snapshot.get("tags", []))
+            self._tag_ids = {tag: tag_id for tag_id, tag in enumerate(self._tags)}
+            self._game_tags = {
+                int(appid): tuple(tags) for appid, tags in snapshot.get("games", {}).items()
+            }
+            self._popularity = {
+                int(appid): value for appid, value in snapshot.get("popularity", {}).items()
+            }
+            self._candidates = list(snapshot.get("candidates", []))
+            self._positions = {appid: position for position, appid in enumerate(self._candidates)}
+            self._rebuild_postings()
+            # Версия только растёт, чтобы построенные по ней кэши не путались
+            self.version = max(self.version, snapshot.get("version", 0)) + 1
+            self._saved_version = self.version
+
+    async def load_snapshot(self) -> bool:
+        """Поднимает индекс из снимка в Redis (один раз на процесс)"""
+        if self.loaded:
+            return False
+        self.loaded = True
+        snapshot = await redis_service.get_cached_data_async(SNAPSHOT_KEY)
+        if not snapshot:
+            return False
+        try:
+            self.load_from_snapshot(snapshot)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Invalid tag index snapshot: {e}")
+            return False
+        return True
+
+    async def save_snapshot(self, force: bool = False) -> bool:
+        """Сохраняет снимок, если индекс менялся и прошёл интервал сохранения"""
+        now = time.monotonic()
+        if self.version == self._saved_version:
+            return False
+        if not force and now - self._saved_at < settings.TAG_INDEX_SNAPSHOT_INTERVAL:
+            return False
+        self._saved_at = now
+        snapshot = self.to_snapshot()
+        if await redis_service.cache_data_async(SNAPSHOT_KEY, snapshot, ttl=settings.GAME_DETAILS_HARD_TTL):
+            self._saved_version = snapshot["version"]
+            return True
+        return False
+
+
+tag_index = TagIndex()
@@ -0,0 +1,103 @@
+"""Размер и время декодирования записей кэша в разных форматах.
+
+Пример:
+    python -m benchmarks.codec --library-size 5000
+    python -m benchmarks.codec --redis-url redis://localhost:6379/15
+
+Сравнивает старый формат (json.dumps полного ответа GetOwnedGames) с
+вариантами Codec на библиотеке пользователя и деталях игры. С --redis-url
+дополнительно замеряет MEMORY USAGE записей в Redis.
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List, Optional
+
+from backend.src.services.cache import wrap_swr
+from backend.src.services.codec import Codec
+from backend.src.services.steam import steam_service
+
+from .fake_steam import FakeSteam, FakeSteamConfig
+
+VARIANTS = [
+    ("msgpack", "zstd"),
+    ("msgpack", "lz4"),
+    ("msgpack", "none"),
+    ("orjson", "zstd"),
+    ("orjson", "none"),
+    ("json", "none"),
+]
+
+
+def decode_seconds(decode, data: bytes, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        decode(data)
+    return (time.perf_counter() - started) / iterations
+
+
+def measure(key: str, value, iterations: int, redis_client=None) -> List[Dict]:
+    legacy = json.dumps(wrap_swr(value, 3600)).encode()
+    encodings = [("legacy-json", legacy, lambda data: json.loads(data.decode()))]
+    for serializer, compression in VARIANTS:
+        codec = Codec(serializer, compression)
+        encoded = codec.encode(key, wrap_swr(codec.project(key, value), 3600))
+        encodings.append((f"{codec.serializer}+{codec.compression}", encoded, codec.decode))
+
+    rows = []
+    for name, data, decode in encodings:
+        row = {
+            "key": key.split(":", 1)[0],
+            "format": name,
+            "bytes": len(data),
+            "decode_us": round(decode_seconds(decode, data, iterations) * 1e6, 1),
+        }
+        if redis_client is not None:
+            redis_client.set("bench:codec", data)
+            row["redis_memory"] = redis_client.memory_usage("bench:codec")
+        rows.append(row)
+    if redis_client is not None:
+        redis_client.delete("bench:codec")
+    return rows
+
+
+def run(args) -> List[Dict]:
+    steam = FakeSteam(FakeSteamConfig(catalog_size=max(args.library_size * 2, 100), library_size=args.library_size))
+    library = steam.library("76561190000000001")
+    appid = steam.appids[0]
+    details = steam_service._parse_game_details(appid, steam.details(appid)).dict()
+
+    redis_client: Optional[object] = None
+    if args.redis_url:
+        import redis
+        redis_client = redis.Redis.from_url(args.redis_url)
+
+    return (
+        measure("user_games:1", library, args.iterations, redis_client)
+        + measure("game_details:1", details, args.iterations * 20, redis_client)
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--library-size", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--redis-url", default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    rows = run(parse_args(argv))
+    for row in rows:
+        memory = f" redis={row['redis_memory']:>8}" if "redis_memory" in row else ""
+        print(
+            f"{row['key']:>13} {row['format']:>14} {row['bytes']:>9} B "
+            f"decode={row['decode_us']:>9.1f}us{memory}",
+            file=sys.stderr
+        )
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
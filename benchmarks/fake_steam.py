@@ -0,0 +1,128 @@
+"""Локальная замена Steam API для бенчмарков.
+
+Отдаёт GetOwnedGames, appdetails и GetMostPlayedGames с детерминированными
+данными, настраиваемой задержкой и долей ответов 429.
+"""
+import asyncio
+import random
+from dataclasses import dataclass
+from typing import Dict, List
+
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse
+
+CATEGORIES = [
+    'Single-player', 'Multi-player', 'Co-op', 'Online Co-op', 'Local Co-op',
+    'Online Multi-Player', 'PvP', 'PvE', 'Cross-Platform Multiplayer', 'Steam Achievements',
+]
+GENRES = [
+    'Action', 'Adventure', 'Casual', 'Indie', 'Massively Multiplayer', 'Racing', 'RPG',
+    'Simulation', 'Sports', 'Strategy', 'Free to Play', 'Early Access', 'Survival', 'Horror',
+]
+
+
+@dataclass
+class FakeSteamConfig:
+    catalog_size: int = 2000
+    library_size: int = 200
+    popular_count: int = 100
+    latency_ms: float = 50.0
+    jitter_ms: float = 20.0
+    rate_limit_ratio: float = 0.0
+    missing_ratio: float = 0.02
+    seed: int = 42
+
+
+class FakeSteam:
+    def __init__(self, config: FakeSteamConfig):
+        self.config = config
+        self.appids = [10 * (index + 1) for index in range(config.catalog_size)]
+        self._appid_set = set(self.appids)
+        self._rng = random.Random(config.seed)
+        self.requests: Dict[str, int] = {"GetOwnedGames": 0, "appdetails": 0, "GetMostPlayedGames": 0, "429": 0}
+
+    async def _delay(self) -> None:
+        delay = self.config.latency_ms + self._rng.uniform(-1, 1) * self.config.jitter_ms
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    def _throttled(self) -> bool:
+        if self._rng.random() < self.config.rate_limit_ratio:
+            self.requests["429"] += 1
+            return True
+        return False
+
+    def library(self, steam_id: str) -> List[Dict]:
+        rng = random.Random(f"{self.config.seed}:{steam_id}")
+        size = min(self.config.library_size, len(self.appids))
+        return [
+            {
+                "appid": appid,
+                "name": f"Game {appid}",
+                "playtime_forever": rng.choice([0, rng.randint(1, 60000)]),
+                "rtime_last_played": rng.randint(1500000000, 1760000000),
+                "img_icon_url": f"{appid:040x}",
+                "has_community_visible_stats": True,
+                "playtime_windows_forever": rng.randint(0, 60000),
+                "playtime_mac_forever": 0,
+                "playtime_linux_forever": 0,
+                "playtime_deck_forever": 0,
+                "playtime_disconnected": 0,
+                "content_descriptorids": [2, 5],
+            }
+            for appid in rng.sample(self.appids, size)
+        ]
+
+    def details(self, appid: int) -> Dict:
+        rng = random.Random(f"{self.config.seed}:app:{appid}")
+        if appid not in self._appid_set or rng.random() < self.config.missing_ratio:
+            return {str(appid): {"success": False}}
+        return {str(appid): {
+            "success": True,
+            "data": {
+                "name": f"Game {appid}",
+                "categories": [{"id": i, "description": c} for i, c in enumerate(rng.sample(CATEGORIES, rng.randint(1, 4)))],
+                "genres": [{"id": str(i), "description": g} for i, g in enumerate(rng.sample(GENRES, rng.randint(1, 3)))],
+                "recommendations": {"total": rng.randint(0, 500000)},
+                "release_date": {"coming_soon": False, "date": f"{rng.randint(1, 28)} Mar, {rng.randint(2005, 2025)}"},
+                "short_description": "x" * rng.randint(100, 400),
+            }
+        }}
+
+    def popular(self) -> List[Dict]:
+        rng = random.Random(f"{self.config.seed}:popular")
+        appids = rng.sample(self.appids, min(self.config.popular_count, len(self.appids)))
+        return [{"rank": rank + 1, "appid": appid, "peak_in_game": rng.randint(1000, 1000000)} for rank, appid in enumerate(appids)]
+
+
+def create_app(config: FakeSteamConfig) -> FastAPI:
+    steam = FakeSteam(config)
+    app = FastAPI(title="Fake Steam")
+    app.state.steam = steam
+
+    @app.get("/IPlayerService/GetOwnedGames/v1/")
+    async def owned_games(steamid: str):
+        steam.requests["GetOwnedGames"] += 1
+        await steam._delay()
+        if steam._throttled():
+            return JSONResponse({}, status_code=429)
+        games = steam.library(steamid)
+        return {"response": {"game_count": len(games), "games": games}}
+
+    @app.get("/api/appdetails")
+    async def appdetails(appids: int = Query(...)):
+        steam.requests["appdetails"] += 1
+        await steam._delay()
+        if steam._throttled():
+            return JSONResponse(None, status_code=429)
+        return steam.details(appids)
+
+    @app.get("/ISteamChartsService/GetMostPlayedGames/v1/")
+    async def most_played():
+        steam.requests["GetMostPlayedGames"] += 1
+        await steam._delay()
+        if steam._throttled():
+            return JSONResponse({}, status_code=429)
+        return {"response": {"rollup_date": 0, "ranks": steam.popular()}}
+
+    return app
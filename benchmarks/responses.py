@@ -0,0 +1,147 @@
+"""CPU и память на сборку ответов /recommend и /game из закэшированных деталей.
+
+Пример:
+    python -m benchmarks.responses --games 25 --iterations 2000
+
+Сравнивает прежний путь (модели pydantic из словарей кэша, словари ответа,
+jsonable_encoder и JSONResponse) с фрагментами: GameRecord из кэша с готовым
+JSON игры и склейка байтов через FragmentJSONResponse.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from backend.src.models.game import Game, GameRecord, RecommendationMetrics
+from backend.src.services.steam import steam_service
+from backend.src.utils.fragments import FragmentJSONResponse, cache_payload, detail_fragment, game_fragment, public_payload
+
+from .fake_steam import FakeSteam, FakeSteamConfig
+
+
+class LegacyMetrics(BaseModel):
+    """RecommendationMetrics в виде модели pydantic, как до фрагментов"""
+    user_id: str
+    timestamp: float
+    execution_time: float
+    input_games_count: int
+    recommended_games_count: int
+    categories_used: List[str]
+    genres_used: List[str]
+    metrics: Dict[str, Any]
+    stages: Dict[str, float] = {}
+
+
+def _metrics_fields() -> Dict[str, Any]:
+    return {
+        "user_id": "76561190000000001",
+        "timestamp": time.time(),
+        "execution_time": 0.0123,
+        "input_games_count": 200,
+        "recommended_games_count": 25,
+        "categories_used": ["Single-player", "Multi-player", "Co-op"],
+        "genres_used": ["Action", "RPG", "Indie"],
+        "metrics": {"execution_time": 0.0123, "input_games_count": 200, "result_cache_hit": False, "l1_hits": 27},
+        "stages": {"library": 0.001, "rank": 0.004, "fetch_candidates": 0.002},
+    }
+
+
+def legacy_recommend(cached: List[Dict]) -> bytes:
+    games = [Game(**data) for data in cached]
+    metrics = LegacyMetrics(**_metrics_fields())
+    return JSONResponse(jsonable_encoder({
+        "steam_id": metrics.user_id,
+        "recommendations": [public_payload(game) for game in games],
+        "count": len(games),
+        "cache_hit": False,
+        "partial": False,
+        "metrics": metrics.metrics,
+        "stages": metrics.stages,
+    })).body
+
+
+def fragment_recommend(cached: List[Dict]) -> bytes:
+    games = [GameRecord.from_dict(data) for data in cached]
+    metrics = RecommendationMetrics(**_metrics_fields())
+    return FragmentJSONResponse({
+        "steam_id": metrics.user_id,
+        "recommendations": [game_fragment(game) for game in games],
+        "count": len(games),
+        "cache_hit": False,
+        "partial": False,
+        "metrics": metrics.metrics,
+        "stages": metrics.stages,
+    }).body
+
+
+def legacy_game(cached: List[Dict]) -> bytes:
+    return JSONResponse(jsonable_encoder(Game(**cached[0]).dict())).body
+
+
+def fragment_game(cached: List[Dict]) -> bytes:
+    return FragmentJSONResponse(detail_fragment(GameRecord.from_dict(cached[0]))).body
+
+
+def measure(build: Callable[[List[Dict]], bytes], cached: List[Dict], iterations: int) -> Dict:
+    build(cached)
+    started = time.process_time()
+    for _ in range(iterations):
+        build(cached)
+    cpu = (time.process_time() - started) / iterations
+
+    # Пик памяти, выделенной на сборку одного ответа
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    body = build(cached)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return {
+        "cpu_us": round(cpu * 1e6, 1),
+        "peak_alloc_bytes": peak,
+        "body_bytes": len(body),
+    }
+
+
+def run(args) -> List[Dict]:
+    steam = FakeSteam(FakeSteamConfig(catalog_size=max(args.games, 100)))
+    records = [steam_service._parse_game_details(appid, steam.details(appid)) for appid in steam.appids[:args.games]]
+    with_fragments = [cache_payload(record) for record in records]
+    plain = [record.dict() for record in records]
+
+    rows = []
+    for endpoint, legacy, fragment in (
+            ("recommend", legacy_recommend, fragment_recommend),
+            ("game", legacy_game, fragment_game),
+    ):
+        assert json.loads(legacy(plain)) == json.loads(fragment(with_fragments))
+        for variant, build, cached in (("legacy", legacy, plain), ("fragments", fragment, with_fragments)):
+            rows.append({"endpoint": endpoint, "variant": variant, **measure(build, cached, args.iterations)})
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--games", type=int, default=25, help="игр в ответе /recommend")
+    parser.add_argument("--iterations", type=int, default=2000)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    rows = run(parse_args(argv))
+    for row in rows:
+        print(
+            f"{row['endpoint']:>9} {row['variant']:>9} cpu={row['cpu_us']:>8.1f}us "
+            f"peak_alloc={row['peak_alloc_bytes']:>7} B body={row['body_bytes']:>6} B",
+            file=sys.stderr
+        )
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
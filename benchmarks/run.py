@@ -0,0 +1,317 @@
+"""Нагрузочный бенчмарк Playiter против локальной замены Steam.
+
+Зависимости: pip install -r benchmarks/requirements.txt
+
+Пример:
+    python -m benchmarks.run --concurrency 1,10,50 --requests 200 --output bench.json
+    python -m benchmarks.run --redis-url redis://localhost:6379/15 --baseline bench.json
+
+Поднимает fake Steam и backend в uvicorn на локальных портах, для каждого
+endpoint'а и уровня конкурентности прогоняет холодную (после сброса кэшей)
+и тёплую фазы и печатает p50/p95/p99 и пропускную способность. Результат
+сохраняется в JSON, --baseline сравнивает его с прошлым прогоном.
+Базу --redis-url бенчмарк очищает перед фазами, поэтому непустая база
+принимается только с --flush.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from backend.src.config import settings
+from backend.src.main import app as backend_app
+from backend.src.services.redis import redis_service
+from backend.src.services.steam import steam_service
+from backend.src.utils.aio import LoopLocal
+from backend.src.utils.ratelimit import SharedRateLimiter
+from backend.src.utils.tag_index import tag_index
+
+from .fake_steam import FakeSteamConfig, create_app
+
+ENDPOINTS = ("recommend", "stream", "user", "game")
+
+
+class ServerThread:
+    """uvicorn-сервер в отдельном потоке на свободном локальном порту"""
+
+    def __init__(self, app):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> str:
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def use_in_process_redis() -> None:
+    """Подменяет Redis на fakeredis с общим хранилищем для sync и async клиентов"""
+    import fakeredis
+
+    server = fakeredis.FakeServer()
+    redis_service.client = fakeredis.FakeRedis(server=server)
+    redis_service._async_clients = LoopLocal(lambda: fakeredis.FakeAsyncRedis(server=server))
+
+
+def reset_state() -> None:
+    """Холодный старт: пустые Redis, L1 и индекс тегов"""
+    redis_service.client.flushdb()
+    redis_service.local.clear()
+    tag_index.load_from_snapshot({})
+    tag_index.loaded = True
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def drive(base_url: str, paths: List[str], concurrency: int, timeout: float) -> Dict:
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        async def one(path: str) -> None:
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with client.stream("GET", path) as response:
+                        first_byte = None
+                        async for _ in response.aiter_raw():
+                            if first_byte is None:
+                                first_byte = time.perf_counter() - started
+                        first_bytes.append(first_byte if first_byte is not None else time.perf_counter() - started)
+                        if response.status_code >= 500:
+                            errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(path) for path in paths))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(paths),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "ttfb_p50_ms": round(percentile(first_bytes, 0.50) * 1000, 3),
+        "ttfb_p95_ms": round(percentile(first_bytes, 0.95) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_rps": round(len(paths) / elapsed, 3) if elapsed else 0.0,
+        "wall_s": round(elapsed, 3),
+    }
+
+
+def build_paths(endpoint: str, count: int, run_id: int, appids: List[int]) -> List[str]:
+    if endpoint == "game":
+        return [f"/game/{appids[(run_id * 7919 + i) % len(appids)]}" for i in range(count)]
+    if endpoint == "stream":
+        return [f"/recommend/7656119{run_id:04d}{i:06d}/stream" for i in range(count)]
+    prefix = "recommend" if endpoint == "recommend" else "user"
+    return [f"/{prefix}/7656119{run_id:04d}{i:06d}" for i in range(count)]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> Dict:
+    steam_config = FakeSteamConfig(
+        catalog_size=args.catalog_size,
+        library_size=args.library_size,
+        popular_count=args.popular_count,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_limit_ratio=args.rate_limit_ratio,
+        seed=args.seed,
+    )
+    fake_app = create_app(steam_config)
+    fake_steam = fake_app.state.steam
+
+    external = None
+    if args.redis_url:
+        import redis
+        external = redis.Redis.from_url(args.redis_url)
+        # Между фазами база очищается целиком: непустую - только с явным --flush
+        if external.dbsize() and not args.flush:
+            raise SystemExit(f"Redis {args.redis_url} is not empty; use an empty database or pass --flush")
+
+    saved = (
+        redis_service.client, redis_service._async_clients,
+        steam_service.base_url, steam_service.store_url, steam_service.rate_limiters,
+        settings.PROFILING_SAMPLE_RATE,
+    )
+    settings.PROFILING_SAMPLE_RATE = args.profile_sample_rate
+    if external is not None:
+        import redis.asyncio as aioredis
+        redis_service.client = external
+        redis_service._async_clients = LoopLocal(lambda: aioredis.Redis.from_url(args.redis_url))
+    else:
+        use_in_process_redis()
+
+    fake_server = ServerThread(fake_app)
+    fake_url = fake_server.start()
+    steam_service.base_url = fake_url
+    steam_service.store_url = f"{fake_url}/api"
+    # fakeredis не выполняет Lua, поэтому общий лимит через Redis - только с --redis-url
+    reserve = redis_service.reserve_rate_tokens_async if args.redis_url else None
+    steam_service.rate_limiters = {
+        "appdetails": SharedRateLimiter("appdetails", args.store_rate, args.store_burst, reserve),
+        "GetOwnedGames": SharedRateLimiter("GetOwnedGames", args.webapi_rate, args.webapi_burst, reserve),
+        "GetMostPlayedGames": SharedRateLimiter("GetMostPlayedGames", args.webapi_rate, args.webapi_burst, reserve),
+    }
+
+    backend_server = ServerThread(backend_app)
+    backend_url = backend_server.start()
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            for endpoint in args.endpoints:
+                run_id = len(results)
+                paths = build_paths(endpoint, args.requests, run_id, fake_steam.appids)
+                for phase in ("cold", "warm"):
+                    if phase == "cold":
+                        reset_state()
+                    steam_before = dict(fake_steam.requests)
+                    stats = asyncio.run(drive(backend_url, paths, concurrency, args.timeout))
+                    stats.update({
+                        "endpoint": endpoint,
+                        "phase": phase,
+                        "concurrency": concurrency,
+                        "steam_requests": {
+                            name: fake_steam.requests[name] - steam_before[name]
+                            for name in fake_steam.requests
+                        },
+                    })
+                    results.append(stats)
+                    print(
+                        f"{endpoint:>9} {phase:>4} c={concurrency:<4} "
+                        f"p50={stats['p50_ms']:>9.2f}ms p95={stats['p95_ms']:>9.2f}ms "
+                        f"p99={stats['p99_ms']:>9.2f}ms ttfb50={stats['ttfb_p50_ms']:>9.2f}ms "
+                        f"rps={stats['throughput_rps']:>8.2f} "
+                        f"errors={stats['errors']}",
+                        file=sys.stderr
+                    )
+    finally:
+        backend_server.stop()
+        fake_server.stop()
+        reset_state()
+        (
+            redis_service.client, redis_service._async_clients,
+            steam_service.base_url, steam_service.store_url, steam_service.rate_limiters,
+            settings.PROFILING_SAMPLE_RATE,
+        ) = saved
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "redis": args.redis_url or "in-process",
+            "requests_per_run": args.requests,
+            "steam": steam_config.__dict__,
+            "store_rate": args.store_rate,
+            "store_burst": args.store_burst,
+            "webapi_rate": args.webapi_rate,
+            "webapi_burst": args.webapi_burst,
+            "profile_sample_rate": args.profile_sample_rate,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    """Строки сравнения p95 и пропускной способности с прошлым прогоном"""
+    previous = {
+        (item["endpoint"], item["phase"], item["concurrency"]): item
+        for item in baseline.get("results", [])
+    }
+    lines = []
+    for item in current["results"]:
+        old = previous.get((item["endpoint"], item["phase"], item["concurrency"]))
+        if not old:
+            continue
+        p95_delta = (item["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        rps_delta = (item["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] * 100 if old["throughput_rps"] else 0.0
+        lines.append(
+            f"{item['endpoint']:>9} {item['phase']:>4} c={item['concurrency']:<4} "
+            f"p95 {old['p95_ms']:.2f} -> {item['p95_ms']:.2f}ms ({p95_delta:+.1f}%) "
+            f"rps {old['throughput_rps']:.2f} -> {item['throughput_rps']:.2f} ({rps_delta:+.1f}%)"
+        )
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 10, 50])
+    parser.add_argument("--endpoints", type=lambda v: v.split(","), default=list(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=100, help="запросов на фазу")
+    parser.add_argument("--catalog-size", type=int, default=2000)
+    parser.add_argument("--library-size", type=int, default=200)
+    parser.add_argument("--popular-count", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--store-rate", type=float, default=1000.0, help="лимит appdetails, запросов/с")
+    parser.add_argument("--store-burst", type=float, default=100.0)
+    parser.add_argument("--webapi-rate", type=float, default=1000.0, help="лимит Web API, запросов/с")
+    parser.add_argument("--webapi-burst", type=float, default=100.0)
+    parser.add_argument("--profile-sample-rate", type=float, default=0.0, help="доля профилируемых запросов")
+    parser.add_argument("--redis-url", default=None, help="локальный Redis; по умолчанию - in-process fakeredis")
+    parser.add_argument("--flush", action="store_true", help="разрешить очистку непустой базы --redis-url")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--baseline", default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    report = run(args)
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+    if args.baseline:
+        with open(args.baseline) as f:
+            for line in compare(report, json.load(f)):
+                print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,4 +23,40 @@ export const getRecommendations = async (steamId: string): Promise<Recommendatio
     console.error('Error fetching recommendations:', error);
     throw error;
   }
-};
\ No newline at end of file
+};
+export type RecommendationGame = RecommendationResponse['recommendations'][number];
+
+export type RecommendationEvent =
+  | { event: 'library'; game_count: number; played_count: number; top_games: Array<{ appid: number; name: string; playtime_hours: number }> }
+  | { event: 'preferences'; categories: string[]; genres: string[] }
+  | { event: 'match'; games: RecommendationGame[] }
+  | { event: 'ranking'; recommendations: RecommendationGame[]; count: number; cache_hit: boolean }
+  | { event: 'metrics'; metrics: Record<string, unknown>; stages: Record<string, number> };
+
+// Читает NDJSON-поток /recommend/{id}/stream; отмена через signal закрывает
+// соединение, и backend прекращает запросы к Steam
+export const streamRecommendations = async (
+  steamId: string,
+  onEvent: (event: RecommendationEvent) => void,
+  signal?: AbortSignal
+): Promise<void> => {
+  const response = await fetch(`${API_BASE}/recommend/${steamId}/stream`, { signal });
+  if (!response.ok || !response.body) {
+    throw new Error(`Stream request failed: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop() ?? '';
+    for (const line of lines) {
+      if (line.trim()) onEvent(JSON.parse(line));
+    }
+  }
+  if (buffer.trim()) onEvent(JSON.parse(buffer));
+};
@@ -1,7 +1,7 @@
 import { useEffect, useState } from 'react';
 import { useSearchParams } from 'react-router-dom';
 import GameCard from '../components/GameCard';
-import { getRecommendations } from '../api/steam';
+import { RecommendationEvent, streamRecommendations } from '../api/steam';
 import LoadingSpinner from '../components/LoadingSpinner';
 import Navbar from '../components/Navbar';
 import './Recommendations.css';
@@ -17,36 +17,57 @@ interface Game {
 
 export default function Recommendations() {
   const [games, setGames] = useState<Game[]>([]);
+  const [preferences, setPreferences] = useState<string[]>([]);
+  const [ranked, setRanked] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [searchParams] = useSearchParams();
 
   useEffect(() => {
-    const fetchRecommendations = async () => {
-      try {
-        const steamId = searchParams.get('steam_id');
-        if (!steamId) {
-          setError('Steam ID not found. Please try logging in again.');
-          return;
-        }
+    const controller = new AbortController();
+    const steamId = searchParams.get('steam_id');
+    if (!steamId) {
+      setError('Steam ID not found. Please try logging in again.');
+      setLoading(false);
+      return;
+    }
 
-        setLoading(true);
-        const data = await getRecommendations(steamId);
+    setLoading(true);
+    setRanked(false);
+    setGames([]);
 
-        if (data.recommendations.length === 0) {
+    // Сначала приходят предпочтения, затем совпадения по мере загрузки,
+    // в конце - итоговый порядок
+    const handleEvent = (event: RecommendationEvent) => {
+      if (event.event === 'preferences') {
+        setPreferences([...event.genres, ...event.categories]);
+        setLoading(false);
+      } else if (event.event === 'match') {
+        setGames((current) => {
+          const seen = new Set(current.map((game) => game.appid));
+          return [...current, ...event.games.filter((game) => !seen.has(game.appid))];
+        });
+      } else if (event.event === 'ranking') {
+        setRanked(true);
+        if (event.recommendations.length === 0) {
           setError('No recommendations found. You may need to play more games to get personalized recommendations.');
         } else {
-          setGames(data.recommendations);
+          setGames(event.recommendations);
         }
-      } catch (err) {
-        setError('Failed to load recommendations. Please try again later.');
-        console.error(err);
-      } finally {
-        setLoading(false);
       }
     };
 
-    fetchRecommendations();
+    streamRecommendations(steamId, handleEvent, controller.signal)
+      .catch((err) => {
+        if (controller.signal.aborted) return;
+        setError('Failed to load recommendations. Please try again later.');
+        console.error(err);
+      })
+      .finally(() => {
+        if (!controller.signal.aborted) setLoading(false);
+      });
+
+    return () => controller.abort();
   }, [searchParams]);
 
   if (loading) return <LoadingSpinner fullPage />;
@@ -68,9 +89,10 @@ export default function Recommendations() {
       <Navbar />
       <div className="recommendations-container">
         <h1>Your Personal Recommendations</h1>
-        {games.length > 0 && (
+        {preferences.length > 0 && (
           <p style={{ textAlign: 'center', marginBottom: '2rem', color: '#aaa' }}>
-            Based on your Steam library and playtime
+            Based on your Steam library and playtime: {preferences.slice(0, 8).join(', ')}
+            {!ranked && ' — finding matches…'}
           </p>
         )}
         <div className="games-grid">
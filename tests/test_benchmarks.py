@@ -0,0 +1,44 @@
+import fakeredis
+import pytest
+from unittest.mock import patch
+from benchmarks import responses
+from benchmarks.run import parse_args, run
+
+
+def test_benchmark_smoke():
+    args = parse_args([
+        "--concurrency", "2", "--requests", "4", "--endpoints", "recommend,game",
+        "--catalog-size", "200", "--library-size", "20", "--popular-count", "30",
+        "--latency-ms", "0", "--jitter-ms", "0",
+    ])
+    report = run(args)
+
+    assert [(r["endpoint"], r["phase"]) for r in report["results"]] == [
+        ("recommend", "cold"), ("recommend", "warm"), ("game", "cold"), ("game", "warm")
+    ]
+    for result in report["results"]:
+        assert result["errors"] == 0
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    warm_game = report["results"][3]
+    assert warm_game["steam_requests"]["appdetails"] == 0
+
+
+def test_benchmark_refuses_to_flush_non_empty_redis():
+    server = fakeredis.FakeServer()
+    existing = fakeredis.FakeRedis(server=server)
+    existing.set("user:data", "keep")
+
+    with patch("redis.Redis.from_url", return_value=fakeredis.FakeRedis(server=server)):
+        with pytest.raises(SystemExit):
+            run(parse_args(["--redis-url", "redis://localhost:6379/15", "--requests", "1"]))
+    assert existing.get("user:data") == b"keep"
+
+
+def test_response_benchmark_builds_identical_bodies():
+    rows = responses.run(responses.parse_args(["--games", "5", "--iterations", "2"]))
+
+    assert [(row["endpoint"], row["variant"]) for row in rows] == [
+        ("recommend", "legacy"), ("recommend", "fragments"), ("game", "legacy"), ("game", "fragments")
+    ]
+    assert rows[0]["body_bytes"] == rows[1]["body_bytes"]
+    assert rows[2]["body_bytes"] == rows[3]["body_bytes"]
@@ -0,0 +1,76 @@
+from unittest.mock import patch
+import json
+import pytest
+from backend.src.services.cache import LocalCache, parse_namespace_ttls, unwrap_swr, wrap_swr
+from backend.src.services.codec import MAGIC, Codec
+
+
+def test_local_cache_lru_eviction():
+    cache = LocalCache(2, {"game_details": 60})
+    cache.set("game_details:1", {"id": 1})
+    cache.set("game_details:2", {"id": 2})
+    assert cache.get("game_details:1") == (True, {"id": 1})
+
+    cache.set("game_details:3", {"id": 3})
+    assert cache.get("game_details:2") == (False, None)
+    assert cache.get("game_details:1")[0]
+    assert cache.get("game_details:3")[0]
+
+
+def test_local_cache_ttl_bounded_by_redis():
+    cache = LocalCache(10, parse_namespace_ttls("game_details=300,popular_games=60"))
+    assert cache.ttl_for("game_details:1", redis_ttl=5) == 5
+    assert cache.ttl_for("popular_games") == 60
+    assert cache.ttl_for("metrics:1:2") == 0
+
+    with patch("backend.src.services.cache.time.monotonic", return_value=100.0):
+        cache.set("game_details:1", {"id": 1}, redis_ttl=5)
+    with patch("backend.src.services.cache.time.monotonic", return_value=106.0):
+        assert cache.get("game_details:1") == (False, None)
+
+    cache.set("metrics:1:2", {"a": 1})
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize("serializer", ["msgpack", "orjson", "json"])
+@pytest.mark.parametrize("compression", ["zstd", "lz4", "none"])
+def test_codec_roundtrip(serializer, compression):
+    codec = Codec(serializer, compression, min_compress_size=64)
+    value = {"steam_appid": 10, "name": "Game", "categories": ["Co-op"] * 40, "release_year": None}
+    encoded = codec.encode("game_details:10", value)
+    assert encoded[:1] == MAGIC
+    assert Codec("json", "none").decode(encoded) == value
+
+
+def test_codec_reads_legacy_json_and_projects_user_games():
+    codec = Codec("msgpack", "zstd", min_compress_size=0)
+    legacy = {"__swr__": 1.0, "value": [{"appid": 1, "img_icon_url": "abc"}]}
+    assert codec.decode(json.dumps(legacy).encode()) == legacy
+
+    games = [
+        {"appid": appid, "name": f"Game {appid}", "playtime_forever": appid * 3, "rtime_last_played": 1700000000,
+         "img_icon_url": "f" * 40, "playtime_windows_forever": 5, "has_community_visible_stats": True}
+        for appid in range(500)
+    ]
+    stored = wrap_swr(codec.project("user_games:1", games), 3600)
+    encoded = codec.encode("user_games:1", stored)
+    entry = unwrap_swr(codec.decode(encoded))
+    assert entry.value == [
+        {"appid": g["appid"], "name": g["name"], "playtime_forever": g["playtime_forever"],
+         "rtime_last_played": g["rtime_last_played"]}
+        for g in games
+    ]
+    assert len(encoded) < len(json.dumps(wrap_swr(games, 3600))) / 10
+
+
+@pytest.mark.parametrize("serializer", ["msgpack", "json"])
+def test_codec_columns_keep_absent_fields_absent(serializer):
+    codec = Codec(serializer, "none")
+    games = [
+        {"appid": 1, "name": "Played", "playtime_forever": 60, "rtime_last_played": 1700000000},
+        {"appid": 2, "name": "Never launched", "playtime_forever": 0},
+        {"appid": 3, "name": None, "playtime_forever": 5, "rtime_last_played": 0},
+    ]
+    stored = wrap_swr(codec.project("user_games:1", games), 3600)
+    # Та же форма, что и в L1: без rtime_last_played: None у второй записи
+    assert unwrap_swr(codec.decode(codec.encode("user_games:1", stored))).value == games
@@ -0,0 +1,94 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+from backend.src.models.game import Game
+from backend.src.services.cache import CacheEntry
+from backend.src.services.catalog import CatalogStore, build_catalog_snapshot
+from backend.src.services.steam import steam_service
+from backend.src.utils.fragments import dumps, public_payload
+
+
+def _games(count, suffix=""):
+    return [
+        Game(
+            steam_appid=appid * 10,
+            name=f"Игра {appid}{suffix}",
+            categories=["Single-player", "Co-op"][:appid % 3],
+            genres=["RPG"] if appid % 2 else [],
+            recommendations=appid * 100,
+            release_year=2000 + appid % 20 if appid % 5 else None
+        )
+        for appid in range(1, count + 1)
+    ]
+
+
+def test_catalog_lookup_and_atomic_swap(tmp_path):
+    path = str(tmp_path / "catalog.bin")
+    games = _games(1000)
+    assert build_catalog_snapshot(games, path) == 1000
+
+    store = CatalogStore(path, check_interval=3600)
+    assert store.reload()
+    for game in games:
+        record = store.get(game.steam_appid)
+        assert record == game
+        # Фрагмент ответа берётся из кучи снимка, без кодирования на запрос
+        assert record.fragment == dumps(public_payload(game))
+        assert record.detail_fragment == dumps(game.dict())
+    assert store.get(5) is None and len(store) == 1000
+
+    build_catalog_snapshot(_games(10, " v2"), path)
+    assert store.get(10).name == "Игра 1"
+    assert store.reload()
+    assert store.get(10).name == "Игра 1 v2"
+    assert store.get(20 * 10) is None
+
+
+def test_game_details_prefer_catalog(tmp_path):
+    path = str(tmp_path / "catalog.bin")
+    games = _games(5)
+    build_catalog_snapshot(games[:3], path)
+    store = CatalogStore(path)
+
+    redis_entries = AsyncMock(return_value=[None, None])
+    fetched = AsyncMock(side_effect=lambda appid: games[appid // 10 - 1])
+    with patch("backend.src.services.steam.catalog_store", store), \
+            patch("backend.src.services.steam.redis_service.get_many_cached_entries_async", redis_entries), \
+            patch.object(steam_service, "_load_game_details", fetched):
+        result = asyncio.run(steam_service.get_game_details_many_async([10, 40, 20, 50]))
+
+    assert result == [games[0], games[3], games[1], games[4]]
+    redis_entries.assert_awaited_once_with(["game_details:40", "game_details:50"])
+
+
+def test_old_catalog_is_fallback_after_cache(tmp_path):
+    path = str(tmp_path / "catalog.bin")
+    games = _games(5)
+    build_catalog_snapshot(_games(3, " old"), path)
+    store = CatalogStore(path)
+
+    # Кэш, обновлённый после сборки снимка, важнее снимка старше soft TTL
+    refreshed = CacheEntry(games[0].dict(), True)
+    redis_entries = AsyncMock(return_value=[refreshed, None, None])
+    fetched = AsyncMock(side_effect=lambda appid: games[appid // 10 - 1])
+    with patch("backend.src.services.steam.catalog_store", store), \
+            patch("backend.src.services.steam.settings.GAME_DETAILS_SOFT_TTL", 0), \
+            patch("backend.src.services.steam.redis_service.get_many_cached_entries_async", redis_entries), \
+            patch.object(steam_service, "_schedule_refresh") as refresh, \
+            patch.object(steam_service, "_load_game_details", fetched):
+        result = asyncio.run(steam_service.get_game_details_many_async([10, 20, 40]))
+
+    assert [game.name for game in result] == ["Игра 1", "Игра 2 old", "Игра 4"]
+    redis_entries.assert_awaited_once_with(["game_details:10", "game_details:20", "game_details:40"])
+    refresh.assert_called_once()
+    fetched.assert_awaited_once_with(40)
+
+
+def test_long_names_are_cut_on_character_boundary(tmp_path):
+    path = str(tmp_path / "catalog.bin")
+    # 0xFFFF байт попадает в середину двухбайтового символа
+    game = Game(steam_appid=10, name="я" * 40000, categories=["Тег" * 30000], genres=[])
+    build_catalog_snapshot([game], path)
+
+    record = CatalogStore(path).get(10)
+    assert record.name == "я" * (0xFFFF // 2)
+    assert record.categories == [("Тег" * 30000).encode()[:0xFFFF].decode("utf-8", "ignore")]
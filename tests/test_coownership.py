@@ -0,0 +1,126 @@
+import asyncio
+import math
+import random
+import fakeredis
+import numpy as np
+from unittest.mock import patch
+from backend.src.services.coownership import (
+    CoOwnershipBuilder, CoOwnershipStore, build_coownership_model, library_vector
+)
+from backend.src.services.cache import LocalCache
+from backend.src.services.redis import RedisService, redis_service
+
+
+def _libraries(users=300, games=80, seed=3):
+    rng = random.Random(seed)
+    return {
+        str(user): [
+            {"appid": 10 * appid, "playtime_forever": rng.choice([0, rng.randint(1, 5000)])}
+            for appid in rng.sample(range(1, games + 1), rng.randint(2, 25))
+        ]
+        for user in range(users)
+    }
+
+
+def _cosine(libraries, max_games):
+    vectors = {}
+    for games in libraries.values():
+        vector = library_vector(games, max_games)
+        if vector is None:
+            continue
+        for appid, weight in zip(*vector):
+            vectors.setdefault(int(appid), {})[id(games)] = weight
+    norms = {appid: math.sqrt(sum(w * w for w in users.values())) for appid, users in vectors.items()}
+
+    def similarity(a, b):
+        shared = vectors[a].keys() & vectors[b].keys()
+        return sum(vectors[a][user] * vectors[b][user] for user in shared) / (norms[a] * norms[b]), len(shared)
+    return vectors, similarity
+
+
+def test_model_matches_brute_force_cosine(tmp_path):
+    path = str(tmp_path / "coownership.bin")
+    libraries = _libraries()
+    vectors = [vector for vector in (library_vector(games, 20) for games in libraries.values()) if vector]
+    build_coownership_model(vectors, path, top_k=5, min_support=2)
+
+    store = CoOwnershipStore(path, check_interval=3600)
+    assert store.reload()
+    items, similarity = _cosine(libraries, 20)
+    for appid in list(items)[:20]:
+        expected = sorted(
+            ((other, similarity(appid, other)[0]) for other in items
+             if other != appid and similarity(appid, other)[1] >= 2),
+            key=lambda x: (-x[1], x[0])
+        )[:5]
+        got = store.neighbours({appid: 1.0}, set(), 5)
+        assert [other for other, _ in got] == [other for other, _ in expected]
+        assert np.allclose([score for _, score in got], [score for _, score in expected], atol=1e-5)
+
+    # Соседи нескольких игр - средняя близость с весами игр, без исключённых
+    played = {10: 2.0, 20: 1.0}
+    combined = store.neighbours(played, {30}, 100)
+    assert 30 not in dict(combined)
+    for other, score in combined[:5]:
+        direct = {appid: dict(store.neighbours({appid: 1.0}, set(), 100)).get(other, 0.0) for appid in played}
+        assert math.isclose(score, (2 * direct[10] + direct[20]) / 3, rel_tol=1e-5)
+
+
+def test_builder_reloads_only_changed_libraries(tmp_path):
+    fake = fakeredis.FakeAsyncRedis()
+    libraries = _libraries(users=20)
+    builder = CoOwnershipBuilder(max_games=20, top_k=10, min_support=1)
+    path = str(tmp_path / "coownership.bin")
+
+    async def scenario():
+        for steam_id, games in libraries.items():
+            await redis_service.cache_data_async(f"user_games:{steam_id}", games)
+        first = await builder.rebuild(path)
+
+        loaded = []
+        original = redis_service.get_many_cached_data_async
+
+        async def spy(keys):
+            loaded.extend(keys)
+            return await original(keys)
+
+        with patch.object(redis_service, "get_many_cached_data_async", side_effect=spy):
+            assert await builder.rebuild(path) is None
+            changed = [{"appid": 5000, "playtime_forever": 600}, {"appid": 10, "playtime_forever": 600}]
+            await redis_service.cache_data_async("user_games:new", changed)
+            await redis_service.mark_library_changed_async("new", builder.cursor + 1, 3600)
+            second = await builder.rebuild(path)
+        return first, second, loaded
+
+    with patch.object(RedisService, "aclient", property(lambda self: fake)):
+        first, second, loaded = asyncio.run(scenario())
+
+    assert loaded == ["user_games:new"]
+    assert second[0] == first[0] + 1
+    store = CoOwnershipStore(path)
+    assert [appid for appid, _ in store.neighbours({5000: 1.0}, set(), 5)] == [10]
+
+
+def test_builder_evicts_expired_libraries(tmp_path):
+    fake = fakeredis.FakeAsyncRedis()
+    builder = CoOwnershipBuilder(max_games=20, top_k=10, min_support=1)
+    path = str(tmp_path / "coownership.bin")
+    library = [{"appid": 10, "playtime_forever": 600}, {"appid": 20, "playtime_forever": 60}]
+
+    async def scenario():
+        await redis_service.cache_data_async("user_games:kept", library)
+        await redis_service.cache_data_async("user_games:gone", library)
+        await builder.rebuild(path)
+        before = set(builder.libraries)
+        await fake.delete("user_games:gone")
+        rebuilt = await builder.rebuild(path)
+        return before, rebuilt
+
+    with patch.object(RedisService, "aclient", property(lambda self: fake)), \
+            patch.object(redis_service, "local", LocalCache(0, {})):
+        before, rebuilt = asyncio.run(scenario())
+
+    assert before == {"kept", "gone"}
+    assert set(builder.libraries) == {"kept"}
+    # Пропажа библиотеки - тоже изменение: модель пересобрана
+    assert rebuilt is not None
@@ -0,0 +1,135 @@
+import asyncio
+import random
+import fakeredis
+import pytest
+from unittest.mock import AsyncMock, patch
+from backend.src.services.library import SORT_FIELDS, _page_from_list, decode_cursor, summarize, user_libraries
+from backend.src.services.redis import RedisService
+
+STEAM_ID = "76561197960434622"
+
+
+def _library(size=250):
+    rng = random.Random(7)
+    return [
+        {
+            "appid": 10 * (i + 1),
+            "name": f"Game {i}",
+            "playtime_forever": rng.choice([0, rng.randint(1, 6000)]),
+            "rtime_last_played": rng.randint(1500000000, 1700000000),
+            "img_icon_url": "ignored",
+        }
+        for i in range(size)
+    ]
+
+
+@pytest.fixture
+def fake_redis():
+    fake = fakeredis.FakeAsyncRedis()
+    with patch.object(RedisService, "aclient", property(lambda self: fake)):
+        yield fake
+
+
+def _pages(sort, descending, min_playtime, limit=30):
+    async def collect():
+        appids, cursor = [], None
+        while True:
+            page = await user_libraries.page_async(STEAM_ID, sort, descending, min_playtime, cursor, limit)
+            appids.extend(game["appid"] for game in page.games)
+            cursor = page.next_cursor
+            if cursor is None:
+                return appids
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("sort", ["recent", "playtime"])
+@pytest.mark.parametrize("descending", [True, False])
+@pytest.mark.parametrize("min_playtime", [0, 600])
+def test_pages_match_full_sort(fake_redis, sort, descending, min_playtime):
+    games = _library()
+    asyncio.run(user_libraries.index_async(STEAM_ID, games))
+    field = SORT_FIELDS[sort]
+    expected = [
+        game["appid"] for game in sorted(games, key=lambda x: (x[field], x["appid"]), reverse=descending)
+        if game["playtime_forever"] >= min_playtime
+    ]
+    appids = _pages(sort, descending, min_playtime)
+    if sort == "playtime":
+        # Порядок равных значений у sorted set и sorted() может различаться
+        assert sorted(appids) == sorted(expected)
+        values = [next(g for g in games if g["appid"] == appid)[field] for appid in appids]
+        assert values == sorted(values, reverse=descending)
+    else:
+        assert appids == expected
+
+    fallback, cursor = [], None
+    while True:
+        page = _page_from_list(games, field, descending, min_playtime, decode_cursor(cursor), 30)
+        fallback.extend(game["appid"] for game in page.games)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert sorted(fallback) == sorted(expected)
+
+
+def test_summary_from_index_matches_full_library(fake_redis):
+    games = _library()
+    with patch("backend.src.services.steam.steam_service.get_user_games_async",
+               AsyncMock(return_value=games)) as get_user_games:
+        indexed = asyncio.run(user_libraries.summary_async(STEAM_ID))
+        again = asyncio.run(user_libraries.summary_async(STEAM_ID))
+
+    # Первый вызов строит индекс из кэша user_games, дальше Steam и кэш не нужны
+    get_user_games.assert_awaited_once()
+    expected = summarize(games)
+    for summary in (indexed, again):
+        assert summary.game_count == expected.game_count
+        assert summary.played_count == expected.played_count
+        assert summary.fingerprint == expected.fingerprint
+        assert summary.played_appids == expected.played_appids
+        assert [game["appid"] for game in summary.top_played] == [game["appid"] for game in expected.top_played]
+    assert "img_icon_url" not in again.top_played[0]
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_cursor_pages_through_ties_like_fallback(fake_redis, descending):
+    # Большинство игр без запусков: длинные серии равных значений
+    games = [
+        {"appid": appid, "playtime_forever": 0 if appid % 4 else 60, "rtime_last_played": 0 if appid % 3 else 1600000000}
+        for appid in range(1, 120)
+    ]
+    asyncio.run(user_libraries.index_async(STEAM_ID, games))
+
+    for sort, min_playtime in (("recent", 0), ("playtime", 0), ("recent", 30)):
+        indexed = _pages(sort, descending, min_playtime, limit=7)
+        fallback, cursor = [], None
+        while True:
+            page = _page_from_list(games, SORT_FIELDS[sort], descending, min_playtime, decode_cursor(cursor), 7)
+            fallback.extend(game["appid"] for game in page.games)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        assert indexed == fallback
+        assert len(set(indexed)) == len(indexed) == sum(game["playtime_forever"] >= min_playtime for game in games)
+
+
+def test_cursor_resumes_after_library_changes(fake_redis):
+    games = _library(50)
+    asyncio.run(user_libraries.index_async(STEAM_ID, games))
+    first = asyncio.run(user_libraries.page_async(STEAM_ID, "recent", cursor=None, limit=10))
+    shown = [game["appid"] for game in first.games]
+
+    # До курсора появились новые игры и пропала одна из показанных
+    changed = [game for game in games if game["appid"] != shown[0]]
+    changed += [{"appid": appid, "playtime_forever": 5, "rtime_last_played": 1800000000} for appid in (99998, 99999)]
+    asyncio.run(user_libraries.index_async(STEAM_ID, changed))
+    second = asyncio.run(user_libraries.page_async(STEAM_ID, "recent", cursor=first.next_cursor, limit=10))
+
+    ordered = [game["appid"] for game in sorted(games, key=lambda x: x["rtime_last_played"], reverse=True)]
+    assert [game["appid"] for game in second.games] == ordered[10:20]
+
+
+def test_invalid_cursor_is_rejected():
+    for cursor in ("10", "a:b", "1:2:3"):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
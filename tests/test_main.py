@@ -1,7 +1,10 @@
+import asyncio
+import json
 from fastapi.testclient import TestClient
 from unittest.mock import patch
-from backend.src.main import app
-from backend.src.models.game import Game, RecommendationMetrics
+from backend.src.main import _until_disconnect, app, recommend_admission
+from backend.src.models.game import BatchRecommendation, Game, GameRecord, RecommendationMetrics
+from backend.src.utils.resilience import AdmissionController
 
 client = TestClient(app)
 
@@ -15,7 +18,7 @@ def test_login_redirect():
     assert "steamcommunity.com/openid" in response.headers.get("location", "")
 
 
-@patch("backend.src.main.steam_service.get_user_games")
+@patch("backend.src.main.steam_service.get_user_games_async")
 def test_user_info(mock_get_user_games):
     mock_get_user_games.return_value = [
         {"appid": 123, "name": "Test Game", "playtime_forever": 120, "rtime_last_played": 1234567890}
@@ -24,10 +27,11 @@ def test_user_info(mock_get_user_games):
     assert response.status_code == 200
     data = response.json()
     assert data["steam_id"] == TEST_STEAM_ID
-    assert isinstance(data["recent_games"], list)
+    assert [game["appid"] for game in data["recent_games"]] == [123]
+    assert data["next_cursor"] is None
 
 
-@patch("backend.src.main.steam_service.get_game_details")
+@patch("backend.src.main.steam_service.get_game_details_async")
 def test_game_info(mock_get_game_details):
     mock_get_game_details.return_value = Game(
         steam_appid=TEST_APP_ID,
@@ -45,8 +49,19 @@ def test_game_info(mock_get_game_details):
     assert json["steam_appid"] == TEST_APP_ID
 
 
-@patch("backend.src.main.get_recommendations")
-@patch("backend.src.main.redis_service.cache_data")
+@patch("backend.src.main.steam_service.get_game_details_async")
+def test_game_info_serves_stored_fragment(mock_get_game_details):
+    # Готовый ответ /game из кэша или каталога отдаётся без повторного кодирования
+    stored = b'{"steam_appid":730,"name":"Stored"}'
+    mock_get_game_details.return_value = GameRecord(TEST_APP_ID, "Mocked Game", detail_fragment=stored)
+
+    response = client.get(f"/game/{TEST_APP_ID}")
+    assert response.status_code == 200
+    assert response.content == stored
+
+
+@patch("backend.src.main.get_recommendations_async")
+@patch("backend.src.main.redis_service.add_metrics_async")
 def test_recommendations(mock_cache_data, mock_get_recommendations):
     mock_game = Game(
         name="Game A",
@@ -77,14 +92,136 @@ def test_recommendations(mock_cache_data, mock_get_recommendations):
     assert json["recommendations"][0]["name"] == "Game A"
 
 
-@patch("backend.src.main.redis_service.client.keys")
-@patch("backend.src.main.redis_service.get_cached_data")
-def test_metrics(mock_get_cached_data, mock_keys):
-    mock_keys.return_value = [f"metrics:{TEST_STEAM_ID}:123"]
-    mock_get_cached_data.return_value = {"mock": "metric"}
+@patch("backend.src.main.get_recommendations_async")
+def test_recommendations_rejected_when_overloaded(mock_get_recommendations):
+    admission = AdmissionController(1, max_queue=0)
+    admission.slots.in_flight = 1
+    with patch("backend.src.main.recommend_admission", admission):
+        response = client.get(f"/recommend/{TEST_STEAM_ID}")
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    mock_get_recommendations.assert_not_called()
+
+    assert client.get(f"/recommend/{TEST_STEAM_ID}", headers={"X-Request-Timeout-Ms": "soon"}).status_code == 400
+
+
+@patch("backend.src.main.redis_service.add_metrics_async")
+@patch("backend.src.main.iter_recommendations")
+def test_recommendations_stream(mock_iter, mock_add_metrics):
+    game = Game(steam_appid=123, name="Game A", categories=["Action"])
+    metrics = RecommendationMetrics(
+        user_id=TEST_STEAM_ID, timestamp=1234567890, execution_time=0.01, input_games_count=1,
+        recommended_games_count=1, categories_used=["Action"], genres_used=[], metrics={}
+    )
+
+    async def events(steam_id, deadline=None):
+        yield {"event": "preferences", "categories": ["Action"], "genres": []}
+        yield {"event": "match", "games": []}
+        yield {"event": "match", "games": [game]}
+        yield {"event": "result", "recommendations": [game], "metrics": metrics}
+
+    mock_iter.side_effect = events
+    response = client.get(f"/recommend/{TEST_STEAM_ID}/stream")
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["event"] for line in lines] == ["preferences", "match", "ranking", "metrics"]
+    assert lines[2]["recommendations"][0]["appid"] == 123
+
+    sse = client.get(f"/recommend/{TEST_STEAM_ID}/stream", params={"format": "sse"})
+    assert sse.headers["content-type"].startswith("text/event-stream")
+    assert sse.text.startswith("event: preferences\ndata: ")
+
+
+def test_stream_cancelled_on_disconnect():
+    cleanup = []
+
+    class DisconnectingRequest:
+        async def receive(self):
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+
+    async def slow_events():
+        try:
+            yield {"event": "preferences"}
+            await asyncio.sleep(60)
+            yield {"event": "result"}
+        finally:
+            cleanup.append("closed")
+
+    async def consume():
+        return [event async for event in _until_disconnect(DisconnectingRequest(), slow_events())]
+
+    assert asyncio.run(asyncio.wait_for(consume(), 5)) == [{"event": "preferences"}]
+    assert cleanup == ["closed"]
+
+
+@patch("backend.src.main.iter_recommendations")
+def test_stream_disconnect_before_first_chunk_releases_slot(mock_iter):
+    async def events(steam_id, deadline=None):
+        await asyncio.sleep(60)
+        yield {"event": "preferences"}
+
+    mock_iter.side_effect = events
+
+    async def call():
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": f"/recommend/{TEST_STEAM_ID}/stream", "raw_path": b"",
+            "root_path": "", "query_string": b"", "headers": [], "client": ("test", 1), "server": ("test", 80),
+        }
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            # Клиент ушёл раньше, чем ушли заголовки: тело так и не начинают читать
+            raise OSError("connection reset")
+
+        try:
+            await asyncio.wait_for(app(scope, receive, send), 5)
+        except Exception:
+            pass
+
+    before = recommend_admission.slots.in_flight
+    for _ in range(3):
+        asyncio.run(call())
+    assert recommend_admission.slots.in_flight == before
+
+
+@patch("backend.src.main.iter_batch_recommendations")
+def test_batch_recommendations(mock_iter_batch):
+    async def results(steam_ids):
+        yield BatchRecommendation(steam_id=steam_ids[0], status="ok",
+                                  recommendations=[Game(steam_appid=123, name="Game A")])
+        yield BatchRecommendation(steam_id=steam_ids[1], status="error", error="timeout")
+
+    mock_iter_batch.side_effect = results
+    response = client.post("/recommend/batch", json={"steam_ids": [TEST_STEAM_ID, "2"]})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["steam_id"] == TEST_STEAM_ID and lines[0]["recommendations"][0]["appid"] == 123
+    assert lines[1]["status"] == "error" and lines[1]["error"] == "timeout"
+    assert lines[2]["summary"]["ok"] == 1 and lines[2]["summary"]["error"] == 1
+
+    assert client.post("/recommend/batch", json={"steam_ids": []}).status_code == 400
+
+
+@patch("backend.src.main.redis_service.get_recent_metrics_async")
+def test_metrics(mock_get_recent_metrics):
+    mock_get_recent_metrics.return_value = [{"mock": "metric"}]
     response = client.get(f"/metrics/{TEST_STEAM_ID}")
     assert response.status_code == 200
     json = response.json()
     assert "metrics" in json
     assert isinstance(json["metrics"], list)
     assert json["metrics"][0] == {"mock": "metric"}
+    mock_get_recent_metrics.assert_awaited_once_with(TEST_STEAM_ID, 10)
+
+
+def test_internal_metrics():
+    response = client.get("/internal/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE playiter_steam_request_seconds histogram" in response.text
+    assert "# TYPE playiter_cache_lookups_total counter" in response.text
@@ -0,0 +1,67 @@
+import asyncio
+import fakeredis
+from unittest.mock import AsyncMock, patch
+from backend.src.services.cache import LocalCache
+from backend.src.services.prefetch import CatalogPrefetcher
+from backend.src.services.redis import RedisService, redis_service
+from backend.src.services.steam import steam_service
+from backend.src.utils.tag_index import TagIndex
+
+
+def _run_cycle(scenario, lease_token="token"):
+    fake = fakeredis.FakeAsyncRedis()
+    fetched = []
+
+    async def fetch_details(appid):
+        fetched.append(appid)
+        await redis_service.cache_data_async(f"game_details:{appid}", {"steam_appid": appid, "name": "x"}, ttl=86400, soft_ttl=3600)
+
+    fetch_popular = AsyncMock(return_value=[{"appid": appid} for appid in (10, 20, 30, 40)])
+    with patch.object(RedisService, "aclient", property(lambda self: fake)), \
+            patch.object(redis_service, "local", LocalCache(0, {})), \
+            patch.object(redis_service, "acquire_lock_async", AsyncMock(return_value=lease_token)), \
+            patch.object(redis_service, "extend_lock_async", AsyncMock(return_value=True)), \
+            patch.object(redis_service, "release_lock_async", AsyncMock()), \
+            patch("backend.src.services.prefetch.tag_index", TagIndex()), \
+            patch.object(steam_service, "_fetch_popular_games", fetch_popular), \
+            patch.object(steam_service, "_fetch_game_details", side_effect=fetch_details):
+        return asyncio.run(scenario()), fetched + [("popular", fetch_popular.await_count)]
+
+
+def test_prefetch_orders_by_priority_and_skips_fresh():
+    prefetcher = CatalogPrefetcher(60000, concurrency=1, refresh_ahead=600)
+
+    async def scenario():
+        # 10 - свежая, 20 - устареет через 5 минут, 30 и 40 - нет в кэше
+        await redis_service.cache_data_async("game_details:10", {"steam_appid": 10}, ttl=86400, soft_ttl=3600)
+        await redis_service.cache_data_async("game_details:20", {"steam_appid": 20}, ttl=82800 + 300, soft_ttl=300)
+        await redis_service.cache_data_async("user_games:1", [{"appid": 50}, {"appid": 40}], ttl=3600)
+        ran = await prefetcher.run_once()
+        return ran, prefetcher.coverage(), prefetcher.queue_depth()
+
+    (ran, coverage, depth), fetched = _run_cycle(scenario)
+    assert ran and coverage == 1.0 and depth == 0
+    assert fetched == [30, 40, 50, 20, ("popular", 1)]
+
+
+def test_prefetch_skips_cycle_without_lease():
+    prefetcher = CatalogPrefetcher(60000)
+    (ran, fetched) = _run_cycle(prefetcher.run_once, lease_token=None)
+    assert ran is False and fetched == [("popular", 0)]
+
+
+def test_prefetch_uses_fresh_popular_games_and_samples_recent_libraries():
+    prefetcher = CatalogPrefetcher(60000, concurrency=1, library_sample=1)
+
+    async def scenario():
+        await redis_service.cache_data_async("popular_games", [{"appid": 10}], ttl=86400, soft_ttl=3600)
+        await redis_service.cache_data_async("game_details:10", {"steam_appid": 10}, ttl=86400, soft_ttl=3600)
+        await redis_service.cache_data_async("user_games:1", [{"appid": 50}], ttl=3600)
+        await redis_service.cache_data_async("user_games:2", [{"appid": 60}], ttl=3600)
+        await redis_service.mark_library_changed_async("1", 100.0, 3600)
+        await redis_service.mark_library_changed_async("2", 200.0, 3600)
+        return await prefetcher.run_once()
+
+    ran, fetched = _run_cycle(scenario)
+    # Чарт свежий - Steam не вызывается; из библиотек - только последняя загруженная
+    assert ran and fetched == [60, ("popular", 0)]
@@ -0,0 +1,107 @@
+import asyncio
+import fakeredis
+import pytest
+from unittest.mock import patch
+from backend.src.models.game import Game
+from backend.src.services.library import summarize
+from backend.src.services.profiles import UserProfileService
+from backend.src.services.redis import RedisService
+from backend.src.services.singleflight import steam_flights
+
+STEAM_ID = "76561197960434622"
+TAGS = ["Single-player", "Co-op", "RPG", "Action", "Indie"]
+
+
+def _details(appid):
+    return Game(steam_appid=appid, name=f"Game {appid}", categories=[TAGS[appid % 2]], genres=TAGS[2 + appid % 3:3 + appid % 3])
+
+
+def _library(size=40):
+    return [
+        {"appid": appid, "name": f"Game {appid}", "playtime_forever": 30 * appid, "rtime_last_played": 1600000000 + appid}
+        for appid in range(1, size + 1)
+    ]
+
+
+@pytest.fixture
+def fetched():
+    fake = fakeredis.FakeAsyncRedis()
+    requested = []
+
+    async def details_many(appids):
+        requested.append(list(appids))
+        return [_details(appid) for appid in appids]
+
+    with patch.object(RedisService, "aclient", property(lambda self: fake)), \
+            patch("backend.src.services.steam.steam_service.get_game_details_many_async", side_effect=details_many):
+        yield requested
+
+
+def _weights(profile):
+    return {tag: round(weight, 6) for tag, weight in {**profile.categories, **profile.genres}.items()}
+
+
+def test_profile_updates_from_library_delta(fetched):
+    service = UserProfileService()
+    games = _library()
+    first = asyncio.run(service.update_from_games_async(STEAM_ID, games))
+    assert sorted(fetched[0]) == sorted(game["appid"] for game in first.games)
+
+    # Та же библиотека - ни одной загрузки деталей
+    assert asyncio.run(service.update_from_games_async(STEAM_ID, games)).fingerprint == first.fingerprint
+    assert len(fetched) == 1
+
+    # Одна игра из топа наиграла больше, одна новая ворвалась в топ
+    changed = [dict(game) for game in games]
+    changed[-1]["playtime_forever"] += 600
+    changed.append({"appid": 500, "name": "New", "playtime_forever": 9000, "rtime_last_played": 1700000000})
+    updated = asyncio.run(service.update_from_games_async(STEAM_ID, changed))
+    assert fetched[1] == [500]
+
+    rebuilt = asyncio.run(UserProfileService()._update(STEAM_ID, changed, updated.fingerprint, None))
+    assert [game["appid"] for game in updated.games] == [game["appid"] for game in rebuilt.games]
+    assert _weights(updated) == _weights(rebuilt)
+
+
+def test_pipeline_reads_profile_in_one_lookup(fetched):
+    service = UserProfileService()
+    games = _library()
+    asyncio.run(service.update_from_games_async(STEAM_ID, games))
+    library = summarize(games)
+
+    profile = asyncio.run(service.get_async(STEAM_ID, library))
+    assert len(fetched) == 1
+    assert [game for game, _ in profile.played()] == profile.games
+    assert {game["appid"] for game in profile.games} == {game["appid"] for game in library.top_played}
+    assert all(details.categories for _, details in profile.played())
+
+    # Библиотека изменилась, а фоновое обновление не успело - профиль догоняет её по сводке
+    games[0]["playtime_forever"] = 100000
+    games[0]["rtime_last_played"] = 1700000000
+    profile = asyncio.run(service.get_async(STEAM_ID, summarize(games)))
+    assert fetched[1:] == [[1]]
+    assert profile.fingerprint == summarize(games).fingerprint
+
+
+def test_catchup_from_summary_keeps_full_snapshot(fetched):
+    service = UserProfileService()
+    games = _library()
+    full = asyncio.run(service.update_from_games_async(STEAM_ID, games))
+    assert len(full.snapshot) == len(games)
+
+    games[0]["playtime_forever"] = 100000
+    games[0]["rtime_last_played"] = 1700000000
+    keys = []
+    original = steam_flights.do
+
+    async def recording(key, fn, recheck=None):
+        keys.append(key)
+        return await original(key, fn, recheck)
+
+    with patch.object(steam_flights, "do", side_effect=recording):
+        caught_up = asyncio.run(service.get_async(STEAM_ID, summarize(games)))
+
+    # Догоняние по топу идёт отдельным single-flight и не теряет снимок остальных игр
+    assert keys == [f"user_profile_catchup:{STEAM_ID}"]
+    assert len(caught_up.snapshot) == len(games)
+    assert caught_up.snapshot["1"][0] == 100000
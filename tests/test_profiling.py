@@ -0,0 +1,73 @@
+import asyncio
+import time
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from backend.src.config import settings
+from backend.src.main import app
+from backend.src.models.game import Game
+from backend.src.services.redis import redis_service
+from backend.src.utils.aio import LoopLocal
+
+client = TestClient(app)
+AUTH = {"X-Profile": "secret"}
+
+
+async def _slow_details(appid):
+    async def spin():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+
+    await asyncio.gather(spin(), asyncio.sleep(0.05))
+    return Game(steam_appid=appid, name="Profiled", categories=[], genres=[])
+
+
+@pytest.fixture
+def profiling():
+    server = fakeredis.FakeServer()
+    with patch.object(redis_service, "_async_clients", LoopLocal(lambda: fakeredis.FakeAsyncRedis(server=server))), \
+            patch.object(settings, "PROFILING_TOKEN", "secret"), \
+            patch.object(settings, "PROFILING_INTERVAL_MS", 1.0), \
+            patch("backend.src.main.steam_service.get_game_details_async", side_effect=_slow_details):
+        yield
+
+
+def test_profile_header_stores_collapsed_stacks(profiling):
+    response = client.get("/game/730", headers={"X-Profile": "secret", "X-Request-Id": "req-1"})
+    assert response.status_code == 200
+    # Ключ профиля выдаёт сервер, X-Request-Id клиента - только поле профиля
+    profile_id = response.headers["x-profile-id"]
+    assert profile_id != "req-1" and len(profile_id) == 32
+
+    listing = client.get("/internal/profiles", headers=AUTH).json()
+    assert listing["count"] == 1
+    summary = listing["profiles"][0]
+    assert summary["id"] == profile_id and summary["request_id"] == "req-1" and summary["path"] == "/game/730" and summary["status"] == 200
+    assert summary["trigger"] == "header" and summary["samples"] > 0
+    assert "stacks" not in summary
+
+    download = client.get(f"/internal/profiles/{profile_id}", headers=AUTH)
+    assert download.status_code == 200
+    assert f'filename="{profile_id}.collapsed"' in download.headers["content-disposition"]
+    lines = download.text.splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == summary["samples"]
+    # На CPU - стек корутины, порождённой запросом, в ожидании - цепочка await
+    assert any("spin (" in line for line in lines)
+    assert any(line.rsplit(" ", 1)[0].endswith("[await]") and "get_game_info (" in line for line in lines)
+
+
+def test_requests_without_trigger_are_not_profiled(profiling):
+    response = client.get("/game/730", headers={"X-Profile": "wrong"})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert client.get("/internal/profiles", headers=AUTH).json()["count"] == 0
+    assert client.get("/internal/profiles/missing", headers=AUTH).status_code == 404
+
+
+def test_profiles_require_token(profiling):
+    assert client.get("/internal/profiles").status_code == 403
+    assert client.get("/internal/profiles/req-1", headers={"X-Profile": "wrong"}).status_code == 403
+    with patch.object(settings, "PROFILING_TOKEN", ""):
+        assert client.get("/internal/profiles", headers=AUTH).status_code == 404
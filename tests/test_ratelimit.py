@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from backend.src.services.redis import redis_service
+from backend.src.utils.ratelimit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, SharedRateLimiter
+
+pytest.importorskip("lupa")
+
+
+@pytest.fixture
+def shared_redis():
+    import fakeredis
+    server = fakeredis.FakeServer()
+    with patch.object(type(redis_service), "aclient", property(lambda self: fakeredis.FakeAsyncRedis(server=server))):
+        yield
+
+
+def test_gcra_budget_is_shared_between_limiters(shared_redis):
+    async def scenario():
+        reserve = redis_service.reserve_rate_tokens_async
+        # Два «воркера» с одним лимитом 1 запрос/с и всплеском 4
+        first = SharedRateLimiter("shared_test", 1, 4, reserve, local_batch=1)
+        second = SharedRateLimiter("shared_test", 1, 4, reserve, local_batch=1)
+        sources = [(await limiter.acquire())[1] for limiter in (first, second, first, second)]
+        assert sources == ["redis"] * 4
+        granted, wait_ms = await reserve("shared_test", 1000, 4000, 1)
+        return granted, wait_ms
+
+    granted, wait_ms = asyncio.run(scenario())
+    assert granted == 0
+    assert 900 < wait_ms <= 1000
+
+
+def test_background_priority_keeps_headroom_for_interactive(shared_redis):
+    async def scenario():
+        limiter = SharedRateLimiter("priority_test", 1, 4, redis_service.reserve_rate_tokens_async, local_batch=1)
+        for _ in range(2):
+            await limiter.acquire(PRIORITY_BACKGROUND)
+        background = asyncio.ensure_future(limiter.acquire(PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.05)
+        blocked = not background.done()
+        waited, _ = await limiter.acquire(PRIORITY_INTERACTIVE)
+        background.cancel()
+        return blocked, waited
+
+    blocked, waited = asyncio.run(scenario())
+    assert blocked
+    assert waited < 0.05
+
+
+def test_local_batch_saves_round_trips(shared_redis):
+    calls = []
+    reserve = redis_service.reserve_rate_tokens_async
+
+    async def counting_reserve(*args):
+        calls.append(args[-1])
+        return await reserve(*args)
+
+    async def scenario():
+        limiter = SharedRateLimiter("batch_test", 100, 100, counting_reserve, local_batch=4)
+        results = await asyncio.gather(*(limiter.acquire() for _ in range(8)))
+        return [source for _, source in results]
+
+    sources = asyncio.run(scenario())
+    assert sources.count("local") >= 4
+    assert len(calls) < 8
+
+
+def test_falls_back_to_local_bucket_without_redis():
+    async def broken_reserve(*args):
+        return None
+
+    async def scenario():
+        limiter = SharedRateLimiter("fallback_test", 100, 10, broken_reserve)
+        return [(await limiter.acquire())[1] for _ in range(3)]
+
+    assert asyncio.run(scenario()) == ["fallback"] * 3
@@ -0,0 +1,289 @@
+import asyncio
+import random
+import time
+from contextlib import ExitStack
+from unittest.mock import AsyncMock, patch
+import fakeredis
+import httpx
+from backend.src.models.game import Game
+from backend.src.services.cache import LocalCache
+from backend.src.services.coownership import CoOwnershipStore, build_coownership_model, library_vector
+from backend.src.services.library import user_libraries
+from backend.src.services.redis import RedisService, redis_service
+from backend.src.utils.deadline import deadline_after
+from backend.src.utils.recommendations import (
+    ALGORITHM_VERSION, get_recommendations_async, iter_batch_recommendations, iter_recommendations
+)
+from backend.src.utils.scoring import ScoringEngine, ScoringWeights
+from backend.src.utils.tag_index import TagIndex
+
+TAGS = ["Single-player", "Multi-player", "Co-op", "RPG", "Action", "Indie", "Strategy", "Racing"]
+
+
+def _catalog(size: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [
+        Game(
+            steam_appid=appid,
+            name=f"Game {appid}",
+            categories=rng.sample(TAGS[:3], rng.randint(0, 2)),
+            genres=rng.sample(TAGS[3:], rng.randint(0, 2)),
+        )
+        for appid in range(1000, 1000 + size)
+    ]
+
+
+def test_tag_index_matches_linear_scan():
+    games = _catalog(300)
+    index = TagIndex()
+    index.set_candidates([game.steam_appid for game in games])
+    index.update_games(games)
+
+    preferences = {"Co-op", "Racing"}
+    owned = {games[0].steam_appid, games[5].steam_appid, 42}
+    expected = [
+        game.steam_appid for game in games
+        if game.steam_appid not in owned
+        and any(pref in game.categories or pref in game.genres for pref in preferences)
+    ][:25]
+
+    assert index.match(preferences, owned, limit=25) == expected
+
+
+def test_tag_index_incremental_update_and_snapshot():
+    games = _catalog(10)
+    index = TagIndex()
+    index.update_games(games)
+    index.set_candidates([game.steam_appid for game in reversed(games)])
+
+    changed = Game(steam_appid=games[3].steam_appid, name=games[3].name, genres=["Horror"])
+    index.update_game(changed)
+    assert index.match({"Horror"}, set(), limit=5) == [changed.steam_appid]
+
+    restored = TagIndex()
+    restored.load_from_snapshot(index.to_snapshot())
+    assert restored.candidates == index.candidates
+    for tag in TAGS + ["Horror"]:
+        assert restored.match({tag}, set(), limit=50) == index.match({tag}, set(), limit=50)
+
+
+def _pipeline_patches(games, library):
+    index = TagIndex()
+    index.loaded = True
+    by_id = {game.steam_appid: game for game in games}
+
+    async def details_many(appids, cached_only=False):
+        return [by_id.get(appid) for appid in appids]
+
+    fake = fakeredis.FakeAsyncRedis()
+    return [
+        patch.object(RedisService, "aclient", property(lambda self: fake)),
+        patch.object(redis_service, "local", LocalCache(0, {})),
+        patch("backend.src.utils.recommendations.tag_index", index),
+        patch("backend.src.utils.recommendations.scoring_engine", ScoringEngine(index)),
+        patch("backend.src.utils.recommendations.steam_service.get_user_games_async",
+              AsyncMock(return_value=library)),
+        patch("backend.src.utils.recommendations.steam_service.get_popular_games_async",
+              AsyncMock(return_value=[{"appid": game.steam_appid} for game in games[20:]])),
+        patch("backend.src.utils.recommendations.steam_service.get_game_details_many_async",
+              side_effect=details_many),
+    ]
+
+
+def test_pipeline_modes():
+    games = _catalog(200)
+    library = [
+        {"appid": game.steam_appid, "playtime_forever": 60 * (i + 1), "rtime_last_played": 1700000000 + i}
+        for i, game in enumerate(games[:20])
+    ] + [{"appid": games[30].steam_appid, "playtime_forever": 5}]
+
+    with ExitStack() as stack:
+        for p in _pipeline_patches(games, library):
+            stack.enter_context(p)
+        stack.enter_context(patch("backend.src.utils.recommendations.settings.RECOMMENDATION_CACHE_TTL", 0))
+        legacy, _ = asyncio.run(get_recommendations_async("1", mode="legacy"))
+        _, compare_metrics = asyncio.run(get_recommendations_async("1", mode="compare"))
+        scored, scored_metrics = asyncio.run(get_recommendations_async("1", mode="scored"))
+
+    assert compare_metrics.metrics["compare_equivalent"] is True
+    assert compare_metrics.metrics["compare_overlap"] == len(legacy)
+    assert 0 < len(scored) <= 25
+    assert games[30].steam_appid not in {game.steam_appid for game in scored}
+    assert {"fetch_user_games", "fetch_popular_games", "build_preferences", "fetch_candidates", "rank"} <= set(scored_metrics.stages)
+    scores = list(scored_metrics.metrics["scores"].values())
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_incremental_pipeline_events():
+    games = _catalog(200)
+    library = [
+        {"appid": game.steam_appid, "playtime_forever": 60 * (i + 1), "rtime_last_played": 1700000000 + i}
+        for i, game in enumerate(games[:20])
+    ]
+
+    async def collect():
+        return [event async for event in iter_recommendations("1", mode="scored")]
+
+    with ExitStack() as stack:
+        for p in _pipeline_patches(games, library):
+            stack.enter_context(p)
+        events = asyncio.run(collect())
+
+    kinds = [event["event"] for event in events]
+    assert kinds[:2] == ["library", "preferences"] and kinds[-1] == "result"
+    assert set(kinds[2:-1]) == {"match"}
+    assert len(events[0]["top_games"]) == 10
+    matched = {game.steam_appid for event in events[2:-1] for game in event["games"]}
+    owned = {game["appid"] for game in library}
+    assert matched and not matched & owned
+    assert {game.steam_appid for game in events[-1]["recommendations"]} <= matched
+
+
+def test_result_cache_is_keyed_by_inputs():
+    games = _catalog(200)
+    library = [
+        {"appid": game.steam_appid, "playtime_forever": 60 * (i + 1), "rtime_last_played": 1700000000 + i}
+        for i, game in enumerate(games[:20])
+    ]
+
+    async def run(mode="scored"):
+        recommended, metrics = await get_recommendations_async("1", mode=mode)
+        return [game.steam_appid for game in recommended], metrics.metrics
+
+    async def scenario():
+        first = await run()
+        repeat = await run()
+        # Обновление библиотеки из Steam переиндексирует её
+        changed = library + [{"appid": games[40].steam_appid, "playtime_forever": 30}]
+        await user_libraries.index_async("1", changed)
+        changed_library = await run()
+        with patch("backend.src.utils.recommendations.ALGORITHM_VERSION", ALGORITHM_VERSION + 1):
+            new_algorithm = await run()
+        # Новая модель совместного владения меняет ключ
+        with patch("backend.src.utils.recommendations.coownership_store.version", return_value="2.0"):
+            new_model = await run()
+        legacy = await run("legacy")
+        return first, repeat, changed_library, new_algorithm, new_model, legacy
+
+    with ExitStack() as stack:
+        for p in _pipeline_patches(games, library):
+            stack.enter_context(p)
+        first, repeat, changed_library, new_algorithm, new_model, legacy = asyncio.run(scenario())
+
+    assert first[1]["result_cache_hit"] is False
+    assert repeat[1]["result_cache_hit"] is True
+    assert repeat[0] == first[0] and repeat[1]["scores"] == first[1]["scores"]
+    assert changed_library[1]["result_cache_hit"] is False
+    assert games[40].steam_appid not in changed_library[0]
+    assert new_algorithm[1]["result_cache_hit"] is False
+    assert new_model[1]["result_cache_hit"] is False
+    assert legacy[1]["result_cache_hit"] is False
+
+
+def test_batch_matches_single_user_scoring():
+    games = _catalog(200)
+    libraries = {
+        str(user): [
+            {"appid": game.steam_appid, "playtime_forever": 60 * (i + user), "rtime_last_played": 1700000000 + i * user}
+            for i, game in enumerate(games[user * 3:user * 3 + 15])
+        ]
+        for user in (1, 2, 3)
+    }
+    libraries["empty"] = [{"appid": games[0].steam_appid, "playtime_forever": 0}]
+
+    async def user_games(steam_id, raise_errors=False):
+        if steam_id == "broken":
+            raise httpx.ConnectError("boom")
+        return libraries[steam_id]
+
+    async def collect():
+        return [result async for result in iter_batch_recommendations(["1", "broken", "2", "empty", "3", "1"])]
+
+    with ExitStack() as stack:
+        for p in _pipeline_patches(games, []):
+            stack.enter_context(p)
+        stack.enter_context(patch("backend.src.utils.recommendations.settings.RECOMMEND_BATCH_CHUNK_SIZE", 2))
+        stack.enter_context(patch(
+            "backend.src.utils.recommendations.steam_service.get_user_games_async", side_effect=user_games
+        ))
+        batch = asyncio.run(collect())
+        single = {steam_id: asyncio.run(get_recommendations_async(steam_id, mode="scored")) for steam_id in ("1", "2", "3")}
+
+    assert [(r.steam_id, r.status) for r in batch] == [
+        ("1", "ok"), ("broken", "error"), ("2", "ok"), ("empty", "empty"), ("3", "ok")
+    ]
+    assert "boom" in batch[1].error
+    for result in batch:
+        if result.status == "ok":
+            recommended, metrics = single[result.steam_id]
+            assert [game.steam_appid for game in result.recommendations] == [game.steam_appid for game in recommended]
+            assert {str(appid): score for appid, score in result.scores.items()} == metrics.metrics["scores"]
+
+
+def test_deadline_ranks_resolved_candidates_as_partial():
+    games = _catalog(200)
+    library = [
+        {"appid": game.steam_appid, "playtime_forever": 60 * (i + 1), "rtime_last_played": 1700000000 + i}
+        for i, game in enumerate(games[:20])
+    ]
+    by_id = {game.steam_appid: game for game in games}
+    fast_appids = {game.steam_appid for game in games[:60]}
+
+    async def slow_candidates(appids, cached_only=False):
+        # Библиотека и известные кандидаты отдаются сразу, остальные - дольше срока запроса
+        if not fast_appids.issuperset(appids):
+            await asyncio.sleep(5)
+        return [by_id.get(appid) for appid in appids]
+
+    with ExitStack() as stack:
+        patches = _pipeline_patches(games, library)
+        patches[-1] = patch("backend.src.utils.recommendations.steam_service.get_game_details_many_async",
+                            side_effect=slow_candidates)
+        entered = [stack.enter_context(p) for p in patches]
+        index = entered[2]
+        # Часть кандидатов уже известна индексу
+        index.update_games(games[20:60])
+        started = time.monotonic()
+        recommended, metrics = asyncio.run(get_recommendations_async("1", deadline=deadline_after(0.3)))
+        elapsed = time.monotonic() - started
+        cached = asyncio.run(redis_service.get_keys_by_pattern_async("recommendation_result:*"))
+
+    assert elapsed < 1
+    assert metrics.metrics["partial"] is True
+    assert recommended
+    assert {game.steam_appid for game in recommended} <= {game.steam_appid for game in games[20:60]}
+    assert cached == []
+
+
+def test_co_owned_games_join_scored_candidates(tmp_path):
+    games = _catalog(200)
+    library = [
+        {"appid": game.steam_appid, "playtime_forever": 60 * (i + 1), "rtime_last_played": 1700000000 + i}
+        for i, game in enumerate(games[:20])
+    ]
+    # Игры вне списка популярных, которые часто есть вместе с играми пользователя
+    outside = [game for game in games[150:] if game.categories or game.genres][:3]
+    libraries = [
+        library_vector([{"appid": games[i].steam_appid, "playtime_forever": 600},
+                        {"appid": game.steam_appid, "playtime_forever": 600}], 10)
+        for i in range(10, 20) for game in outside
+    ]
+    path = str(tmp_path / "coownership.bin")
+    build_coownership_model(libraries, path, top_k=10)
+
+    with ExitStack() as stack:
+        for p in _pipeline_patches(games, library):
+            stack.enter_context(p)
+        stack.enter_context(patch("backend.src.utils.recommendations.steam_service.get_popular_games_async",
+                                  AsyncMock(return_value=[{"appid": game.steam_appid} for game in games[20:150]])))
+        stack.enter_context(patch("backend.src.utils.recommendations.coownership_store", CoOwnershipStore(path)))
+        weights = ScoringWeights(coownership_weight=10.0)
+        recommended, metrics = asyncio.run(get_recommendations_async("1", mode="scored", weights=weights))
+
+    appids = [game.steam_appid for game in recommended]
+    assert metrics.metrics["co_owned_candidates"] == len(outside)
+    preferences = {tag for game in games[10:20] for tag in game.categories + game.genres}
+    shared = [game.steam_appid for game in outside if preferences.intersection(game.categories + game.genres)]
+    assert appids[0] == shared[0] and set(shared) <= set(appids)
+    # Без общих тегов совместное владение не делает игру кандидатом
+    assert not {game.steam_appid for game in outside if game.steam_appid not in shared} & set(appids)
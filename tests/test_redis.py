@@ -0,0 +1,34 @@
+import asyncio
+import fakeredis
+from unittest.mock import patch
+from backend.src.services.redis import RedisService, redis_service
+
+
+def _with_fake_redis(coro_factory):
+    fake = fakeredis.FakeAsyncRedis()
+    with patch.object(RedisService, "aclient", property(lambda self: fake)):
+        return asyncio.run(coro_factory(fake))
+
+
+def test_metrics_index_returns_newest_first_and_trims():
+    async def scenario(fake):
+        with patch("backend.src.services.redis.settings.METRICS_MAX_PER_USER", 3):
+            for i in range(5):
+                await redis_service.add_metrics_async("42", 1700000000.0 + i, {"run": i})
+        recent = await redis_service.get_recent_metrics_async("42", limit=10)
+        return recent, await fake.zcard("metrics_index:42")
+
+    recent, indexed = _with_fake_redis(scenario)
+    assert [m["run"] for m in recent] == [4, 3, 2]
+    assert indexed == 3
+
+
+def test_keys_by_pattern_uses_scan():
+    async def scenario(fake):
+        await fake.set("metrics:1:1", "{}")
+        await fake.set("metrics:1:2", "{}")
+        await fake.set("game_details:1", "{}")
+        with patch.object(fake, "keys", side_effect=AssertionError("KEYS must not be used")):
+            return await redis_service.get_keys_by_pattern_async("metrics:1:*")
+
+    assert sorted(_with_fake_redis(scenario)) == [b"metrics:1:1", b"metrics:1:2"]
@@ -0,0 +1,176 @@
+import asyncio
+import httpx
+from unittest.mock import patch, AsyncMock
+from backend.src.services.cache import CacheEntry
+from backend.src.services.steam import SteamService, SteamUnavailable
+from backend.src.utils.resilience import (
+    AdmissionController, AIMDLimiter, CircuitBreaker, CLOSED, HALF_OPEN, OPEN, Overloaded, parse_retry_after
+)
+
+
+def _owned_games(games):
+    return httpx.Response(200, json={"response": {"games": games}})
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_aimd_limiter_backs_off_and_recovers():
+    limiter = AIMDLimiter(8, min_limit=1, max_limit=10, cooldown=0)
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.on_success()
+    assert 4.9 < limiter.limit < 5.1
+
+    async def scenario():
+        limiter.limit = 1
+        order = []
+
+        async def worker(name):
+            async with limiter:
+                order.append(name)
+                await asyncio.sleep(0.01)
+                order.append(name)
+
+        await asyncio.gather(worker("a"), worker("b"))
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "a", "b", "b"]
+    assert limiter.in_flight == 0
+
+
+def test_admission_queues_then_rejects():
+    admission = AdmissionController(1, max_queue=1, queue_timeout=1.0)
+
+    async def scenario():
+        await admission.acquire()
+        # Второй ждёт в очереди, третьему места нет
+        queued = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        try:
+            await admission.acquire()
+        except Overloaded as e:
+            rejected = e.retry_after
+        admission.release(0.5)
+        waited = await queued
+        # Слот так и не освободился за срок - тоже отказ
+        try:
+            await admission.acquire(timeout=0.01)
+        except Overloaded:
+            timed_out = True
+        admission.release(0.5)
+        return rejected, waited, timed_out
+
+    rejected, waited, timed_out = asyncio.run(scenario())
+    assert rejected >= 1 and waited >= 0 and timed_out
+    assert admission.slots.in_flight == 0
+    assert admission.service_time < 1.0
+
+
+def test_circuit_breaker_half_open_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state in (OPEN, HALF_OPEN)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert not breaker.allow()
+    assert breaker.retry_in() > 0
+
+
+@patch("backend.src.services.steam.asyncio.sleep", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_cached_entry_async", new_callable=AsyncMock)
+def test_user_games_retry_honors_retry_after(mock_get_entry, mock_cache, mock_sleep):
+    mock_get_entry.return_value = None
+    responses = iter([
+        httpx.Response(429, headers={"Retry-After": "2"}),
+        httpx.Response(503),
+        _owned_games([{"appid": 1}]),
+    ])
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: next(responses)))
+    service = SteamService()
+
+    with patch("backend.src.services.steam.get_http_client", return_value=client):
+        games = asyncio.run(service.get_user_games_async("1"))
+
+    assert games == [{"appid": 1}]
+    delays = [call.args[0] for call in mock_sleep.await_args_list]
+    assert delays[0] == 2.0 and len(delays) == 2
+    assert service.concurrency["GetOwnedGames"].limit < 16
+    assert service.breakers["GetOwnedGames"].state == CLOSED
+
+
+@patch("backend.src.services.steam.asyncio.sleep", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_cached_entry_async", new_callable=AsyncMock)
+def test_long_retry_after_is_not_retried_early(mock_get_entry, mock_cache, mock_sleep):
+    mock_get_entry.return_value = None
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        return httpx.Response(429, headers={"Retry-After": "60"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    service = SteamService()
+
+    async def scenario():
+        games = await service.get_user_games_async("1")
+        try:
+            await service._fetch_user_games("2")
+        except SteamUnavailable:
+            return games, "unavailable"
+        return games, None
+
+    with patch("backend.src.services.steam.get_http_client", return_value=client):
+        games, fetched = asyncio.run(scenario())
+
+    assert games == [] and fetched == "unavailable"
+    # Ни одного повтора раньше, чем просит Steam
+    assert len(requested) == 2
+    mock_sleep.assert_not_awaited()
+
+
+@patch("backend.src.services.steam.asyncio.sleep", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_cached_entry_async", new_callable=AsyncMock)
+def test_open_circuit_fails_fast_and_serves_stale(mock_get_entry, mock_cache, mock_sleep):
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        return httpx.Response(500)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    service = SteamService()
+    service.breakers["GetOwnedGames"] = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    async def scenario():
+        mock_get_entry.return_value = None
+        results = [await service.get_user_games_async(str(i)) for i in range(3)]
+        mock_get_entry.return_value = CacheEntry([{"appid": 7}], True)
+        results.append(await service.get_user_games_async("4"))
+        try:
+            await service._fetch_user_games("5")
+        except SteamUnavailable:
+            results.append("unavailable")
+        return results
+
+    with patch("backend.src.services.steam.get_http_client", return_value=client):
+        results = asyncio.run(scenario())
+
+    assert results == [[], [], [], [{"appid": 7}], "unavailable"]
+    # Две неудачные загрузки по три попытки, дальше Steam не вызывается
+    assert len(requested) == 6
+    assert service.breakers["GetOwnedGames"].state == OPEN
@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from backend.src.services.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_fetch():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"appid": 730}
+
+    async def main():
+        return await asyncio.gather(*(flights.do("game_details:730", fetch) for _ in range(20)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result == {"appid": 730} for result in results)
+    assert flights.inflight() == 0
+
+
+def test_threads_with_own_loops_share_one_fetch():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return ["popular"]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(
+            lambda _: asyncio.run(flights.do("popular_games", fetch)), range(4)
+        ))
+
+    assert len(calls) == 1
+    assert results == [["popular"]] * 4
+
+
+def test_cancelled_waiter_does_not_break_other_callers():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "details"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do("game_details:730", fetch))
+        await asyncio.sleep(0)
+        cancelled = asyncio.ensure_future(flights.do("game_details:730", fetch))
+        waiter = asyncio.ensure_future(flights.do("game_details:730", fetch))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        results = await asyncio.gather(leader, waiter, cancelled, return_exceptions=True)
+        return results
+
+    leader, waiter, cancelled = asyncio.run(main())
+    assert leader == "details" and waiter == "details"
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert flights.inflight() == 0
+
+
+def test_leader_timeout_does_not_restart_shared_fetch():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "details"
+
+    async def main():
+        # Срок лидера истекает раньше загрузки: ожидающий получает её результат
+        leader = asyncio.ensure_future(asyncio.wait_for(flights.do("game_details:730", fetch), 0.01))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.do("game_details:730", fetch))
+        return await asyncio.gather(leader, waiter, return_exceptions=True)
+
+    leader, waiter = asyncio.run(main())
+    assert isinstance(leader, asyncio.TimeoutError)
+    assert waiter == "details"
+    assert len(calls) == 1
+    assert flights.inflight() == 0
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import httpx
+from unittest.mock import patch, AsyncMock
+from backend.src.models.game import GameRecord
+from backend.src.services.cache import CacheEntry
+from backend.src.services.refresh import refresher
+from backend.src.services.steam import steam_service
+from backend.src.utils.deadline import deadline_after, set_deadline
+from backend.src.utils.resilience import CLOSED
+from backend.src.utils.fragments import game_fragment
+
+TEST_APP_ID = 730
+
+
+def _appdetails_handler(request: httpx.Request) -> httpx.Response:
+    appid = request.url.params["appids"]
+    return httpx.Response(200, json={
+        appid: {
+            "success": True,
+            "data": {
+                "name": "Mocked Game",
+                "categories": [{"description": "Single-player"}, {"description": "Unknown"}],
+                "genres": [{"description": "RPG"}],
+                "recommendations": {"total": 42},
+                "release_date": {"date": "21 Aug, 2012"}
+            }
+        }
+    })
+
+
+@patch("backend.src.services.steam.asyncio.sleep", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_cached_entry_async", new_callable=AsyncMock)
+def test_sync_facade_game_details(mock_get_cached, mock_cache, mock_sleep):
+    mock_get_cached.return_value = None
+    client = httpx.AsyncClient(transport=httpx.MockTransport(_appdetails_handler))
+
+    with patch("backend.src.services.steam.get_http_client", return_value=client):
+        game = steam_service.get_game_details(TEST_APP_ID)
+
+    assert game.steam_appid == TEST_APP_ID
+    assert game.categories == ["Single-player"]
+    assert game.genres == ["RPG"]
+    assert game.release_year == 2012
+    mock_cache.assert_awaited_once()
+    # Рядом с деталями в кэше лежит готовый фрагмент ответа
+    cached = mock_cache.await_args.args[1]
+    assert json.loads(cached["fragment"]) == {
+        "name": "Mocked Game", "appid": TEST_APP_ID, "categories": ["Single-player"], "genres": ["RPG"],
+        "recommendations": 42, "release_year": 2012, "store_url": f"https://store.steampowered.com/app/{TEST_APP_ID}"
+    }
+    assert game_fragment(GameRecord.from_dict(cached)) == cached["fragment"].encode()
+    assert json.loads(cached["detail_fragment"]) == game.dict()
+    assert GameRecord.from_dict(cached).detail_fragment == cached["detail_fragment"].encode()
+
+
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_many_cached_entries_async", new_callable=AsyncMock)
+def test_game_details_many_keeps_order(mock_get_many, mock_cache):
+    cached_game = {"steam_appid": 10, "name": "Cached Game", "categories": [], "genres": ["RPG"]}
+    mock_get_many.return_value = [None, CacheEntry(cached_game, False)]
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(int(request.url.params["appids"]))
+        return _appdetails_handler(request)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    with patch("backend.src.services.steam.get_http_client", return_value=client):
+        games = steam_service.get_game_details_many([TEST_APP_ID, 10, TEST_APP_ID])
+
+    mock_get_many.assert_awaited_once_with([f"game_details:{TEST_APP_ID}", "game_details:10"])
+    assert requested == [TEST_APP_ID]
+    assert [g.name for g in games] == ["Mocked Game", "Cached Game", "Mocked Game"]
+
+
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_cached_entry_async", new_callable=AsyncMock)
+def test_stale_popular_games_refreshed_in_background(mock_get_entry, mock_cache):
+    mock_get_entry.return_value = CacheEntry([{"appid": 1}], True)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, json={"response": {"ranks": [{"appid": 2}]}})
+    ))
+
+    async def scenario():
+        with patch("backend.src.services.steam.get_http_client", return_value=client):
+            games = await steam_service.get_popular_games_async()
+            await refresher.drain()
+        return games
+
+    before = dict(refresher.stats)
+    assert asyncio.run(scenario()) == [{"appid": 1}]
+    assert refresher.stats["served_stale"] == before["served_stale"] + 1
+    assert refresher.stats["refresh_succeeded"] == before["refresh_succeeded"] + 1
+    assert mock_cache.await_args.args[1] == [{"appid": 2}]
+
+
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_cached_entry_async", new_callable=AsyncMock)
+def test_short_request_deadline_does_not_trip_breaker_or_cut_shared_fetch(mock_get_entry, mock_cache):
+    mock_get_entry.return_value = None
+
+    async def slow_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.1)
+        return _appdetails_handler(request)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(slow_handler))
+
+    async def impatient():
+        set_deadline(deadline_after(0.01))
+        return await steam_service.get_game_details_async(TEST_APP_ID)
+
+    async def scenario():
+        with patch("backend.src.services.steam.get_http_client", return_value=client):
+            patient = asyncio.ensure_future(steam_service.get_game_details_async(TEST_APP_ID))
+            await asyncio.sleep(0)
+            short = await asyncio.gather(*(impatient() for _ in range(6)))
+            return short, await patient
+
+    short, patient = asyncio.run(scenario())
+    # Короткий срок - забота самого запроса: общая загрузка доходит до конца
+    assert short == [None] * 6
+    assert patient is not None and patient.steam_appid == TEST_APP_ID
+    assert steam_service.breakers["appdetails"].state == CLOSED
+
+
+@patch("backend.src.services.steam.refresher.schedule")
+@patch("backend.src.services.steam.user_libraries.index_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.mark_library_changed_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+def test_library_changes_logged_only_for_coownership_model(mock_cache, mock_mark, mock_index, mock_schedule):
+    games = [{"appid": 10, "playtime_forever": 60}]
+
+    def owned_games(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"response": {"games": games}})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(owned_games))
+    with patch("backend.src.services.steam.get_http_client", return_value=client):
+        with patch("backend.src.services.steam.settings.COOWNERSHIP_MODEL_PATH", ""):
+            assert asyncio.run(steam_service._fetch_user_games("1")) == games
+        mock_mark.assert_not_awaited()
+        with patch("backend.src.services.steam.settings.COOWNERSHIP_MODEL_PATH", "/tmp/coownership.bin"):
+            asyncio.run(steam_service._fetch_user_games("1"))
+    assert mock_mark.await_args.args[0] == "1"
+
+
+@patch("backend.src.services.steam.asyncio.sleep", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.cache_data_async", new_callable=AsyncMock)
+@patch("backend.src.services.steam.redis_service.get_cached_entry_async", new_callable=AsyncMock)
+def test_truncated_json_is_an_api_error(mock_get_entry, mock_cache, mock_sleep):
+    mock_get_entry.return_value = None
+    client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, content=b'{"response": {"games": [')
+    ))
+
+    with patch("backend.src.services.steam.get_http_client", return_value=client), \
+            patch("backend.src.services.steam.record_steam_error") as errors:
+        games = asyncio.run(steam_service.get_user_games_async("truncated"))
+        game = asyncio.run(steam_service.get_game_details_async(987654))
+
+    assert games == [] and game is None
+    assert [call.args[0] for call in errors.call_args_list] == ["GetOwnedGames", "appdetails"]
+    mock_cache.assert_not_awaited()